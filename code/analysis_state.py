@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+
+STATE_FILE = 'analysis_state.json'
+# Files of an agent folder the analysis of a task reads
+AGENT_INPUTS = {
+    'simulated_judges': ['annotations.json'],
+    'simulated_tutors': ['pytest_report.json', 'pytest_coverage_report.json', 'annotations.json'],
+    'simulated_students': ['pytest_report.json'],
+}
+
+def file_stat(path):
+    """[mtime_ns, size] of a file, or None when it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def task_fingerprint(task_path):
+    """{relative path: [mtime_ns, size]} of every input of the analysis of a task: the report of the expert
+    solution and the annotations and reports of every judge, tutor and student (None for missing files)."""
+    fingerprint = {'pytest_report.json': file_stat(os.path.join(task_path, 'pytest_report.json'))}
+    for folder, names in AGENT_INPUTS.items():
+        agents_path = os.path.join(task_path, folder)
+        if not os.path.isdir(agents_path):
+            continue
+        for agent in sorted(os.listdir(agents_path)):
+            for name in names:
+                fingerprint[f'{folder}/{agent}/{name}'] = file_stat(os.path.join(agents_path, agent, name))
+    return fingerprint
+
+def load_analysis_state(query_path):
+    """{'config': ..., 'tasks': {task: {'inputs', 'row', 'test_matrix'}}, 'distribution': ...} recorded by the
+    last analysis of the query, or an empty state."""
+    try:
+        with open(os.path.join(query_path, STATE_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_analysis_state(query_path, state):
+    path = os.path.join(query_path, STATE_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
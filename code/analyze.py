@@ -3,18 +3,15 @@ import json
 import argparse
 from datetime import datetime
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-# make all the fonts bigger
-plt.rcParams.update({'font.size': 16})
 from .utils import check_passed_all_tests, get_coverage, get_perc_passed_tests
+from .outcome import load_outcome
+from .analysis_state import task_fingerprint, file_stat, load_analysis_state, save_analysis_state
 from scipy.stats import norm
 import numpy as np
 from scipy.stats import truncnorm
 from scipy.stats import kendalltau
 # set all seeds
 import random
-from matplotlib.colors import ListedColormap, BoundaryNorm
 from sklearn.metrics import cohen_kappa_score
 np.random.seed(200)
 from scipy.stats import ttest_ind
@@ -30,18 +27,59 @@ TUTOR_TESTSUITE_PASS_THRESHOLD = model_configuration['tutor_testsuite']['pass_th
 TUTOR_TESTSUITE_COVERAGE_THRESHOLD = model_configuration['tutor_testsuite']['coverage_threshold']
 STU_PASS_THRESHOLD = model_configuration['student']['pass_threshold']
 
-# set font size
-plt.rcParams.update({'font.size': 50})
-# set latex font
-plt.rc('text', usetex=True)
-
 # Get the directory of the current script
 script_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
 ON_HEROKU = eval(os.environ.get("ON_HEROKU"))
 
-def analyze_results(trial_path):
-    data_df = pd.DataFrame(columns=['task', 'total_num_tc', 'gen_consistency', 'LLMJudge', 'Q-Testsuite', 'Q-Context', 'total_num_stu', 'num_passed_stu', 'passed_stus'])
+RESULTS_COLUMNS = ['task', 'total_num_tc', 'gen_consistency', 'LLMJudge', 'Q-Testsuite', 'Q-Context', 'total_num_stu', 'num_passed_stu', 'passed_stus']
+
+def write_if_changed(path, content):
+    # leaves an unchanged file (and its mtime) alone, so render_matrices can skip its figure
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return
+    with open(path, 'w') as f:
+        f.write(content)
+
+def build_test_matrix(matrix_rows, num_columns):
+    """Test matrix of a task from (label, outcomes, width) rows, filled in one preallocated int8 array.
+
+    A row only spans the first `width` test cases (the ones known when it was added); its remaining
+    cells are missing, and cells within the width without an outcome are -1.
+    """
+    if num_columns is None:
+        return None
+    matrix = np.full((len(matrix_rows), num_columns), -1, dtype=np.int8)
+    missing = np.zeros((len(matrix_rows), num_columns), dtype=bool)
+    for i, (_, outcomes, width) in enumerate(matrix_rows):
+        n = min(len(outcomes), width)
+        matrix[i, :n] = np.frombuffer(outcomes, dtype=np.int8)[:n]
+        missing[i, width:] = True
+    columns = [str(i) for i in range(num_columns)]
+    matrix_df = pd.DataFrame(matrix, columns=columns).astype('Int8').mask(missing)
+    matrix_df.insert(0, 'Simulated student', [label for label, _, _ in matrix_rows])
+    return matrix_df
+
+def analysis_config():
+    # a change of the thresholds makes every recorded row stale
+    return {'tutor_testsuite_pass_threshold': TUTOR_TESTSUITE_PASS_THRESHOLD, 'tutor_testsuite_coverage_threshold': TUTOR_TESTSUITE_COVERAGE_THRESHOLD}
+
+def is_up_to_date(task_state, inputs, task_path):
+    return (task_state is not None and task_state['inputs'] == inputs
+            and task_state['test_matrix'] == file_stat(os.path.join(task_path, 'test_matrix.csv')))
+
+def analyze_results(trial_path, incremental=False):
+    """Analyze every task of a query into results.csv.
+
+    The inputs of every task are recorded in analysis_state.json; with incremental, a task whose inputs and
+    test_matrix.csv are unchanged since then keeps its recorded row instead of being analyzed again.
+    """
+    state = load_analysis_state(trial_path)
+    task_states = state.get('tasks', {}) if incremental and state.get('config') == analysis_config() else {}
+    new_task_states = {}
+    results_rows = []
 
     tasks = [folder for folder in os.listdir(trial_path) if os.path.isdir(os.path.join(trial_path, folder))]
     # sort by number
@@ -49,8 +87,16 @@ def analyze_results(trial_path):
     for task in tasks:
         if not os.path.isdir(os.path.join(trial_path, task)):
             continue
-        print(f'\n=== Analyzing task {task}')
         task_path = os.path.join(trial_path, task)
+        inputs = task_fingerprint(task_path)
+        if is_up_to_date(task_states.get(task), inputs, task_path):
+            print(f'\n=== Task {task} is unchanged')
+            new_task_states[task] = task_states[task]
+            if task_states[task]['row'] is not None:
+                results_rows.append(task_states[task]['row'])
+            continue
+        print(f'\n=== Analyzing task {task}')
+        new_task_states[task] = {'inputs': inputs, 'row': None}
         # load pytest_report.json
         
         try:
@@ -68,34 +114,28 @@ def analyze_results(trial_path):
                 else:
                     judge_q_overall = 0
 
-            with open(os.path.join(task_path, 'pytest_report.json'), 'r') as f:
-                sol_pytest_report = json.load(f)
-            # load 
-            tests = sol_pytest_report['tests']
+            sol_outcome = load_outcome(os.path.join(task_path, 'pytest_report.json'))
+            if sol_outcome is None:
+                raise FileNotFoundError(f'No readable pytest_report.json in {task_path}')
+            tests = sol_outcome.outcomes
             num_passed_stu = 0
             total_num_stu = 0
             sol_num_passed_tc = 0
             simta_q_context = 0
             simta_q_concepts = 0
             passed_stus = []
-            matrix_df = None
+            matrix_rows = []
+            num_columns = None
             total_num_tc = 0
             # test_coverage = 0
             gen_consistency = 0
             print(f'Number of test cases in the solution: {len(tests)}')
             if len(tests) > 0:
-                matrix_df = pd.DataFrame(columns=['Simulated student'] + [str(i) for i in range(len(tests))])
-                total_num_tc = sol_pytest_report['summary']['total']
+                num_columns = len(tests)
+                total_num_tc = sol_outcome.summary['total']
                 
-                sol_outcomes = [-1 for i in range(len(tests))]
-                for i in range(len(tests)):
-                    if 'call' in tests[i]:
-                        if tests[i]['call']['outcome'] == 'passed':
-                            sol_outcomes[i] = 1
-                        elif tests[i]['call']['outcome'] == 'failed':
-                            sol_outcomes[i] = 0
-                matrix_df = pd.concat([matrix_df, pd.DataFrame([['Expert'] + sol_outcomes], columns=['Simulated student'] + [str(i) for i in range(len(tests))])])
-                sol_num_passed_tc = sol_outcomes.count(1)
+                matrix_rows.append(('Expert', tests, len(tests)))
+                sol_num_passed_tc = sol_outcome.num_passed
                 gen_consistency = 1 if sol_num_passed_tc==total_num_tc else 0
 
             
@@ -146,78 +186,55 @@ def analyze_results(trial_path):
                 for stu in all_stus:
                     stu_path = os.path.join(stus_path, stu)
                     print("stu_path=", stu_path)
-                    if not os.path.exists(os.path.join(stu_path, 'pytest_report.json')):
+                    stu_outcome = load_outcome(os.path.join(stu_path, 'pytest_report.json'))
+                    if stu_outcome is None:
                         continue
-                    with open(os.path.join(stu_path, 'pytest_report.json'), 'r') as f:
-                        stu_pytest_report = json.load(f)
-                    stu_tests = stu_pytest_report['tests']
+                    stu_tests = stu_outcome.outcomes
                     print("len(stu_tests)=", len(stu_tests))
                     if len(stu_tests) > 0:
                         total_num_tc = max(total_num_tc, len(stu_tests))
-                    if matrix_df is None and len(stu_tests) > 0:
+                    if num_columns is None and len(stu_tests) > 0:
                         total_num_tc = len(stu_tests)
-                        matrix_df = pd.DataFrame(columns=['Simulated student'] + [str(i) for i in range(len(stu_tests))])
                         print(f'Number of test cases in the student: {len(stu_tests)}')
                     
-                    stu_outcomes = [-1 for i in range(total_num_tc)]
-                    print("stu_outcomes=", stu_outcomes)
-
-                    for i in range(len(stu_tests)):
-                        try:
-                            if stu_tests[i]['call']['outcome'] == 'passed':
-                                stu_outcomes[i] = 1
-                            elif stu_tests[i]['call']['outcome'] == 'failed':
-                                stu_outcomes[i] = 0
-                        except:
-                            stu_outcomes[i] = -1
-
-                    print("stu_outcomes=", stu_outcomes)
-                    matrix_df = pd.concat([matrix_df, pd.DataFrame([['SimSTU ' + stu.split("_")[-1]] + stu_outcomes], columns=['Simulated student'] + [str(i) for i in range(total_num_tc)])])
-
-                    if 'passed' in stu_pytest_report['summary']:
-                        if check_passed_all_tests(os.path.join(stu_path, 'pytest_report.json')): 
+                    print("stu_outcomes=", stu_tests.tolist())
+                    # the row spans every test case known so far, and widens the matrix if it has more
+                    matrix_rows.append(('SimSTU ' + stu.split("_")[-1], stu_tests, total_num_tc))
+                    num_columns = max(num_columns or 0, total_num_tc)
+
+                    if 'passed' in stu_outcome.summary:
+                        if stu_outcome.passed_all(): 
                         # and stu_coverage>=STU_COVERAGE_THRESHOLD:
                             num_passed_stu += 1
                             passed_stus.append(stu)
 
-            data_df = pd.concat([data_df, pd.DataFrame([[task, total_num_tc, gen_consistency, judge_q_overall, q_testsuite, simta_q_context, total_num_stu, num_passed_stu, passed_stus]], columns=['task', 'total_num_tc', 'gen_consistency', 'LLMJudge',  'Q-Testsuite', 'Q-Context', 'total_num_stu', 'num_passed_stu', 'passed_stus'])])
-            matrix_df.to_csv(os.path.join(task_path, 'test_matrix.csv'), index=False)
-
-            try:
-                print("matrix_df=", matrix_df)
-                matrix_df.set_index('Simulated student', inplace=True)
-                matrix_df = matrix_df[matrix_df.columns].astype(float)
-
-                if matrix_df.empty:
-                    continue
-                
-                # Define the colormap for the values
-                colors = ListedColormap(['grey', 'orangered', 'dodgerblue'])
-
-                # Define boundaries for each value
-                bounds = [-1.5, -0.5, 0.5, 1.5]  # Boundaries between each value (-1, 0, 1)
-                norm = BoundaryNorm(bounds, colors.N)  # Normalizer
-
-                ax = sns.heatmap(matrix_df, cmap=colors, norm=norm, cbar=False, square=True,
-                 linewidths=2, linecolor='white', xticklabels=True, yticklabels=True,
-                 vmin=-1, vmax=1)
-                plt.tick_params(left=False, bottom=False)
-                ax.set_aspect("equal")
-                plt.xlabel('Generated test cases')
-                plt.ylabel('')                
-                plt.tick_params(axis='both', which='major', labelsize=10, labelbottom = False, bottom=False, top = True, labeltop=True)
-                ax.tick_params(length=0)
-                plt.tight_layout()
-                plt.savefig(os.path.join(task_path, 'test_matrix.pdf'))
-            except Exception as e:
-                print(e)
+            results_rows.append([task, total_num_tc, gen_consistency, judge_q_overall, q_testsuite, simta_q_context, total_num_stu, num_passed_stu, passed_stus])
+            new_task_states[task]['row'] = results_rows[-1]
+            matrix_df = build_test_matrix(matrix_rows, num_columns)
+            write_if_changed(os.path.join(task_path, 'test_matrix.csv'), matrix_df.to_csv(index=False))
         except Exception as e:
             print(e)
+        new_task_states[task]['test_matrix'] = file_stat(os.path.join(task_path, 'test_matrix.csv'))
+    data_df = pd.DataFrame(results_rows, columns=RESULTS_COLUMNS)
     print(data_df)
     print('data_df', data_df)
-    data_df.to_csv(os.path.join(trial_path, 'results.csv'), index=False)
+    write_if_changed(os.path.join(trial_path, 'results.csv'), data_df.to_csv(index=False))
+    state.update(config=analysis_config(), tasks=new_task_states)
+    save_analysis_state(trial_path, state)
     return data_df
 
-
-
-
+if __name__ == '__main__':
+    from .run_test import compute_simulated_distribution
+
+    parser = argparse.ArgumentParser(description='Analyze the queries of an output tree again')
+    parser.add_argument('output_path', type=str, nargs='?', default='outputs')
+    parser.add_argument('--num_tasks_per_pair', type=int, default=10)
+    parser.add_argument('--incremental', action='store_true', help='only analyze the tasks whose inputs changed since the last analysis')
+
+    #example command: python -m code.analyze outputs --num_tasks_per_pair 10 --incremental
+    args = parser.parse_args()
+    queries = sorted(folder for folder in os.listdir(args.output_path) if os.path.isdir(os.path.join(args.output_path, folder)))
+    for query in queries:
+        query_path = os.path.join(args.output_path, query)
+        analyze_results(query_path, incremental=args.incremental)
+        compute_simulated_distribution(query_path, args.num_tasks_per_pair, incremental=args.incremental)
@@ -0,0 +1,360 @@
+import os
+import json
+import queue
+import sqlite3
+import argparse
+import threading
+
+from .outcome import TestOutcome
+
+# Rows committed per write transaction, and how long the writer waits to fill a batch
+BATCH_SIZE = 2000
+FLUSH_INTERVAL = 0.5
+
+EXPERT = 'expert'
+ROLE_FOLDERS = {'simulated_tutors': 'tutor', 'simulated_judges': 'judge', 'simulated_students': 'student'}
+ROLE_FOLDER = {role: folder for folder, role in ROLE_FOLDERS.items()}
+
+# Files of the output tree stored as columns; every other file is kept as is in the files table
+QUERY_FILES = {
+    'theme.txt': 'theme',
+    'programming_concepts.txt': 'programming_concepts',
+    'prompt.txt': 'prompt',
+    'responses.txt': 'responses',
+    'token_count.json': 'token_count',
+    'passed_tasks_for_each_technique.json': 'passed_tasks',
+}
+TASK_FILES = {
+    'task_description.txt': 'task_description',
+    'solution_program.py': 'solution_program',
+    'test_suite.py': 'test_suite',
+    'token_count.json': 'token_count',
+}
+AGENT_FILES = {
+    'prompt.txt': 'prompt',
+    'annotations.json': 'annotations',
+}
+# program written by each agent role
+PROGRAM_FILES = {'tutor': 'program.py', 'student': 'solution_program.py'}
+REPORT_FILE = 'pytest_report.json'
+# test output of the expert solution, in the task folder, and of tutors and students
+RESULTS_FILES = {EXPERT: 'test_solution_results.txt', 'tutor': 'test_results.txt', 'student': 'test_results.txt'}
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS queries (
+        query TEXT PRIMARY KEY,
+        theme TEXT, programming_concepts TEXT, prompt TEXT, responses TEXT, token_count TEXT, passed_tasks TEXT)''',
+    # passed_tasks_for_each_technique.json split by number of tasks N, for lookups of a single N
+    '''CREATE TABLE IF NOT EXISTS technique_passes (
+        n INTEGER NOT NULL, query TEXT NOT NULL, passed_tasks TEXT NOT NULL,
+        PRIMARY KEY (n, query))''',
+    '''CREATE TABLE IF NOT EXISTS tasks (
+        query TEXT NOT NULL, task TEXT NOT NULL,
+        task_description TEXT, solution_program TEXT, test_suite TEXT, token_count TEXT,
+        PRIMARY KEY (query, task))''',
+    '''CREATE TABLE IF NOT EXISTS agent_responses (
+        query TEXT NOT NULL, task TEXT NOT NULL, role TEXT NOT NULL, agent TEXT NOT NULL,
+        prompt TEXT, annotations TEXT, program TEXT,
+        PRIMARY KEY (query, task, role, agent))''',
+    '''CREATE TABLE IF NOT EXISTS test_runs (
+        query TEXT NOT NULL, task TEXT NOT NULL, role TEXT NOT NULL, agent TEXT NOT NULL,
+        total INTEGER, passed INTEGER, passed_all INTEGER, report TEXT, test_results TEXT,
+        PRIMARY KEY (query, task, role, agent))''',
+    'CREATE INDEX IF NOT EXISTS test_runs_role ON test_runs (role, passed_all)',
+    '''CREATE TABLE IF NOT EXISTS test_outcomes (
+        query TEXT NOT NULL, task TEXT NOT NULL, role TEXT NOT NULL, agent TEXT NOT NULL, position INTEGER NOT NULL,
+        nodeid TEXT NOT NULL, outcome INTEGER NOT NULL, message TEXT,
+        PRIMARY KEY (query, task, role, agent, position))''',
+    '''CREATE TABLE IF NOT EXISTS files (
+        query TEXT NOT NULL, path TEXT NOT NULL, content BLOB NOT NULL,
+        PRIMARY KEY (query, path))''',
+]
+QUERY_TABLES = ['queries', 'technique_passes', 'tasks', 'agent_responses', 'test_runs', 'test_outcomes', 'files']
+
+def insert(table, row):
+    columns = list(row)
+    return (f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+            [row[column] for column in columns])
+
+def read_text(path):
+    """Content of a text file, or None when it is not valid UTF-8 (it is then kept as bytes)."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+def test_run_rows(query, task, role, agent, report_text, test_results):
+    run = {'query': query, 'task': task, 'role': role, 'agent': agent, 'total': None, 'passed': None,
+           'passed_all': None, 'report': report_text, 'test_results': test_results}
+    statements = []
+    if report_text is not None:
+        try:
+            outcome = TestOutcome.from_report(json.loads(report_text))
+        except (ValueError, KeyError, TypeError):
+            outcome = None
+        if outcome is not None:
+            run.update(total=outcome.summary.get('total'), passed=outcome.num_passed, passed_all=int(outcome.passed_all()))
+            for position, (nodeid, code, message) in enumerate(zip(outcome.nodeids, outcome.outcomes, outcome.messages)):
+                statements.append(insert('test_outcomes', {'query': query, 'task': task, 'role': role, 'agent': agent,
+                                                           'position': position, 'nodeid': nodeid, 'outcome': code, 'message': message}))
+    return [insert('test_runs', run)] + statements
+
+def technique_pass_rows(query, passed_tasks):
+    try:
+        passed_tasks = json.loads(passed_tasks)
+    except ValueError:
+        return []
+    return [insert('technique_passes', {'n': int(n), 'query': query, 'passed_tasks': json.dumps(techniques)})
+            for n, techniques in passed_tasks.items()]
+
+def query_rows(output_path, query):
+    """Statements that store the query folder output_path/query, replacing what was stored for it."""
+    query_path = os.path.join(output_path, query)
+    statements = [(f'DELETE FROM {table} WHERE query = ?', [query]) for table in QUERY_TABLES]
+    query_row = {'query': query}
+    tasks = {}
+    agents = {}
+    runs = {}
+
+    def keep_file(path, rel_path):
+        with open(path, 'rb') as f:
+            statements.append(insert('files', {'query': query, 'path': rel_path, 'content': f.read()}))
+
+    for root, dirs, files in os.walk(query_path):
+        dirs.sort()
+        rel_root = os.path.relpath(root, query_path)
+        parts = [] if rel_root == '.' else rel_root.split(os.sep)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            rel_path = os.path.join(rel_root, name) if parts else name
+            content = None
+            if not parts and name in QUERY_FILES:
+                content = read_text(path)
+                if content is not None:
+                    query_row[QUERY_FILES[name]] = content
+            elif len(parts) == 1:
+                task = parts[0]
+                run = runs.setdefault((task, EXPERT, ''), {})
+                if name in TASK_FILES:
+                    content = read_text(path)
+                    if content is not None:
+                        tasks.setdefault(task, {'query': query, 'task': task})[TASK_FILES[name]] = content
+                elif name == REPORT_FILE or name == RESULTS_FILES[EXPERT]:
+                    content = read_text(path)
+                    if content is not None:
+                        run['report' if name == REPORT_FILE else 'test_results'] = content
+            elif len(parts) == 3 and parts[1] in ROLE_FOLDERS:
+                task, role, agent = parts[0], ROLE_FOLDERS[parts[1]], parts[2]
+                if name in AGENT_FILES or name == PROGRAM_FILES.get(role):
+                    content = read_text(path)
+                    if content is not None:
+                        column = AGENT_FILES.get(name, 'program')
+                        agents.setdefault((task, role, agent), {'query': query, 'task': task, 'role': role, 'agent': agent})[column] = content
+                elif name == REPORT_FILE or name == RESULTS_FILES.get(role):
+                    content = read_text(path)
+                    if content is not None:
+                        runs.setdefault((task, role, agent), {})['report' if name == REPORT_FILE else 'test_results'] = content
+            if content is None:
+                keep_file(path, rel_path)
+
+    statements.append(insert('queries', query_row))
+    if query_row.get('passed_tasks') is not None:
+        statements.extend(technique_pass_rows(query, query_row['passed_tasks']))
+    statements.extend(insert('tasks', row) for row in tasks.values())
+    statements.extend(insert('agent_responses', row) for row in agents.values())
+    for (task, role, agent), run in runs.items():
+        if run:
+            statements.extend(test_run_rows(query, task, role, agent, run.get('report'), run.get('test_results')))
+    return statements
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content.encode('utf-8') if isinstance(content, str) else content)
+
+class ArtifactStore:
+    """Outputs of a run (queries, tasks, agent responses, test runs and their per-test outcomes) in one SQLite file.
+
+    Writes are handed to a single writer thread, which commits them in batches, so concurrent workers never
+    wait on each other for the database lock. Every query folder is replaced in one transaction.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.writer = None
+        self.error = None
+        if read_only:
+            self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=30, check_same_thread=False)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def start_writer(self):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.write_batches, daemon=True)
+                self.writer.start()
+
+    def write_batches(self):
+        # the writer has its own connection, readers keep using self.conn thanks to WAL
+        conn = sqlite3.connect(self.path, timeout=30)
+        while True:
+            items = [self.pending.get()]
+            num_rows = len(items[0] or [])
+            while items[-1] is not None and num_rows < BATCH_SIZE:
+                try:
+                    items.append(self.pending.get(timeout=FLUSH_INTERVAL))
+                    num_rows += len(items[-1] or [])
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    for statements in items:
+                        for sql, params in statements or []:
+                            conn.execute(sql, params)
+            except sqlite3.Error as e:
+                print(f'Could not write to the artifact store {self.path}: {e}')
+                self.error = e
+            for _ in items:
+                self.pending.task_done()
+            if items[-1] is None:
+                conn.close()
+                return
+
+    def submit(self, statements):
+        if self.read_only:
+            raise ValueError(f'Artifact store {self.path} is read-only')
+        self.start_writer()
+        self.pending.put(statements)
+
+    def import_query(self, query_path):
+        """Queue query_path (a query folder of the output tree) to replace what is stored for that query."""
+        query_path = os.path.abspath(query_path)
+        self.submit(query_rows(os.path.dirname(query_path), os.path.basename(query_path)))
+
+    def import_outputs(self, output_path, num_workers=8):
+        """Store every query folder under output_path, and the files next to them (e.g. expert annotations)."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        entries = sorted(os.listdir(output_path))
+        queries = [entry for entry in entries if os.path.isdir(os.path.join(output_path, entry))]
+        # the store itself (and its -wal and -shm files) may live in output_path
+        root_files = [entry for entry in entries if os.path.isfile(os.path.join(output_path, entry))
+                      and not os.path.abspath(os.path.join(output_path, entry)).startswith(os.path.abspath(self.path))]
+        statements = [("DELETE FROM files WHERE query = ''", [])]
+        for name in root_files:
+            with open(os.path.join(output_path, name), 'rb') as f:
+                statements.append(insert('files', {'query': '', 'path': name, 'content': f.read()}))
+        self.submit(statements)
+        # reading the folders is parallel, writing them stays with the single writer
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(self.import_query, [os.path.join(output_path, query) for query in queries]))
+        self.flush()
+        return queries
+
+    def flush(self):
+        if self.writer is not None:
+            self.pending.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        if self.writer is not None:
+            self.pending.put(None)
+            self.writer.join()
+            self.writer = None
+        self.conn.close()
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def queries(self):
+        return [row[0] for row in self.execute('SELECT query FROM queries ORDER BY query')]
+
+    def passed_tasks(self, n):
+        """{query: {technique: [task, ...]}} of the first n tasks of every query, as in passed_tasks_for_each_technique.json."""
+        passed = {query: {} for query in self.queries()}
+        for query, passed_tasks in self.execute('SELECT query, passed_tasks FROM technique_passes WHERE n = ? ORDER BY query', (n,)):
+            passed[query] = json.loads(passed_tasks)
+        return passed
+
+    def query_contexts(self):
+        """{query: (theme, programming concepts)} as written in theme.txt and programming_concepts.txt."""
+        return {query: (theme, concepts) for query, theme, concepts in
+                self.execute('SELECT query, theme, programming_concepts FROM queries ORDER BY query')}
+
+    def export_outputs(self, output_path, queries=None):
+        """Write the stored queries (all by default) back to output_path in the layout of the output tree."""
+        queries = self.queries() if queries is None else queries
+        for path, content in self.execute("SELECT path, content FROM files WHERE query = ''"):
+            write_file(os.path.join(output_path, path), content)
+        for query in queries:
+            query_path = os.path.join(output_path, query)
+            os.makedirs(query_path, exist_ok=True)
+            columns = list(QUERY_FILES.values())
+            row = self.execute(f'SELECT {", ".join(columns)} FROM queries WHERE query = ?', (query,))[0]
+            for name, content in zip(QUERY_FILES, row):
+                if content is not None:
+                    write_file(os.path.join(query_path, name), content)
+            columns = list(TASK_FILES.values())
+            for task, *row in self.execute(f'SELECT task, {", ".join(columns)} FROM tasks WHERE query = ?', (query,)):
+                for name, content in zip(TASK_FILES, row):
+                    if content is not None:
+                        write_file(os.path.join(query_path, task, name), content)
+            for task, role, agent, prompt, annotations, program in self.execute(
+                    'SELECT task, role, agent, prompt, annotations, program FROM agent_responses WHERE query = ?', (query,)):
+                agent_path = os.path.join(query_path, task, ROLE_FOLDER[role], agent)
+                for name, content in [('prompt.txt', prompt), ('annotations.json', annotations), (PROGRAM_FILES.get(role), program)]:
+                    if content is not None:
+                        write_file(os.path.join(agent_path, name), content)
+            for task, role, agent, report, test_results in self.execute(
+                    'SELECT task, role, agent, report, test_results FROM test_runs WHERE query = ?', (query,)):
+                run_path = os.path.join(query_path, task) if role == EXPERT else os.path.join(query_path, task, ROLE_FOLDER[role], agent)
+                if report is not None:
+                    write_file(os.path.join(run_path, REPORT_FILE), report)
+                if test_results is not None:
+                    write_file(os.path.join(run_path, RESULTS_FILES[role]), test_results)
+            for path, content in self.execute('SELECT path, content FROM files WHERE query = ?', (query,)):
+                write_file(os.path.join(query_path, path), content)
+        return queries
+
+# Store the pipeline mirrors every analyzed query into, when run with --artifact_store
+artifact_store = None
+
+def configure_artifact_store(path):
+    global artifact_store
+    artifact_store = ArtifactStore(path) if path else None
+    return artifact_store
+
+def get_artifact_store():
+    return artifact_store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move an output tree into an artifact store, or back')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('output_path', type=str, help='output tree to import from or export to')
+    parser.add_argument('--store', type=str, required=True, help='artifact store file')
+    parser.add_argument('--queries', nargs='+', default=None, help='queries to export, all by default')
+
+    #example command: python -m code.artifact_store import outputs --store artifacts.sqlite
+    args = parser.parse_args()
+    store = ArtifactStore(args.store, read_only=args.command == 'export')
+    if args.command == 'import':
+        queries = store.import_outputs(args.output_path)
+        print(f'Imported {len(queries)} queries into {args.store}')
+    else:
+        queries = store.export_outputs(args.output_path, args.queries)
+        print(f'Exported {len(queries)} queries from {args.store}')
+    store.close()
@@ -0,0 +1,103 @@
+import os
+import io
+import json
+import time
+import shutil
+import random
+import argparse
+import tempfile
+import contextlib
+
+from ..analyze import analyze_results
+
+def write_json(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(content, f)
+
+def pytest_report(test_file, outcomes):
+    """Minimal pytest-json-report report; an outcome of 'error' is a test whose setup failed."""
+    tests = []
+    for i, outcome in enumerate(outcomes):
+        test = {'nodeid': f'{test_file}::test_{i}', 'outcome': outcome, 'setup': {'outcome': 'passed'}}
+        if outcome == 'error':
+            test['setup'] = {'outcome': 'failed', 'crash': {'message': 'fixture failed'}}
+        else:
+            test['call'] = {'outcome': outcome}
+            if outcome == 'failed':
+                test['call']['crash'] = {'message': 'AssertionError'}
+        tests.append(test)
+    summary = {'total': len(outcomes), 'collected': len(outcomes)}
+    for outcome in outcomes:
+        summary[outcome] = summary.get(outcome, 0) + 1
+    return {'summary': summary, 'tests': tests}
+
+def build_query(query_path, num_tasks, num_students, num_tests, seed=0):
+    """Write a query folder with the reports and annotations analyze_results reads.
+
+    Students pass, fail or error on every test case; a few do not collect (no tests) or have more
+    test cases than the expert solution, as happens with real populations.
+    """
+    rng = random.Random(seed)
+    for t in range(num_tasks):
+        task_path = os.path.join(query_path, f'task_{t}')
+        write_json(os.path.join(task_path, 'pytest_report.json'), pytest_report('test_suite_sol.py', ['passed'] * num_tests))
+        write_json(os.path.join(task_path, 'simulated_judges', 'judge_0', 'annotations.json'),
+                   {'q_testsuite': 1.0, 'q_context': 1.0, 'q_comprehensible': 1.0, 'q_overall': float(rng.random() < 0.8)})
+        tutor_path = os.path.join(task_path, 'simulated_tutors', 'tutor_0')
+        write_json(os.path.join(tutor_path, 'annotations.json'), {'program': '', 'context_relevance': 1.0})
+        write_json(os.path.join(tutor_path, 'pytest_report.json'), pytest_report('test_suite_ta.py', ['passed'] * num_tests))
+        write_json(os.path.join(tutor_path, 'pytest_coverage_report.json'), {'totals': {'percent_covered': 100.0}})
+        for s in range(num_students):
+            draw = rng.random()
+            if draw < 0.05:
+                outcomes = []
+            elif draw < 0.1:
+                outcomes = ['passed'] * (num_tests + 1)
+            else:
+                skill = rng.random()
+                outcomes = [rng.choices(['passed', 'failed', 'error'], [skill, 1 - skill, 0.05])[0] for _ in range(num_tests)]
+            write_json(os.path.join(task_path, 'simulated_students', f'student_temp-1.0_{s}', 'pytest_report.json'),
+                       pytest_report('test_suite_stu.py', outcomes))
+
+def benchmark(student_counts, task_counts, num_tests, repeats=3):
+    summaries = []
+    for num_tasks in task_counts:
+        for num_students in student_counts:
+            query_path = tempfile.mkdtemp(prefix='bench_analysis_')
+            try:
+                build_query(query_path, num_tasks, num_students, num_tests)
+                durations = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    # analyze_results reports every student it reads
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        analyze_results(query_path)
+                    durations.append(time.perf_counter() - start)
+            finally:
+                shutil.rmtree(query_path, ignore_errors=True)
+            summary = {
+                'tasks': num_tasks,
+                'students': num_students,
+                'tests': num_tests,
+                'best_s': round(min(durations), 3),
+                'ms_per_student_report': round(min(durations) / (num_tasks * num_students) * 1000, 3),
+            }
+            print(json.dumps(summary))
+            summaries.append(summary)
+    return summaries
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark how analyze_results scales with students and tasks')
+    parser.add_argument('--students', nargs='+', type=int, default=[10, 50, 100, 200])
+    parser.add_argument('--tasks', nargs='+', type=int, default=[5, 20, 50])
+    parser.add_argument('--num_tests', type=int, default=10, help='test cases per task')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', type=str, default=None, help='write the summaries to this JSON file')
+
+    #example command: python -m code.benchmarks.bench_analysis --students 10 100 --tasks 5 50
+    args = parser.parse_args()
+    summaries = benchmark(args.students, args.tasks, args.num_tests, args.repeats)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(summaries, f, indent=4)
@@ -0,0 +1,113 @@
+import os
+import json
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from ..run_test import write_test_suite_ta
+from ..execution_backend import run_pytest, set_test_backend, shutdown_pool, TEST_BACKENDS
+from .fixtures import build_corpus
+
+# Appended to every other tutor program of the synthetic corpus, so that not every program is fully covered
+UNUSED_HELPER = '\n\ndef unused_helper(x):\n    if x:\n        return x\n    return 0\n'
+PYTEST_COV_REPORT = 'bench_pytest_cov.json'
+
+def synthetic_tutors(corpus_path, num_tasks, num_tutors):
+    corpus = build_corpus(corpus_path, num_tasks, num_students=0, num_tutors=num_tutors)
+    tutors = []
+    for task in corpus:
+        task_folder = os.path.join(corpus_path, task)
+        for i, tutor in enumerate(sorted(os.listdir(os.path.join(task_folder, 'simulated_tutors')))):
+            tutor_folder = os.path.join(task_folder, 'simulated_tutors', tutor)
+            if i % 2:
+                with open(os.path.join(tutor_folder, 'program.py'), 'a') as f:
+                    f.write(UNUSED_HELPER)
+            tutors.append((tutor_folder, task_folder))
+    return tutors
+
+def copied_tutors(output_path, corpus_path, max_tutors):
+    """Tutors of an existing output tree, copied with their task's test suite so that the tree is left as it is."""
+    tutors = []
+    for program_path in sorted(glob.glob(os.path.join(output_path, '*', 'task_*', 'simulated_tutors', '*', 'program.py')))[:max_tutors]:
+        tutor_folder = os.path.dirname(program_path)
+        task_folder = os.path.dirname(os.path.dirname(tutor_folder))
+        copy_task = os.path.join(corpus_path, f'task_{len(tutors)}')
+        copy_tutor = os.path.join(copy_task, 'simulated_tutors', os.path.basename(tutor_folder))
+        os.makedirs(copy_tutor)
+        shutil.copy(os.path.join(task_folder, 'test_suite.py'), copy_task)
+        shutil.copy(program_path, copy_tutor)
+        tutors.append((copy_tutor, copy_task))
+    return tutors
+
+def with_pytest_cov(tutor_folder, test_suite_path):
+    report_path = os.path.join(tutor_folder, PYTEST_COV_REPORT)
+    run_pytest(['--tb=line', '--cov=program', f'--cov-report=json:{report_path}', test_suite_path], os.devnull, cwd=tutor_folder)
+    try:
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    missing_lines = [file['missing_lines'] for file in report['files'].values()]
+    return round(report['totals']['percent_covered'], 2), missing_lines[0] if missing_lines else []
+
+def with_line_coverage(tutor_folder, test_suite_path):
+    run = run_pytest(['--tb=line', test_suite_path], os.devnull, cwd=tutor_folder, coverage_source=os.path.join(tutor_folder, 'program.py'))
+    return round(run['coverage']['percent_covered'], 2), run['coverage']['missing_lines']
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def benchmark(tutors, backend, num_workers, repeats):
+    set_test_backend(backend, num_workers, num_workers)
+    durations = {'pytest_cov': [], 'line_coverage': []}
+    mismatches = []
+    for tutor_folder, task_folder in tutors:
+        test_suite_path = write_test_suite_ta(tutor_folder, task_folder)
+        for _ in range(repeats):
+            expected, duration = timed(with_pytest_cov, tutor_folder, test_suite_path)
+            durations['pytest_cov'].append(duration)
+            measured, duration = timed(with_line_coverage, tutor_folder, test_suite_path)
+            durations['line_coverage'].append(duration)
+        if expected != measured:
+            mismatches.append({'tutor': tutor_folder, 'pytest_cov': expected, 'line_coverage': measured})
+    shutdown_pool()
+    summary = {'backend': backend, 'programs': len(tutors), 'mismatches': len(mismatches)}
+    for method, values in durations.items():
+        summary[f'{method}_p50_s'] = round(float(np.percentile(values, 50)), 3)
+        summary[f'{method}_p95_s'] = round(float(np.percentile(values, 95)), 3)
+    summary['speedup_p50'] = round(summary['pytest_cov_p50_s'] / summary['line_coverage_p50_s'], 2)
+    return summary, mismatches
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the line coverage of tutor test runs against pytest-cov')
+    parser.add_argument('--backends', nargs='+', default=TEST_BACKENDS, choices=TEST_BACKENDS)
+    parser.add_argument('--workers', type=int, default=1, help='size of the pytest worker pool')
+    parser.add_argument('--num_tasks', type=int, default=2)
+    parser.add_argument('--num_tutors', type=int, default=10, help='tutors per synthetic task')
+    parser.add_argument('--output_path', type=str, default=None, help='take the tutors of this output tree instead of synthetic ones')
+    parser.add_argument('--max_tutors', type=int, default=100, help='tutors taken from --output_path')
+    parser.add_argument('--repeats', type=int, default=3, help='runs of each method on every tutor')
+
+    #example command: python -m code.benchmarks.bench_coverage --backends subprocess pool --output_path outputs --max_tutors 50
+    args = parser.parse_args()
+    corpus_path = tempfile.mkdtemp(prefix='bench_coverage_')
+    try:
+        if args.output_path is not None:
+            tutors = copied_tutors(args.output_path, corpus_path, args.max_tutors)
+            if not tutors:
+                raise SystemExit(f'no tutor programs found in {args.output_path}')
+        else:
+            tutors = synthetic_tutors(corpus_path, args.num_tasks, args.num_tutors)
+        for backend in args.backends:
+            summary, mismatches = benchmark(tutors, backend, args.workers, args.repeats)
+            print(json.dumps(summary))
+            for mismatch in mismatches:
+                print('  mismatch:', json.dumps(mismatch))
+    finally:
+        shutil.rmtree(corpus_path, ignore_errors=True)
@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+import numpy as np
+
+# Libraries only the analysis and plotting stages need, which the generation path must not load
+ANALYSIS_MODULES = ['pandas', 'scipy', 'sklearn', 'matplotlib', 'seaborn']
+# Entry points of task generation: the CLI and the functions a web worker calls
+GENERATION_ENTRY_POINT = 'code.main'
+# Cumulative import time allowed for the entry point
+DEFAULT_BUDGET_MS = 1500
+
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+def import_times(module):
+    """Run `python -X importtime -c 'import module'` in a fresh interpreter.
+
+    Returns the cumulative import time in microseconds of every module, and the analysis modules it loaded.
+    """
+    check = f'import sys, {module}; print(",".join(m for m in {ANALYSIS_MODULES!r} if m in sys.modules))'
+    env = dict(os.environ, LLM_BACKEND=os.environ.get('LLM_BACKEND', 'mock'))
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', check], cwd=parent_dir, env=env,
+                               capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        # a module imported twice is only timed the first time
+        cumulative.setdefault(name.strip(), int(total))
+    loaded = [m for m in completed.stdout.strip().split(',') if m]
+    return cumulative, loaded
+
+def benchmark(module, repeats):
+    totals = []
+    for _ in range(repeats):
+        cumulative, loaded = import_times(module)
+        totals.append(cumulative[module] / 1000)
+    slowest = sorted(((name, total) for name, total in cumulative.items() if '.' not in name and name != module),
+                     key=lambda item: -item[1])[:10]
+    return {
+        'module': module,
+        'p50_ms': round(float(np.percentile(totals, 50)), 1),
+        'max_ms': round(max(totals), 1),
+        'analysis_modules_loaded': loaded,
+        'slowest_top_level_ms': {name: round(total / 1000, 1) for name, total in slowest},
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the import time of the generation entry point against a budget')
+    parser.add_argument('--module', type=str, default=GENERATION_ENTRY_POINT)
+    parser.add_argument('--budget_ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', type=str, default=None, help='write the summary to this JSON file')
+
+    #example command: python -m code.benchmarks.bench_import_time --budget_ms 1500
+    args = parser.parse_args()
+    summary = benchmark(args.module, args.repeats)
+    print(json.dumps(summary, indent=4))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=4)
+
+    failures = []
+    if summary['p50_ms'] > args.budget_ms:
+        failures.append(f"{args.module} takes {summary['p50_ms']} ms to import, over the budget of {args.budget_ms} ms")
+    if summary['analysis_modules_loaded']:
+        failures.append(f"{args.module} loads analysis modules: {', '.join(summary['analysis_modules_loaded'])}")
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ..gen_consistency import check_gen_consistency
+from ..run_test import test_student, test_students_batch, test_ta_testsuite
+from ..execution_backend import set_test_backend, shutdown_pool, TEST_BACKENDS
+from .fixtures import build_corpus, PROGRAM_KINDS
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def run_task(task_folder, students, num_workers, batch=False):
+    """Run every test of one task the way the validation pipeline does, timing each program."""
+    timings = []
+    _, duration = timed(check_gen_consistency, task_folder)
+    timings.append(('gen_consistency', duration))
+    # the tutors of a task are tested at once, so the stage is timed as a whole
+    _, duration = timed(test_ta_testsuite, os.path.dirname(task_folder), os.path.basename(task_folder))
+    timings.append(('tutors', duration))
+    if batch:
+        # one session tests every student, so each program is charged an equal share of it
+        _, duration = timed(test_students_batch, list(students), task_folder)
+        timings.extend((kind, duration / len(students)) for kind in students.values())
+        return timings
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(timed, test_student, student, task_folder): kind for student, kind in students.items()}
+        for future, kind in futures.items():
+            _, duration = future.result()
+            timings.append((kind, duration))
+    return timings
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux; children covers every pytest process that has been waited for
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_rss, children_rss) / 1024
+
+def run_configuration(corpus_path, corpus, backend, num_workers, batch, connection):
+    # Runs in a fresh child so that peak RSS and worker pools are measured per configuration
+    set_test_backend(backend, num_workers, num_workers, batch)
+    timings = []
+    start = time.perf_counter()
+    # tasks run one after the other and their students on num_workers threads, as many as the pytest
+    # budget allows, so a program's latency never includes waiting for another one to finish
+    for task, students in corpus.items():
+        timings.extend(run_task(os.path.join(corpus_path, task), students, num_workers, batch))
+    wall = time.perf_counter() - start
+    shutdown_pool()
+    connection.send({'timings': timings, 'wall': wall, 'peak_rss_mb': peak_rss_mb()})
+    connection.close()
+
+def summarize(backend, num_workers, batch, measurement):
+    durations = np.array([duration for _, duration in measurement['timings']])
+    summary = {
+        'backend': backend,
+        'workers': num_workers,
+        'batch': batch,
+        'programs': len(durations),
+        'wall_s': round(measurement['wall'], 2),
+        'programs_per_s': round(len(durations) / measurement['wall'], 2),
+        'p50_s': round(float(np.percentile(durations, 50)), 3),
+        'p95_s': round(float(np.percentile(durations, 95)), 3),
+        'peak_rss_mb': round(measurement['peak_rss_mb'], 1),
+    }
+    by_kind = {}
+    for kind, duration in measurement['timings']:
+        by_kind.setdefault(kind, []).append(duration)
+    summary['p50_by_kind_s'] = {kind: round(float(np.percentile(values, 50)), 3) for kind, values in sorted(by_kind.items())}
+    return summary
+
+def benchmark(backends, workers, num_tasks, num_students, kinds, corpus_path=None, batch=False, num_tutors=1):
+    keep_corpus = corpus_path is not None
+    corpus_path = corpus_path or tempfile.mkdtemp(prefix='bench_test_execution_')
+    corpus = build_corpus(corpus_path, num_tasks, kinds, num_students, num_tutors)
+    summaries = []
+    try:
+        for backend in backends:
+            for num_workers in workers:
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.get_context('fork').Process(target=run_configuration, args=(corpus_path, corpus, backend, num_workers, batch, sender))
+                process.start()
+                measurement = receiver.recv()
+                process.join()
+                summary = summarize(backend, num_workers, batch, measurement)
+                print(json.dumps(summary))
+                summaries.append(summary)
+    finally:
+        if not keep_corpus:
+            shutil.rmtree(corpus_path, ignore_errors=True)
+    return summaries
+
+def print_table(summaries):
+    columns = ['backend', 'workers', 'batch', 'programs', 'wall_s', 'programs_per_s', 'p50_s', 'p95_s', 'peak_rss_mb']
+    print(' '.join(f'{column:>14}' for column in columns))
+    for summary in summaries:
+        print(' '.join(f'{str(summary[column]):>14}' for column in columns))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the test execution of the validation pipeline')
+    parser.add_argument('--backends', nargs='+', default=TEST_BACKENDS, choices=TEST_BACKENDS)
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, os.cpu_count() or 4])
+    parser.add_argument('--num_tasks', type=int, default=2)
+    parser.add_argument('--num_students', type=int, default=10, help='student programs per task, cycling through --kinds')
+    parser.add_argument('--num_tutors', type=int, default=1, help='tutors per task, all writing the expert solution')
+    parser.add_argument('--kinds', nargs='+', default=PROGRAM_KINDS, choices=PROGRAM_KINDS)
+    parser.add_argument('--batch', action='store_true', help='test the students of a task in one pytest session')
+    parser.add_argument('--corpus_path', type=str, default=None, help='keep the generated task folders here instead of a temporary directory')
+    parser.add_argument('--output', type=str, default=None, help='write the summaries to this JSON file')
+
+    #example command: python -m code.benchmarks.bench_test_execution --backends subprocess pool --workers 1 4 --num_tasks 2 --num_students 10
+    args = parser.parse_args()
+    summaries = benchmark(args.backends, args.workers, args.num_tasks, args.num_students, args.kinds, args.corpus_path, args.batch, args.num_tutors)
+    print_table(summaries)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(summaries, f, indent=4)
@@ -0,0 +1,125 @@
+import os
+
+# Kinds of student programs in the benchmark corpus
+PASSING = 'passing'
+FAILING = 'failing'
+SYNTAX_ERROR = 'syntax_error'
+INFINITE_LOOP = 'infinite_loop'
+# loops in C code, where a signal handler does not run until the loop ends
+NATIVE_HANG = 'native_hang'
+FILE_IO = 'file_io'
+PROGRAM_KINDS = [PASSING, FAILING, SYNTAX_ERROR, INFINITE_LOOP, NATIVE_HANG, FILE_IO]
+
+# Size of the scratch file written and read back on every call of a file_io program
+FILE_IO_BYTES = 4 * 1024**2
+
+TASKS = [
+    {
+        'function': 'add',
+        'task_description': 'Write a function `add(a, b)` that returns the sum of two numbers.',
+        'solution_program': 'def add(a, b):\n    return a + b\n',
+        'wrong_program': 'def add(a, b):\n    return a - b\n',
+        'test_suite': (
+            'from solution import add\n\n'
+            'def test_add_positive():\n    assert add(1, 2) == 3\n\n'
+            'def test_add_zero():\n    assert add(0, 0) == 0\n\n'
+            'def test_add_negative():\n    assert add(-1, -2) == -3\n'
+        ),
+    },
+    {
+        'function': 'word_frequencies',
+        'task_description': 'Write a function `word_frequencies(path)` that returns a dict mapping each word of the text file at `path` to its number of occurrences.',
+        'solution_program': (
+            'def word_frequencies(path):\n'
+            '    counts = {}\n'
+            '    with open(path) as f:\n'
+            '        for word in f.read().split():\n'
+            '            counts[word] = counts.get(word, 0) + 1\n'
+            '    return counts\n'
+        ),
+        'wrong_program': (
+            'def word_frequencies(path):\n'
+            '    with open(path) as f:\n'
+            '        return {word: 1 for word in f.read().split()}\n'
+        ),
+        'test_suite': (
+            'import os\n'
+            'from solution import word_frequencies\n\n'
+            'def setup_module():\n'
+            "    with open('words.txt', 'w') as f:\n"
+            "        f.write('a b a c b a\\n' * 1000)\n"
+            "    with open('empty.txt', 'w') as f:\n"
+            "        f.write('')\n\n"
+            'def teardown_module():\n'
+            "    os.remove('words.txt')\n"
+            "    os.remove('empty.txt')\n\n"
+            'def test_counts():\n'
+            "    assert word_frequencies('words.txt') == {'a': 3000, 'b': 2000, 'c': 1000}\n\n"
+            'def test_empty():\n'
+            "    assert word_frequencies('empty.txt') == {}\n"
+        ),
+    },
+]
+
+def student_program(task, kind):
+    name = task['function']
+    if kind == PASSING:
+        return task['solution_program']
+    if kind == FAILING:
+        return task['wrong_program']
+    if kind == SYNTAX_ERROR:
+        return f'def {name}(:\n    return\n'
+    if kind == INFINITE_LOOP:
+        return f'def {name}(*args):\n    while True:\n        pass\n'
+    if kind == NATIVE_HANG:
+        return f'def {name}(*args):\n    return sum(range(10**15))\n'
+    if kind == FILE_IO:
+        # correct, but every call writes and reads back a scratch file in the working directory
+        return (
+            'import os\n\n'
+            + task['solution_program'].replace(f'def {name}(', f'def _{name}(') +
+            f'\ndef {name}(*args):\n'
+            "    with open('scratch.bin', 'wb') as f:\n"
+            f'        f.write(os.urandom({FILE_IO_BYTES}))\n'
+            "    with open('scratch.bin', 'rb') as f:\n"
+            '        f.read()\n'
+            f'    return _{name}(*args)\n'
+        )
+    raise ValueError(f'Unknown program kind {kind}, expected one of {PROGRAM_KINDS}')
+
+def write_file(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+def build_task(task_folder, task, kinds, num_students, num_tutors=1):
+    """Lay out a task folder the way the pipeline leaves it before its tests run.
+
+    Students cycle through `kinds`; each one gets its own folder as with simulated students. Every tutor
+    writes the expert solution. Returns the kind of every student folder.
+    """
+    os.makedirs(task_folder, exist_ok=True)
+    write_file(os.path.join(task_folder, 'task_description.txt'), task['task_description'])
+    write_file(os.path.join(task_folder, 'solution_program.py'), task['solution_program'])
+    write_file(os.path.join(task_folder, 'test_suite.py'), task['test_suite'])
+
+    for i in range(num_tutors):
+        tutor_folder = os.path.join(task_folder, 'simulated_tutors', f'tutor_{i}')
+        os.makedirs(tutor_folder, exist_ok=True)
+        write_file(os.path.join(tutor_folder, 'program.py'), task['solution_program'])
+
+    student_kinds = {}
+    for i in range(num_students):
+        kind = kinds[i % len(kinds)]
+        student_folder = os.path.join(task_folder, 'simulated_students', f'student_{i}_{kind}')
+        os.makedirs(student_folder, exist_ok=True)
+        write_file(os.path.join(student_folder, 'solution_program.py'), student_program(task, kind))
+        student_kinds[student_folder] = kind
+    return student_kinds
+
+def build_corpus(output_path, num_tasks, kinds=PROGRAM_KINDS, num_students=10, num_tutors=1):
+    """Write num_tasks synthetic task folders (task_0, task_1, ...) under output_path, cycling through TASKS."""
+    corpus = {}
+    for i in range(num_tasks):
+        task = f'task_{i}'
+        corpus[task] = build_task(os.path.join(output_path, task), TASKS[i % len(TASKS)], kinds, num_students, num_tutors)
+    return corpus
@@ -0,0 +1,170 @@
+import os
+import json
+import threading
+
+from .task_generation import ProgrammingProblem
+from .run_test import ta_passed, population_passed_from_reports
+from .utils import check_passed_all_tests
+
+MANIFEST_FILE = 'manifest.json'
+QUERY_STAGE_KEY = '_query'
+
+# Stages whose outputs are stale once the given stage has been rerun
+DOWNSTREAM_STAGES = {
+    'parse': ['judge', 'gen_consistency', 'tutor', 'tutor_testsuite', 'students', 'student_tests'],
+    'tutor': ['tutor_testsuite'],
+    'students': ['student_tests'],
+}
+
+RESUME = False
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def set_resume(resume):
+    global RESUME
+    RESUME = resume
+
+class Manifest:
+    """Completed stages of one query, stored as {task: [stage, ...]} in query_path/manifest.json."""
+
+    def __init__(self, query_path):
+        self.path = os.path.join(query_path, MANIFEST_FILE)
+        self.lock = threading.Lock()
+        self.stages = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.stages = json.load(f)
+            except ValueError:
+                print(f'Ignoring unreadable manifest {self.path}')
+
+    def is_complete(self, task, stage):
+        with self.lock:
+            return stage in self.stages.get(task, [])
+
+    def mark_complete(self, task, stage):
+        with self.lock:
+            stages = self.stages.setdefault(task, [])
+            if stage not in stages:
+                stages.append(stage)
+            self.save()
+
+    def invalidate(self, task, stage):
+        with self.lock:
+            if task == QUERY_STAGE_KEY:
+                # a regenerated pool makes every task stale
+                self.stages = {QUERY_STAGE_KEY: [s for s in self.stages.get(QUERY_STAGE_KEY, []) if s != stage]}
+            else:
+                stale = [stage] + DOWNSTREAM_STAGES.get(stage, [])
+                self.stages[task] = [s for s in self.stages.get(task, []) if s not in stale]
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.stages, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+def get_manifest(query_path):
+    key = os.path.abspath(query_path)
+    with _manifests_lock:
+        if key not in _manifests:
+            _manifests[key] = Manifest(query_path)
+        return _manifests[key]
+
+def load_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def agent_folders(task_path, agents_folder):
+    path = os.path.join(task_path, agents_folder)
+    if not os.path.isdir(path):
+        return []
+    return [os.path.join(path, agent) for agent in sorted(os.listdir(path)) if os.path.isdir(os.path.join(path, agent))]
+
+def stage_outputs_valid(query_path, task, stage, model_configuration):
+    if stage == 'gen_tasks':
+        responses = load_json(os.path.join(query_path, 'responses.json'))
+        return isinstance(responses, list) and len(responses) > 0
+
+    task_path = os.path.join(query_path, task)
+    if stage == 'parse':
+        return all(os.path.exists(os.path.join(task_path, name)) for name in ['task_description.txt', 'solution_program.py', 'test_suite.py'])
+    if stage == 'gen_consistency':
+        return load_json(os.path.join(task_path, 'pytest_report.json')) is not None
+    if stage == 'judge':
+        judges = agent_folders(task_path, 'simulated_judges')
+        return len(judges) >= model_configuration['judge']['quantity'] and all(load_json(os.path.join(judge, 'annotations.json')) is not None for judge in judges)
+    if stage == 'tutor':
+        tutors = agent_folders(task_path, 'simulated_tutors')
+        annotations = [load_json(os.path.join(tutor, 'annotations.json')) for tutor in tutors]
+        if not tutors or any(annotation is None for annotation in annotations) or not all(os.path.exists(os.path.join(tutor, 'program.py')) for tutor in tutors):
+            return False
+        # query_simulated_tutor stops writing tutors at the first one without context relevance
+        return len(tutors) >= model_configuration['tutor']['quantity'] or any(not annotation['context_relevance'] for annotation in annotations)
+    if stage == 'tutor_testsuite':
+        tutors = agent_folders(task_path, 'simulated_tutors')
+        return len(tutors) > 0 and all(load_json(os.path.join(tutor, 'pytest_report.json')) is not None for tutor in tutors)
+    if stage == 'students':
+        students = agent_folders(task_path, 'simulated_students')
+        return len(students) >= model_configuration['student']['quantity'] and all(os.path.exists(os.path.join(student, 'solution_program.py')) for student in students)
+    if stage == 'student_tests':
+        students = agent_folders(task_path, 'simulated_students')
+        return len(students) > 0 and all(load_json(os.path.join(student, 'pytest_report.json')) is not None for student in students)
+    return False
+
+def load_stage_result(query_path, task, stage):
+    # Recomputes what the stage function returned from the outputs it left on disk
+    if stage == 'gen_tasks':
+        return [ProgrammingProblem(**response) for response in load_json(os.path.join(query_path, 'responses.json'))]
+
+    task_path = os.path.join(query_path, task)
+    if stage == 'parse':
+        task_files = []
+        for name in ['task_description.txt', 'solution_program.py', 'test_suite.py']:
+            with open(os.path.join(task_path, name), 'r') as f:
+                task_files.append(f.read())
+        return (task, *task_files)
+    if stage == 'gen_consistency':
+        return check_passed_all_tests(os.path.join(task_path, 'pytest_report.json'))
+    if stage == 'tutor':
+        return all(load_json(os.path.join(tutor, 'annotations.json'))['context_relevance'] for tutor in agent_folders(task_path, 'simulated_tutors'))
+    if stage == 'tutor_testsuite':
+        return all(ta_passed(tutor) for tutor in agent_folders(task_path, 'simulated_tutors'))
+    if stage == 'student_tests':
+        return population_passed_from_reports(task_path)
+    return None
+
+def can_skip_stage(query_path, task, stage, model_configuration):
+    manifest = get_manifest(query_path)
+    if RESUME and manifest.is_complete(task or QUERY_STAGE_KEY, stage) and stage_outputs_valid(query_path, task, stage, model_configuration):
+        print(f'Resuming {task or query_path}: skipping {stage}')
+        return True
+    return False
+
+def run_stage(query_path, task, stage, fn, model_configuration):
+    """Run fn for a stage of a task (task=None for query-level stages) and record its completion.
+
+    With resume enabled, a stage recorded as complete whose outputs are still valid is skipped and
+    its result is reloaded from disk instead.
+    """
+    if can_skip_stage(query_path, task, stage, model_configuration):
+        return load_stage_result(query_path, task, stage)
+    manifest = get_manifest(query_path)
+    manifest.invalidate(task or QUERY_STAGE_KEY, stage)
+    result = fn()
+    manifest.mark_complete(task or QUERY_STAGE_KEY, stage)
+    return result
+
+async def async_run_stage(query_path, task, stage, fn, model_configuration):
+    if can_skip_stage(query_path, task, stage, model_configuration):
+        return load_stage_result(query_path, task, stage)
+    manifest = get_manifest(query_path)
+    manifest.invalidate(task or QUERY_STAGE_KEY, stage)
+    result = await fn()
+    manifest.mark_complete(task or QUERY_STAGE_KEY, stage)
+    return result
@@ -0,0 +1,198 @@
+import os
+import csv
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from .artifact_store import EXPERT, ROLE_FOLDER, PROGRAM_FILES, REPORT_FILE, read_text
+from .outcome import load_outcome
+
+# One Arrow IPC file per table, uncompressed so that readers can memory-map them without copying
+TABLE_EXTENSION = '.arrow'
+# Columns of results.csv kept in the tasks table (passed_stus is in test_runs)
+RESULTS_COLUMNS = ['total_num_tc', 'gen_consistency', 'LLMJudge', 'Q-Testsuite', 'Q-Context', 'total_num_stu', 'num_passed_stu']
+TOKEN_COLUMNS = ['prompt_tokens', 'completion_tokens', 'total_tokens']
+TABLES = ['queries', 'technique_passes', 'tasks', 'test_runs', 'token_usage']
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.compute
+    except ImportError:
+        raise ImportError('The columnar tables need pyarrow: pip install pyarrow')
+    return pyarrow
+
+def table_schemas():
+    pa = require_pyarrow()
+    return {
+        'queries': pa.schema([('query', pa.string()), ('theme', pa.string()), ('programming_concepts', pa.string())]),
+        # one row per technique and number of tasks N, with the tasks it lets through in passed_tasks_for_each_technique.json
+        'technique_passes': pa.schema([('n', pa.int16()), ('query', pa.string()), ('position', pa.int16()),
+                                       ('technique', pa.string()), ('tasks', pa.list_(pa.string()))]),
+        'tasks': pa.schema([('query', pa.string()), ('task', pa.string()), ('task_description', pa.string()),
+                            ('perc_passed_tests', pa.float64()), ('coverage', pa.float64())]
+                           + [(column, pa.float64()) for column in RESULTS_COLUMNS]),
+        # test runs of the expert solution (agent '') and of every tutor and student, with one outcome per test case
+        'test_runs': pa.schema([('query', pa.string()), ('task', pa.string()), ('role', pa.string()), ('agent', pa.string()),
+                                ('total', pa.int32()), ('passed', pa.int32()), ('passed_all', pa.bool_()),
+                                ('outcomes', pa.list_(pa.int8()))]),
+        # token counts of the task generation (task null) and of every agent role of a task
+        'token_usage': pa.schema([('query', pa.string()), ('task', pa.string()), ('role', pa.string())]
+                                 + [(column, pa.int64()) for column in TOKEN_COLUMNS]),
+    }
+
+def subfolders(path):
+    return sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+
+def read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def read_optional_text(path):
+    return read_text(path) if os.path.exists(path) else None
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def read_results(query_path):
+    """{task: row} of the results.csv analyze_results writes for a query."""
+    try:
+        with open(os.path.join(query_path, 'results.csv'), 'r', newline='') as f:
+            return {row['task']: row for row in csv.DictReader(f)}
+    except OSError:
+        return {}
+
+def test_run_row(query, task, role, agent, outcome):
+    return {'query': query, 'task': task, 'role': role, 'agent': agent, 'total': outcome.summary.get('total'),
+            'passed': outcome.num_passed, 'passed_all': outcome.passed_all(), 'outcomes': list(outcome.outcomes)}
+
+def token_rows(query, task, token_count):
+    if not isinstance(token_count, dict):
+        return []
+    # the query's token_count.json counts the generation by the expert, a task's one counts every agent role
+    counts = {EXPERT: token_count} if task is None else token_count
+    return [dict({'query': query, 'task': task, 'role': role}, **{column: usage.get(column) for column in TOKEN_COLUMNS})
+            for role, usage in counts.items() if isinstance(usage, dict)]
+
+def query_table_rows(output_path, query):
+    """{table: [row, ...]} of the query folder output_path/query."""
+    from .utils import get_coverage
+
+    query_path = os.path.join(output_path, query)
+    rows = {name: [] for name in TABLES}
+    rows['queries'].append({'query': query, 'theme': read_optional_text(os.path.join(query_path, 'theme.txt')),
+                            'programming_concepts': read_optional_text(os.path.join(query_path, 'programming_concepts.txt'))})
+    for n, techniques in (read_json(os.path.join(query_path, 'passed_tasks_for_each_technique.json')) or {}).items():
+        for position, (technique, tasks) in enumerate(techniques.items()):
+            rows['technique_passes'].append({'n': int(n), 'query': query, 'position': position, 'technique': technique, 'tasks': tasks})
+    rows['token_usage'].extend(token_rows(query, None, read_json(os.path.join(query_path, 'token_count.json'))))
+
+    results = read_results(query_path)
+    for task in subfolders(query_path):
+        task_path = os.path.join(query_path, task)
+        outcome = load_outcome(os.path.join(task_path, REPORT_FILE))
+        if outcome is not None:
+            rows['test_runs'].append(test_run_row(query, task, EXPERT, '', outcome))
+        task_row = {'query': query, 'task': task,
+                    'task_description': read_optional_text(os.path.join(task_path, 'task_description.txt')),
+                    'perc_passed_tests': 0 if outcome is None else outcome.perc_passed(),
+                    'coverage': get_coverage(os.path.join(task_path, 'pytest_coverage_report.json'))}
+        result = results.get(task, {})
+        task_row.update({column: to_float(result.get(column)) for column in RESULTS_COLUMNS})
+        rows['tasks'].append(task_row)
+        rows['token_usage'].extend(token_rows(query, task, read_json(os.path.join(task_path, 'token_count.json'))))
+        # only tutors and students write programs that are tested
+        for role in PROGRAM_FILES:
+            role_path = os.path.join(task_path, ROLE_FOLDER[role])
+            if not os.path.isdir(role_path):
+                continue
+            for agent in subfolders(role_path):
+                outcome = load_outcome(os.path.join(role_path, agent, REPORT_FILE))
+                if outcome is not None:
+                    rows['test_runs'].append(test_run_row(query, task, role, agent, outcome))
+    return rows
+
+def write_table(table, path):
+    pa = require_pyarrow()
+    tmp_path = f'{path}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def compact_outputs(output_path, tables_path, num_workers=8):
+    """Write the queries, tasks, technique passes, test runs and token usage of every query folder under output_path
+    as Arrow tables in tables_path. Returns the number of rows of every table."""
+    pa = require_pyarrow()
+    schemas = table_schemas()
+    queries = subfolders(output_path)
+    rows = {name: [] for name in TABLES}
+    # reading the folders is I/O bound, so it is spread over threads
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for query_rows in executor.map(lambda query: query_table_rows(output_path, query), queries):
+            for name, table_rows in query_rows.items():
+                rows[name].extend(table_rows)
+    os.makedirs(tables_path, exist_ok=True)
+    for name, schema in schemas.items():
+        write_table(pa.Table.from_pylist(rows[name], schema=schema), os.path.join(tables_path, name + TABLE_EXTENSION))
+    return {name: len(table_rows) for name, table_rows in rows.items()}
+
+class OutputTables:
+    """Read side of the tables written by compact_outputs, with the read methods of ArtifactStore.
+
+    Every table is memory-mapped the first time it is used.
+    """
+
+    def __init__(self, tables_path):
+        if not os.path.exists(os.path.join(tables_path, 'queries' + TABLE_EXTENSION)):
+            raise FileNotFoundError(f'No tables in {tables_path}, write them with `python -m code.compact_outputs`')
+        self.path = tables_path
+        self.tables = {}
+
+    def table(self, name):
+        if name not in self.tables:
+            pa = require_pyarrow()
+            with pa.memory_map(os.path.join(self.path, name + TABLE_EXTENSION), 'r') as source:
+                self.tables[name] = pa.ipc.open_file(source).read_all()
+        return self.tables[name]
+
+    def queries(self):
+        return sorted(self.table('queries').column('query').to_pylist())
+
+    def passed_tasks(self, n):
+        """{query: {technique: [task, ...]}} of the first n tasks of every query, as in passed_tasks_for_each_technique.json."""
+        pc = require_pyarrow().compute
+        passes = self.table('technique_passes')
+        passes = passes.filter(pc.equal(passes.column('n'), n)).sort_by([('query', 'ascending'), ('position', 'ascending')])
+        passed = {query: {} for query in self.queries()}
+        for query, technique, tasks in zip(*(passes.column(column).to_pylist() for column in ['query', 'technique', 'tasks'])):
+            passed[query][technique] = tasks
+        return passed
+
+    def query_contexts(self):
+        """{query: (theme, programming concepts)} as written in theme.txt and programming_concepts.txt."""
+        queries = self.table('queries').sort_by('query')
+        return {query: (theme, concepts) for query, theme, concepts in
+                zip(*(queries.column(column).to_pylist() for column in ['query', 'theme', 'programming_concepts']))}
+
+    def close(self):
+        self.tables = {}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact an output tree into Arrow tables for the analysis scripts')
+    parser.add_argument('output_path', type=str, nargs='?', default='outputs', help='output tree to compact')
+    parser.add_argument('--tables_path', type=str, default=None, help='folder of the tables, <output_path>_tables by default')
+    parser.add_argument('--num_workers', type=int, default=8, help='threads reading the query folders')
+
+    #example command: python -m code.compact_outputs outputs --tables_path outputs_tables
+    args = parser.parse_args()
+    tables_path = args.tables_path or os.path.normpath(args.output_path) + '_tables'
+    num_rows = compact_outputs(args.output_path, tables_path, args.num_workers)
+    print(f'Wrote {tables_path}: ' + ', '.join(f'{name} ({count} rows)' for name, count in num_rows.items()))
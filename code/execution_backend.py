@@ -0,0 +1,455 @@
+import os
+import sys
+import json
+import time
+import atexit
+import select
+import signal
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from uuid import uuid4
+from concurrent.futures import ProcessPoolExecutor
+
+from .watchdog import Watchdog, set_cpu_limit, WATCHDOG_FD_ENV, CPU_LIMIT_ENV, COVERAGE_SOURCE_ENV
+from .line_coverage import LineCoverage, coverage_summary
+
+SUBPROCESS = 'subprocess'
+POOL = 'pool'
+# like POOL, but outcomes come back from the forked run through a plugin instead of a JSON report
+INPROCESS = 'inprocess'
+TEST_BACKENDS = [SUBPROCESS, POOL, INPROCESS]
+
+TEST_BACKEND = os.environ.get('TEST_BACKEND', SUBPROCESS)
+NUM_TEST_WORKERS = int(os.environ.get('NUM_TEST_WORKERS', os.cpu_count() or 4))
+# Pytest runs allowed at once across every query and task of the process
+MAX_CONCURRENT_TESTS = int(os.environ.get('MAX_CONCURRENT_TESTS', min(32, (os.cpu_count() or 1) + 4)))
+# Test the simulated students of a task in one pytest session instead of one session per student
+BATCH_STUDENT_TESTS = eval(os.environ.get('BATCH_STUDENT_TESTS', 'False'))
+# Wall-clock seconds a test (setup, call and teardown) may run before the watchdog kills its session
+TEST_TIMEOUT = float(os.environ.get('TEST_TIMEOUT', 5))
+# Wall-clock seconds a session may go without any progress outside of a test (start-up, collection, reporting)
+SESSION_TIMEOUT = float(os.environ.get('SESSION_TIMEOUT', 60))
+# CPU seconds of a pytest process (RLIMIT_CPU), should the watchdog itself fall behind
+TEST_CPU_LIMIT = int(os.environ.get('TEST_CPU_LIMIT', 120))
+# Outcome of a test the watchdog stopped, and the exit code of a session it stopped
+TIMEOUT = 'timeout'
+TIMEOUT_EXITCODE = 124
+CANCELLED = 'cancelled'
+# Timeouts in a row (without a test finishing in between) after which the remaining tests are not run
+MAX_CONSECUTIVE_TIMEOUTS = int(os.environ.get('MAX_CONSECUTIVE_TIMEOUTS', 2))
+# Seconds between two looks of the watchdog at the cancel token of its run
+CANCEL_POLL_INTERVAL = 0.05
+# Root of the package, kept off the path of sessions so that `code` is the standard library's module there
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only directory added to the path of subprocess sessions, holding the entry point of the watchdog plugin
+SESSION_PLUGIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'session_plugin')
+SESSION_PLUGIN = 'pytasksyn_watchdog'
+
+# Plugins are imported by the warm-up session, so forked runs would otherwise warn that they cannot be rewritten
+FORKED_PYTEST_ARGS = ['-W', 'ignore::pytest.PytestAssertRewriteWarning']
+
+WARM_UP_TEST = "def test_warm_up():\n    assert True\n"
+
+_pool = None
+_pool_lock = threading.Lock()
+test_slots = threading.BoundedSemaphore(MAX_CONCURRENT_TESTS)
+
+def set_test_backend(backend, num_workers=None, max_concurrent_tests=None, batch_student_tests=None):
+    global TEST_BACKEND, NUM_TEST_WORKERS, MAX_CONCURRENT_TESTS, BATCH_STUDENT_TESTS, test_slots
+    if backend not in TEST_BACKENDS:
+        raise ValueError(f'Unknown test backend {backend}, expected one of {TEST_BACKENDS}')
+    TEST_BACKEND = backend
+    if num_workers is not None:
+        NUM_TEST_WORKERS = num_workers
+    if max_concurrent_tests is not None:
+        MAX_CONCURRENT_TESTS = max_concurrent_tests
+        test_slots = threading.BoundedSemaphore(max_concurrent_tests)
+    if batch_student_tests is not None:
+        BATCH_STUDENT_TESTS = batch_student_tests
+    if backend in (POOL, INPROCESS):
+        # called before the pipeline starts any thread, which a forked worker could inherit with a lock held
+        start_pool()
+
+def warm_up_worker():
+    # A throwaway session imports pytest, its plugins and everything they load lazily,
+    # so that every run forked from this worker skips that work.
+    import tempfile
+    import pytest
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        test_path = os.path.join(tmp_dir, 'test_warm_up.py')
+        with open(test_path, 'w') as f:
+            f.write(WARM_UP_TEST)
+        stdout_fd, stderr_fd = os.dup(1), os.dup(2)
+        try:
+            redirect_output(os.devnull)
+            pytest.main(['-q', '-p', 'no:cacheprovider', test_path])
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(stdout_fd, 1)
+            os.dup2(stderr_fd, 2)
+            os.close(stdout_fd)
+            os.close(stderr_fd)
+
+def redirect_output(output_path, append=False):
+    fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC), 0o644)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+
+class ResultCollector:
+    """Outcome of every test phase of a run, built from the events of its Watchdog plugin.
+
+    result() has the `tests` and `summary` layout of a pytest-json-report report, so the same checks
+    apply to both.
+    """
+
+    def __init__(self):
+        self.tests = {}
+        self.collected = []
+        self.collection_errors = set()
+        self.running = None
+        self.timeouts = 0
+        self.restarts = 0
+        self.cancelled = False
+        self.executed_lines = set()
+
+    def feed(self, event):
+        kind = event['event']
+        if kind == 'collecterror':
+            # a restarted session reports the same collection errors again
+            self.collection_errors.add(event['nodeid'])
+        elif kind == 'collected' and not self.collected:
+            self.collected = event['nodeids']
+        elif kind == 'start':
+            self.running = event['nodeid']
+        elif kind == 'finish':
+            self.running = None
+        elif kind == 'coverage':
+            self.executed_lines.update(event['lines'])
+        elif kind == 'report':
+            test = self.tests.setdefault(event['nodeid'], {'nodeid': event['nodeid'], 'outcome': 'passed'})
+            phase = {'outcome': event['outcome']}
+            if event['outcome'] == 'failed':
+                phase['crash'] = {'message': event['message']}
+                test['outcome'] = 'failed' if event['when'] == 'call' else 'error'
+            elif event['outcome'] == 'skipped' and test['outcome'] == 'passed':
+                test['outcome'] = 'skipped'
+            test[event['when']] = phase
+
+    def interrupt(self, outcome, message):
+        """Record the phase of the running test its session was stopped in, as TIMEOUT or failed."""
+        nodeid, self.running = self.running, None
+        test = self.tests.setdefault(nodeid, {'nodeid': nodeid})
+        when = 'setup' if 'setup' not in test else 'call' if 'call' not in test else 'teardown'
+        test[when] = {'outcome': outcome, 'crash': {'message': message}}
+        test['outcome'] = outcome if outcome == TIMEOUT or when == 'call' else 'error'
+        return nodeid
+
+    def remaining(self):
+        return [nodeid for nodeid in self.collected if nodeid not in self.tests]
+
+    def give_up(self, outcome, message):
+        """Record every test without an outcome as outcome, without running it."""
+        remaining = self.remaining()
+        for nodeid in remaining:
+            self.tests[nodeid] = {'nodeid': nodeid, 'outcome': outcome, 'setup': {'outcome': outcome, 'crash': {'message': message}}}
+        return remaining
+
+    def result(self, reported=()):
+        # tests of a pytest-json-report report (reported) replace the ones built from events
+        tests = dict(self.tests, **{test['nodeid']: test for test in reported})
+        position = {nodeid: i for i, nodeid in enumerate(self.collected)}
+        tests = sorted(tests.values(), key=lambda test: position.get(test['nodeid'], len(position)))
+        summary = {'total': len(tests), 'collected': len(tests)}
+        for test in tests:
+            summary[test['outcome']] = summary.get(test['outcome'], 0) + 1
+        if self.collection_errors:
+            summary['error'] = summary.get('error', 0) + len(self.collection_errors)
+        if self.timeouts > summary.get(TIMEOUT, 0):
+            # the session itself timed out, outside of any test
+            summary[TIMEOUT] = self.timeouts
+        return {'tests': tests, 'summary': summary}
+
+def kill_session(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+class CancelToken:
+    """Cancels the runs of run_pytest it is passed to, the ones waiting for a slot and the running ones.
+
+    Runs of the pool backends are supervised in the workers, so the token is a file their watchdogs look for.
+    A token with a parent is also set once its parent is.
+    """
+
+    def __init__(self, parent=None):
+        self.path = os.path.join(tempfile.gettempdir(), f'pytest_cancel_{uuid4().hex}')
+        self.parent = parent
+
+    def set(self):
+        open(self.path, 'w').close()
+
+    def is_set(self):
+        return os.path.exists(self.path) or (self.parent is not None and self.parent.is_set())
+
+    def close(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def supervise(pid, read_fd, collector, cancel=None):
+    """Feed the events of session pid to collector until it closes its end of the pipe.
+
+    Kills the process group of the session when a test runs for more than TEST_TIMEOUT, the session goes
+    SESSION_TIMEOUT without an event or cancel is set, and returns TIMEOUT or CANCELLED when it did (None otherwise).
+    """
+    pending = b''
+    deadline = time.monotonic() + SESSION_TIMEOUT
+    try:
+        while True:
+            if cancel is not None and cancel.is_set():
+                kill_session(pid)
+                return CANCELLED
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                kill_session(pid)
+                return TIMEOUT
+            if cancel is not None:
+                remaining = min(remaining, CANCEL_POLL_INTERVAL)
+            if not select.select([read_fd], [], [], remaining)[0]:
+                continue
+            chunk = os.read(read_fd, 65536)
+            if not chunk:
+                return None
+            *lines, pending = (pending + chunk).split(b'\n')
+            for line in lines:
+                event = json.loads(line)
+                collector.feed(event)
+                if event['event'] == 'start':
+                    deadline = time.monotonic() + TEST_TIMEOUT
+                elif collector.running is None:
+                    deadline = time.monotonic() + SESSION_TIMEOUT
+    finally:
+        os.close(read_fd)
+
+def hide_package():
+    # a forked session would otherwise import this package for `import code`
+    sys.path[:] = [path for path in sys.path if not path or os.path.realpath(path) != PACKAGE_ROOT]
+    for name in [name for name in sys.modules if name == __package__ or name.startswith(__package__ + '.')]:
+        del sys.modules[name]
+
+def fork_session(args, output_path, cwd, write_fd, append, coverage_source=None):
+    # Each session runs in a child forked from the warm worker, so modules imported by the
+    # program under test (e.g. solution_program) never leak into the next job.
+    import pytest
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        exitcode = 1
+        try:
+            os.setpgid(0, 0)
+            set_cpu_limit(TEST_CPU_LIMIT)
+            if output_path is not None:
+                redirect_output(output_path, append)
+            if cwd is not None:
+                os.chdir(cwd)
+            watchdog = Watchdog(write_fd)
+            plugins = [watchdog] if coverage_source is None else [watchdog, LineCoverage(coverage_source, watchdog.send)]
+            hide_package()
+            exitcode = int(pytest.main(FORKED_PYTEST_ARGS + list(args), plugins=plugins))
+        except BaseException:
+            exitcode = 3
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exitcode)
+    try:
+        # also set here, the watchdog may have to kill the group before the child gets to it
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    return pid, lambda: os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+def spawn_session(args, output_path, cwd, write_fd, append, coverage_source=None):
+    env = dict(os.environ, **{WATCHDOG_FD_ENV: str(write_fd), CPU_LIMIT_ENV: str(TEST_CPU_LIMIT)})
+    if coverage_source is not None:
+        env[COVERAGE_SOURCE_ENV] = coverage_source
+    inherited = [path for path in env.get('PYTHONPATH', '').split(os.pathsep) if path and os.path.realpath(path) != PACKAGE_ROOT]
+    env['PYTHONPATH'] = os.pathsep.join([SESSION_PLUGIN_PATH] + inherited)
+    command = ['pytest', '-p', SESSION_PLUGIN] + list(args)
+    output = None if output_path is None else open(output_path, 'a' if append else 'w')
+    try:
+        process = subprocess.Popen(command, stdout=output, stderr=None if output is None else subprocess.STDOUT,
+                                   cwd=cwd, env=env, pass_fds=(write_fd,), start_new_session=True)
+    finally:
+        if output is not None:
+            output.close()
+    return process.pid, process.wait
+
+def json_report_file(args):
+    for arg in args:
+        if arg.startswith('--json-report-file='):
+            return arg[len('--json-report-file='):]
+    return None
+
+def merge_report(report_path, collector, exitcode):
+    # the last session only reports the tests it ran, the others are known from the events
+    try:
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        report = {}
+    report.update(collector.result(report.get('tests', [])), exitcode=exitcode)
+    with open(report_path, 'w') as f:
+        json.dump(report, f)
+
+def run_watched(start_session, args, output_path, cwd, cancel=None, coverage_source=None):
+    """Run a pytest session started by start_session under the watchdog.
+
+    A test that times out (or takes its session down with it) is recorded with outcome TIMEOUT (or failed),
+    and a new session runs the tests that have no outcome yet, unless the session timed out outside of a test
+    or MAX_CONSECUTIVE_TIMEOUTS times in a row: the tests left are then recorded as TIMEOUT without running.
+    A cancelled run stops without a report.
+    Returns the exit code and the ResultCollector.
+    """
+    collector = ResultCollector()
+    report_path = json_report_file(args)
+    if report_path is not None:
+        # a killed session writes no report, so a report left by an earlier run of the folder must not be merged
+        try:
+            os.remove(report_path)
+        except FileNotFoundError:
+            pass
+    consecutive_timeouts = 0
+    while True:
+        if cancel is not None and cancel.is_set():
+            collector.cancelled = True
+            return None, collector
+        num_done = len(collector.tests)
+        read_fd, write_fd = os.pipe()
+        try:
+            pid, wait = start_session(list(args) + [f'--deselect={nodeid}' for nodeid in collector.tests],
+                                      output_path, cwd, write_fd, collector.restarts > 0, coverage_source)
+        finally:
+            os.close(write_fd)
+        status = supervise(pid, read_fd, collector, cancel)
+        exitcode = wait()
+        if status == CANCELLED:
+            collector.cancelled = True
+            return exitcode, collector
+        # a session over its CPU limit is killed by the kernel instead
+        timed_out = status == TIMEOUT or exitcode in (-signal.SIGXCPU, -signal.SIGKILL)
+        if collector.running is None:
+            if timed_out:
+                collector.timeouts += 1
+                exitcode = TIMEOUT_EXITCODE
+                # e.g. a restarted session stuck importing the program, as the next one would be
+                skipped = collector.give_up(TIMEOUT, 'Timeout: not run, the test session timed out outside of a test')
+                if skipped and output_path is not None:
+                    with open(output_path, 'a') as f:
+                        f.write(f'\nSession TIMEOUT outside of a test, {len(skipped)} remaining tests not run\n')
+            break
+        if timed_out:
+            collector.timeouts += 1
+            # no test finished in this session before the one that timed out (whose setup may be recorded)
+            num_finished = len(collector.tests) - (collector.running in collector.tests)
+            consecutive_timeouts = consecutive_timeouts + 1 if num_finished == num_done else 1
+            nodeid = collector.interrupt(TIMEOUT, f'Timeout: the test ran for more than {TEST_TIMEOUT:g} s')
+        else:
+            consecutive_timeouts = 0
+            nodeid = collector.interrupt('failed', f'The test session exited with code {exitcode}')
+        remaining = collector.remaining()
+        give_up = remaining and consecutive_timeouts >= MAX_CONSECUTIVE_TIMEOUTS
+        if give_up:
+            collector.give_up(TIMEOUT, f'Timeout: not run after {consecutive_timeouts} tests in a row timed out')
+        if output_path is not None:
+            with open(output_path, 'a') as f:
+                f.write(f'\n{nodeid} {collector.tests[nodeid]["outcome"].upper()}'
+                        + (f', {len(remaining)} remaining tests not run after {consecutive_timeouts} timeouts in a row\n' if give_up
+                           else f', {len(remaining)} remaining tests run in a new session\n' if remaining else '\n'))
+        if not remaining or give_up:
+            exitcode = TIMEOUT_EXITCODE if timed_out else 1
+            break
+        collector.restarts += 1
+    if report_path is not None and (collector.timeouts or collector.restarts):
+        merge_report(report_path, collector, exitcode)
+    return exitcode, collector
+
+def run_session(start_session, args, output_path, cwd=None, collect=False, cancel=None, coverage_source=None):
+    exitcode, collector = run_watched(start_session, args, output_path, cwd, cancel, coverage_source)
+    coverage = None
+    if coverage_source is not None and not collector.cancelled:
+        coverage = coverage_summary(coverage_source, collector.executed_lines)
+    return {'exitcode': exitcode, 'report': collector.result() if collect else None, 'timeouts': collector.timeouts,
+            'cancelled': collector.cancelled, 'coverage': coverage}
+
+def run_forked_pytest(args, output_path, cwd=None, collect=False, cancel=None, coverage_source=None):
+    return run_session(fork_session, args, output_path, cwd, collect, cancel, coverage_source)
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=NUM_TEST_WORKERS,
+                                        mp_context=multiprocessing.get_context('fork'),
+                                        initializer=warm_up_worker)
+        return _pool
+
+def start_pool():
+    """Create the worker pool and start every one of its workers now rather than on their first jobs."""
+    pool = get_pool()
+    # before Python 3.11 a forked worker is only started when a job finds no idle one, so one job per worker
+    for future in [pool.submit(os.getpid) for _ in range(NUM_TEST_WORKERS)]:
+        future.result()
+    return pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+atexit.register(shutdown_pool)
+
+def run_pytest(args, output_path=None, backend=None, cwd=None, cancel=None, coverage_source=None):
+    """Run pytest with the given command-line arguments on the selected backend.
+
+    stdout and stderr are written to output_path, or inherited when it is None. With cwd set, the run
+    (and any files the program under test writes) happens in that directory, so paths in args must be absolute.
+    Every session runs under the watchdog (see run_watched), which also stops it once the CancelToken cancel is
+    set. With coverage_source, the lines of that program executed by the run are recorded (see line_coverage).
+    Returns a dict with the pytest exit code, the wall-clock duration of the run, its number of `timeouts`,
+    whether it was `cancelled` and the `coverage` summary of coverage_source (None without it); with the
+    inprocess backend it also holds the collected `report`.
+    """
+    backend = backend or TEST_BACKEND
+    if cwd is not None:
+        # the rootdir follows cwd, keep pytest's cache out of the agent folders
+        args = ['-p', 'no:cacheprovider'] + list(args)
+    with test_slots:
+        start = time.time()
+        if backend in (INPROCESS, POOL):
+            run = get_pool().submit(run_forked_pytest, args, output_path, cwd, backend == INPROCESS, cancel, coverage_source).result()
+        elif backend == SUBPROCESS:
+            run = run_session(spawn_session, args, output_path, cwd, False, cancel, coverage_source)
+        else:
+            raise ValueError(f'Unknown test backend {backend}, expected one of {TEST_BACKENDS}')
+    run.update(duration=time.time() - start, backend=backend)
+    return run
+
+def collects_results(backend=None):
+    return (backend or TEST_BACKEND) == INPROCESS
+
+def batches_student_tests():
+    return BATCH_STUDENT_TESTS
+
+def json_report_args(report_path, keep_report=True):
+    """pytest-json-report arguments for a run, left out when the backend collects the outcomes and no file is needed."""
+    if collects_results() and not keep_report:
+        return []
+    return ['--json-report', f'--json-report-file={report_path}']
@@ -1,32 +1,29 @@
-from .utils import check_passed_all_tests, get_coverage
+from .utils import check_passed_all_tests, run_passed_all_tests, get_coverage
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import multiprocessing
-import subprocess
+from . import execution_backend
 
 MAX_WORKERS = max(4, multiprocessing.cpu_count() - 1)
+ON_HEROKU = eval(os.environ.get("ON_HEROKU", "False"))
 
-def run_pytest(task_path, test_solution_results_file_path):
+def run_pytest(task_path, test_solution_results_file_path, cancel=None):
+    task_path = os.path.abspath(task_path)
     pytest_coverage_report_file_path = os.path.join(task_path, 'pytest_coverage_report.json')
     pytest_report_path = os.path.join(task_path, 'pytest_report.json')
     test_suite_sol_path = os.path.join(task_path, 'test_suite_sol.py')
     
     cmd = [
-        'pytest',
         '--no-header',
         '--quiet',
         '--tb=line',
-        '--timeout=5',
-        '--timeout_method=signal',
         # f'--cov=solution_program',
         # f'--cov-report=json:{pytest_coverage_report_file_path}',
-        '--json-report',
-        f'--json-report-file={pytest_report_path}',
+        *execution_backend.json_report_args(pytest_report_path, keep_report=not ON_HEROKU),
         test_suite_sol_path
     ]
     
-    with open(test_solution_results_file_path, 'w') as f:
-        subprocess.run(cmd, stdout=f, stderr=subprocess.STDOUT, check=False)
+    return execution_backend.run_pytest(cmd, test_solution_results_file_path, cwd=task_path, cancel=cancel)
 
 def prepare_test_suite(task_path):
     test_suite_sol_path = os.path.join(task_path, 'test_suite_sol.py')
@@ -39,12 +36,14 @@ def prepare_test_suite(task_path):
     
     return test_suite_sol_path
 
-def check_gen_consistency(task_path):
+def check_gen_consistency(task_path, cancel=None):
     try:
         prepare_test_suite(task_path)
         test_solution_results_file_path = os.path.join(task_path, 'test_solution_results.txt')
-        run_pytest(task_path, test_solution_results_file_path)
-        return check_passed_all_tests(os.path.join(task_path, 'pytest_report.json'))
+        run = run_pytest(task_path, test_solution_results_file_path, cancel)
+        if run['cancelled']:
+            return 0
+        return run_passed_all_tests(run, os.path.join(task_path, 'pytest_report.json'))
     except Exception as e:
         print(f"Failed to test solution for task {task_path}: {e}")
         return 0
\ No newline at end of file
@@ -0,0 +1,165 @@
+import os
+import re
+import ast
+import dis
+import io
+import sys
+import threading
+import tokenize
+
+# Lines excluded from the statements as with coverage.py's default exclusion, with the block they open
+EXCLUDE_PATTERN = re.compile(r'#\s*(pragma|PRAGMA)[:\s]?\s*(no|NO)\s*(cover|COVER)')
+
+def logical_lines(source):
+    """{line: first line of its logical line} for lines of statements written over several lines."""
+    first_lines = {}
+    start = None
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        if token.type in (tokenize.COMMENT, tokenize.NL, tokenize.INDENT, tokenize.DEDENT, tokenize.ENCODING):
+            continue
+        if start is None:
+            start = token.start[0]
+        if token.type in (tokenize.NEWLINE, tokenize.ENDMARKER):
+            for line in range(start, token.end[0] + 1):
+                first_lines[line] = start
+            start = None
+    return first_lines
+
+def code_lines(code):
+    """Lines with bytecode in code and in every code object nested in it (functions, classes, lambdas)."""
+    # the module's code starts at line 0 on Python 3.11+
+    lines = {line for _, line in dis.findlinestarts(code) if line}
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            lines |= code_lines(const)
+    return lines
+
+def docstring_lines(tree):
+    lines = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+                lines.update(range(first.lineno, first.end_lineno + 1))
+    return lines
+
+def excluded_lines(source, tree):
+    excluded = {i for i, line in enumerate(source.splitlines(), 1) if EXCLUDE_PATTERN.search(line)}
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.stmt, ast.ExceptHandler)):
+            # a decorated definition starts at its first decorator
+            start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+            if excluded & set(range(start, node.lineno + 1)):
+                excluded.update(range(start, node.end_lineno + 1))
+    return excluded
+
+def statement_lines(source, filename='<program>'):
+    """Line numbers of the statements of a program, as coverage.py counts them: the first line of every logical line
+    with bytecode, without docstrings and lines excluded with `# pragma: no cover`. Returns (statements, first_lines)."""
+    tree = ast.parse(source, filename)
+    first_lines = logical_lines(source)
+    lines = {first_lines.get(line, line) for line in code_lines(compile(tree, filename, 'exec'))}
+    return lines - docstring_lines(tree) - excluded_lines(source, tree), first_lines
+
+def coverage_summary(source_path, executed_lines):
+    """Percent covered and executed and missing statement lines of the program at source_path, given the lines
+    traced while it ran. A program that cannot be read or parsed has no statements and is not covered."""
+    try:
+        with open(source_path, 'r') as f:
+            statements, first_lines = statement_lines(f.read(), source_path)
+        percent_covered = 100.0
+    except (OSError, SyntaxError, ValueError):
+        statements, first_lines, percent_covered = set(), {}, 0.0
+    executed = {first_lines.get(line, line) for line in executed_lines} & statements
+    return {
+        'percent_covered': len(executed) / len(statements) * 100 if statements else percent_covered,
+        'num_statements': len(statements),
+        'covered_lines': len(executed),
+        'executed_lines': sorted(executed),
+        'missing_lines': sorted(statements - executed),
+    }
+
+def coverage_report(source_path, summary):
+    """The parts of pytest-cov's JSON report read by utils.get_coverage and get_not_covered_lines."""
+    totals = {key: summary[key] for key in ['covered_lines', 'num_statements', 'percent_covered']}
+    totals['missing_lines'] = len(summary['missing_lines'])
+    return {
+        'files': {os.path.basename(source_path): {'executed_lines': summary['executed_lines'], 'missing_lines': summary['missing_lines'], 'summary': totals}},
+        'totals': totals,
+    }
+
+class LineCoverage:
+    """pytest plugin recording the lines executed in one source file, sent with send() after every test.
+
+    Uses sys.monitoring where available (Python 3.12+), where each line only reports once, and otherwise a
+    trace function that only traces the frames of the source file.
+    """
+
+    def __init__(self, source_path, send):
+        self.source_path = os.path.realpath(source_path)
+        self.send = send
+        self.lines = set()
+        self.sent = set()
+        self.targets = {}
+
+    def is_target(self, filename):
+        target = self.targets.get(filename)
+        if target is None:
+            target = self.targets[filename] = os.path.realpath(filename) == self.source_path
+        return target
+
+    def on_line(self, code, line):
+        if self.is_target(code.co_filename):
+            self.lines.add(line)
+        return sys.monitoring.DISABLE
+
+    def on_call(self, frame, event, arg):
+        if event == 'call' and self.is_target(frame.f_code.co_filename):
+            return self.on_trace_line
+        return None
+
+    def on_trace_line(self, frame, event, arg):
+        if event == 'line':
+            self.lines.add(frame.f_lineno)
+        return self.on_trace_line
+
+    def start(self):
+        if hasattr(sys, 'monitoring'):
+            monitoring = sys.monitoring
+            monitoring.use_tool_id(monitoring.COVERAGE_ID, 'line_coverage')
+            monitoring.register_callback(monitoring.COVERAGE_ID, monitoring.events.LINE, self.on_line)
+            monitoring.set_events(monitoring.COVERAGE_ID, monitoring.events.LINE)
+        else:
+            threading.settrace(self.on_call)
+            sys.settrace(self.on_call)
+
+    def stop(self):
+        if hasattr(sys, 'monitoring'):
+            monitoring = sys.monitoring
+            monitoring.set_events(monitoring.COVERAGE_ID, 0)
+            monitoring.register_callback(monitoring.COVERAGE_ID, monitoring.events.LINE, None)
+            monitoring.free_tool_id(monitoring.COVERAGE_ID)
+        else:
+            sys.settrace(None)
+            threading.settrace(None)
+
+    def flush(self):
+        # lines reach the supervisor as tests finish, so a session killed later still counts them
+        new_lines = self.lines - self.sent
+        if new_lines:
+            self.send({'event': 'coverage', 'lines': sorted(new_lines)})
+            self.sent |= new_lines
+
+    def pytest_sessionstart(self, session):
+        self.start()
+
+    def pytest_collection_finish(self, session):
+        # lines run at import, before the first test
+        self.flush()
+
+    def pytest_runtest_logfinish(self, nodeid, location):
+        self.flush()
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        self.stop()
+        self.flush()
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from openai.types.chat import ParsedChatCompletion
+
+# Get the directory of the current script
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+
+BYPASS = 'bypass'
+READ_ONLY = 'read_only'
+READ_WRITE = 'read_write'
+CACHE_MODES = [BYPASS, READ_ONLY, READ_WRITE]
+
+DEFAULT_CACHE_PATH = os.path.join(parent_dir, '.llm_cache', 'responses.sqlite')
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+class CacheMissError(Exception):
+    pass
+
+def request_key(request, backend=None):
+    """Content hash of everything that determines a completion, including the backend that serves it
+    unless it is OpenAI (None), whose completions keep the keys they were cached under."""
+    response_format = request.get('response_format')
+    key_fields = {
+        'model': request.get('model'),
+        'messages': request.get('messages'),
+        'response_format': response_format.model_json_schema() if response_format is not None else None,
+        'n': request.get('n', 1),
+        'temperature': request.get('temperature'),
+        'seed': request.get('seed'),
+        'max_tokens': request.get('max_tokens'),
+    }
+    if backend is not None:
+        key_fields['backend'] = backend
+    return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """Persistent completion cache stored in a single SQLite file with size-bounded LRU eviction.
+
+    In read_only mode hits are served without touching the file and misses raise CacheMissError,
+    so an experiment can be replayed without any network traffic.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, mode=BYPASS, max_bytes=DEFAULT_MAX_BYTES):
+        if mode not in CACHE_MODES:
+            raise ValueError(f'Unknown cache mode {mode}, expected one of {CACHE_MODES}')
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = None
+        if mode != BYPASS:
+            self.connect()
+
+    def connect(self):
+        if self.mode == READ_ONLY:
+            self.conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=30, check_same_thread=False)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self.conn.commit()
+
+    def get(self, request, backend=None):
+        if self.mode == BYPASS:
+            return None
+        key = request_key(request, backend)
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.mode == READ_ONLY:
+                    raise CacheMissError(f'No cached response for {request.get("model")} request {key}')
+                return None
+            self.hits += 1
+            if self.mode == READ_WRITE:
+                self.conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+                self.conn.commit()
+        return ParsedChatCompletion[request['response_format']].model_validate_json(row[0])
+
+    def put(self, request, completion, backend=None):
+        if self.mode != READ_WRITE:
+            return
+        key = request_key(request, backend)
+        value = completion.model_dump_json()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+                              (key, value, len(value), time.time()))
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        total_size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall():
+            self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total_size -= size
+            if total_size <= self.max_bytes:
+                break
+
+    def clear(self):
+        if self.mode != READ_WRITE:
+            return
+        with self.lock:
+            self.conn.execute('DELETE FROM responses')
+            self.conn.commit()
+
+response_cache = ResponseCache(
+    path=os.environ.get('LLM_CACHE_PATH', DEFAULT_CACHE_PATH),
+    mode=os.environ.get('LLM_CACHE_MODE', BYPASS),
+    max_bytes=int(os.environ.get('LLM_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+)
+
+def configure_cache(mode, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+    global response_cache
+    response_cache = ResponseCache(path=path, mode=mode, max_bytes=max_bytes)
+    return response_cache
+
+def get_cache():
+    return response_cache
@@ -0,0 +1,129 @@
+import os
+import asyncio
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI, AsyncOpenAI
+from .llm_cache import get_cache
+from .rate_limiter import call_with_rate_limit, async_call_with_rate_limit
+from . import mock_llm
+
+OPENAI_BACKEND = 'openai'
+MOCK_BACKEND = 'mock'
+LLM_BACKENDS = [OPENAI_BACKEND, MOCK_BACKEND]
+
+LLM_BACKEND = os.environ.get('LLM_BACKEND', OPENAI_BACKEND)
+
+# Clients are created on first use, so importing the pipeline needs no API key (e.g. with the mock backend)
+_client = None
+_mock_clients = {}
+_client_lock = threading.Lock()
+
+# Upper bound on in-flight requests issued through the async client (per event loop)
+MAX_CONCURRENT_REQUESTS = 16
+
+# Shared by every thread of the process, so concurrent queries (--jobs) draw on one request budget
+request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+# Threads that block on request_slots for coroutines, apart from the loops' default executors (e.g. DNS lookups)
+_slot_waiters = ThreadPoolExecutor(max_workers=4 * MAX_CONCURRENT_REQUESTS, thread_name_prefix='request_slot')
+
+# AsyncOpenAI keeps an httpx connection pool bound to the loop it was first used on,
+# so both the client and the semaphore are created once per running event loop.
+_async_clients = weakref.WeakKeyDictionary()
+_async_semaphores = weakref.WeakKeyDictionary()
+
+def set_llm_backend(backend):
+    global LLM_BACKEND, _client
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f'Unknown LLM backend {backend}, expected one of {LLM_BACKENDS}')
+    with _client_lock:
+        LLM_BACKEND = backend
+        _client = None
+        _mock_clients.clear()
+    _async_clients.clear()
+
+def get_mock_client(completions_class):
+    with _client_lock:
+        if completions_class not in _mock_clients:
+            _mock_clients[completions_class] = mock_llm.mock_client(completions_class())
+        return _mock_clients[completions_class]
+
+def get_client():
+    global _client
+    if LLM_BACKEND == MOCK_BACKEND:
+        return get_mock_client(mock_llm.MockCompletions)
+    with _client_lock:
+        if _client is None:
+            # retries are handled by the rate limiter, which also knows about the other in-flight requests
+            _client = OpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+        return _client
+
+def get_async_client():
+    if LLM_BACKEND == MOCK_BACKEND:
+        return get_mock_client(mock_llm.AsyncMockCompletions)
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+    return _async_clients[loop]
+
+def get_async_semaphore():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_semaphores:
+        _async_semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _async_semaphores[loop]
+
+def cache_backend():
+    # synthetic completions of the mock are cached apart from OpenAI's, so they are never replayed as real ones
+    return None if LLM_BACKEND == OPENAI_BACKEND else LLM_BACKEND
+
+def without_unset(request):
+    # Optional fields such as seed are left out of the request rather than sent as null
+    return {key: value for key, value in request.items() if value is not None}
+
+def parse_completion(**request):
+    request = without_unset(request)
+    cache = get_cache()
+    completion = cache.get(request, cache_backend())
+    if completion is None:
+        def call():
+            with request_slots:
+                return get_client().beta.chat.completions.parse(**request)
+        completion = call_with_rate_limit(call, request)
+        cache.put(request, completion, cache_backend())
+    return completion
+
+def wait_for_slot(cancelled):
+    request_slots.acquire()
+    if cancelled.is_set():
+        request_slots.release()
+        return False
+    return True
+
+async def acquire_request_slot():
+    # Waits in a thread so the event loop keeps running; a slot acquired for a cancelled caller is released again,
+    # either by the waiting thread or, once it has handed the slot over, by the callback
+    cancelled = threading.Event()
+    waiting = _slot_waiters.submit(wait_for_slot, cancelled)
+    try:
+        await asyncio.wrap_future(waiting)
+    except asyncio.CancelledError:
+        cancelled.set()
+        waiting.add_done_callback(lambda future: request_slots.release() if not future.cancelled() and future.result() else None)
+        raise
+
+async def async_parse_completion(**request):
+    request = without_unset(request)
+    cache = get_cache()
+    completion = cache.get(request, cache_backend())
+    if completion is None:
+        async def call():
+            async with get_async_semaphore():
+                await acquire_request_slot()
+                try:
+                    return await get_async_client().beta.chat.completions.parse(**request)
+                finally:
+                    request_slots.release()
+        completion = await async_call_with_rate_limit(call, request)
+        cache.put(request, completion, cache_backend())
+    return completion
@@ -3,15 +3,25 @@ import os
 import json
 import argparse
 from datetime import datetime
-# from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import time
+import asyncio
 from .query_agents import query_simulated_students, parse_simulated_students_responses, query_simulated_tutor, query_simulated_judge
+from .query_agents import async_query_simulated_students, async_query_simulated_tutor, async_query_simulated_judge
 from .run_test import test_simulated_students, compute_simulated_distribution, test_ta_testsuite
-from .analyze import analyze_results
 import random
 from .utils import check_passed_all_tests, get_coverage
-from .task_generation import gen_tasks, parse_task
+from .task_generation import gen_tasks, async_gen_tasks, parse_task
 from .gen_consistency import check_gen_consistency
+from .pipeline_dag import Stage, run_dag, gates_passed, CPU, NETWORK
+from .checkpoint import run_stage, async_run_stage, set_resume
+from .llm_cache import configure_cache, CACHE_MODES, BYPASS, DEFAULT_CACHE_PATH
+from .rate_limiter import configure_rate_limits
+from .llm_client import set_llm_backend, LLM_BACKENDS, LLM_BACKEND
+from .mock_llm import configure_mock
+from .artifact_store import configure_artifact_store, get_artifact_store
+from .execution_backend import CancelToken, set_test_backend, TEST_BACKENDS, TEST_BACKEND, NUM_TEST_WORKERS, MAX_CONCURRENT_TESTS, BATCH_STUDENT_TESTS
 from time import sleep
 import logging
 random.seed(1)
@@ -36,38 +46,203 @@ def get_task(path_to_selected_task):
         test_driver = f.read()
     return task_description, solution_code, test_driver
 
-def validate_query(theme, programming_concepts, query_path, model_configuration, task_responses, num_tasks_per_pair):
+def get_selected_task(task_dict, i):
+    task = f'task_{i}'
+    print('task_dict[task]:', task_dict[task])
+    return task_dict[task]['task_description'], task_dict[task]['solution_program'], task_dict[task]['test_suite']
+
+def first_passing_task(validated, num_tasks_per_pair):
+    # The lowest passing index is only confirmed once every task before it has failed
+    for i in range(num_tasks_per_pair):
+        if i not in validated:
+            return None
+        if validated[i]:
+            return i
+    return None
+
+def validate_task(i, theme, programming_concepts, query_path, model_configuration, task_responses, task_dict, stop_event=None):
+    task = f'task_{i}'
+    task_path = os.path.join(query_path, task)
+    task, task_description, solution_program, test_suite = run_stage(query_path, task, 'parse', lambda: parse_task(i, task_responses[i], query_path, theme, programming_concepts), model_configuration)
+    task_dict[task] = {
+        'task_description': task_description,
+        'solution_program': solution_program,
+        'test_suite': test_suite
+    }
+    stopped = lambda: stop_event is not None and stop_event.is_set()
+    if not ON_HEROKU:
+        run_stage(query_path, task, 'judge', lambda: query_simulated_judge(query_path, theme, programming_concepts, task, model_configuration, task_dict), model_configuration)
+    if stopped():
+        return False
+    gen_consistency = run_stage(query_path, task, 'gen_consistency', lambda: check_gen_consistency(task_path), model_configuration)
+    if (not ON_HEROKU or gen_consistency) and not stopped():
+        context_satisfied = run_stage(query_path, task, 'tutor', lambda: query_simulated_tutor(query_path, theme, programming_concepts, task, model_configuration, task_dict), model_configuration)
+        print('context_satisfied:', context_satisfied)
+        if (not ON_HEROKU or context_satisfied) and not stopped():
+            high_quality_testsuite = run_stage(query_path, task, 'tutor_testsuite', lambda: test_ta_testsuite(query_path, task), model_configuration)
+            print('high_quality_testsuite:', high_quality_testsuite)
+            if (not ON_HEROKU or high_quality_testsuite) and not stopped():
+                run_stage(query_path, task, 'students', lambda: query_simulated_students(query_path, task, model_configuration, task_dict), model_configuration)
+                # the analysis needs every student's report, so only the served pipeline exits early
+                passed_students = run_stage(query_path, task, 'student_tests', lambda: test_simulated_students(query_path, task, early_exit=ON_HEROKU), model_configuration)
+                print('test_simulated_students:', passed_students)
+                return passed_students
+    return False
+
+def task_stages(task, task_path, theme, programming_concepts, query_path, model_configuration, task_dict):
+    # Off Heroku every stage runs regardless of the others, as in validate_task
+    gate = ON_HEROKU
+    checkpointed = lambda stage, fn: (lambda **inputs: run_stage(query_path, task, stage, fn, model_configuration))
+    stages = [
+        Stage('gen_consistency', checkpointed('gen_consistency', lambda: check_gen_consistency(task_path)), pool=CPU, gate=gate),
+        Stage('tutor', checkpointed('tutor', lambda: query_simulated_tutor(query_path, theme, programming_concepts, task, model_configuration, task_dict)),
+              gated_by=['gen_consistency'], pool=NETWORK, gate=gate),
+        Stage('tutor_testsuite', checkpointed('tutor_testsuite', lambda: test_ta_testsuite(query_path, task)),
+              requires=['tutor'], gated_by=['gen_consistency'], pool=CPU, gate=gate),
+        # students only need the task description, so they are generated while the tutor is validated
+        Stage('students', checkpointed('students', lambda: query_simulated_students(query_path, task, model_configuration, task_dict)),
+              gated_by=['gen_consistency', 'tutor', 'tutor_testsuite'], pool=NETWORK),
+        Stage('student_tests', checkpointed('student_tests', lambda: test_simulated_students(query_path, task, early_exit=ON_HEROKU)),
+              requires=['students'], gated_by=['gen_consistency', 'tutor', 'tutor_testsuite'], pool=CPU, gate=gate),
+    ]
+    if not ON_HEROKU:
+        # the judge is independent of every other stage
+        stages.append(Stage('judge', checkpointed('judge', lambda: query_simulated_judge(query_path, theme, programming_concepts, task, model_configuration, task_dict)), pool=NETWORK))
+    return stages
+
+def validate_task_dag(i, theme, programming_concepts, query_path, model_configuration, task_responses, task_dict, stop_event=None):
+    task = f'task_{i}'
+    task_path = os.path.join(query_path, task)
+    task, task_description, solution_program, test_suite = run_stage(query_path, task, 'parse', lambda: parse_task(i, task_responses[i], query_path, theme, programming_concepts), model_configuration)
+    task_dict[task] = {
+        'task_description': task_description,
+        'solution_program': solution_program,
+        'test_suite': test_suite
+    }
+    stages = task_stages(task, task_path, theme, programming_concepts, query_path, model_configuration, task_dict)
+    results, status = run_dag(stages, speculative=True, stop_event=stop_event)
+    print(f'{task} stages:', status)
+    return gates_passed(stages, status) and bool(results.get('student_tests', False))
+
+def validate_query(theme, programming_concepts, query_path, model_configuration, task_responses, num_tasks_per_pair, num_parallel_tasks=1, use_dag=False):
     student_population_passing_threshold = model_configuration['student']['population_passing_threshold']
 
     task_dict = {}
+    validate = validate_task_dag if use_dag else validate_task
 
-    for i in range(num_tasks_per_pair):
-        task = f'task_{i}'
-        task_path = os.path.join(query_path, task)
-        task, task_description, solution_program, test_suite = parse_task(i, task_responses[i], query_path, theme, programming_concepts)
-        task_dict[task] = {
-            'task_description': task_description,
-            'solution_program': solution_program,
-            'test_suite': test_suite
-        }
-        if not ON_HEROKU:
-            query_simulated_judge(query_path, theme, programming_concepts, task, model_configuration, task_dict)
-        gen_consistency = check_gen_consistency(task_path)
-        if not ON_HEROKU or gen_consistency:
-            context_satisfied = query_simulated_tutor(query_path, theme, programming_concepts, task, model_configuration, task_dict)
-            print('context_satisfied:', context_satisfied)
-            if not ON_HEROKU or context_satisfied:                
-                high_quality_testsuite = test_ta_testsuite(query_path, task)
-                print('high_quality_testsuite:', high_quality_testsuite)
-                if not ON_HEROKU or high_quality_testsuite:
-                    query_simulated_students(query_path, task, model_configuration, task_dict)
-                    print('test_simulated_students:', test_simulated_students(query_path, task))
-                    if test_simulated_students(query_path, task) and ON_HEROKU:
-                        print('task_dict[task]:', task_dict[task])
-                        return task_dict[task]['task_description'], task_dict[task]['solution_program'], task_dict[task]['test_suite']
-    return None, None, None
-
-def generate_task(query=None, theme=None, programming_concepts=None, model_configuration=None, num_tasks_per_pair=10, output_path='outputs'):
+    if num_parallel_tasks <= 1:
+        for i in range(num_tasks_per_pair):
+            if validate(i, theme, programming_concepts, query_path, model_configuration, task_responses, task_dict) and ON_HEROKU:
+                return get_selected_task(task_dict, i)
+        return None, None, None
+
+    # Several task pipelines run at once; on Heroku the lowest-index passing task is still the one served,
+    # and the tasks after it are stopped at their next stage as soon as it is confirmed
+    validated = {}
+    selected = None
+    stop_events = [threading.Event() for _ in range(num_tasks_per_pair)]
+    executor = ThreadPoolExecutor(max_workers=num_parallel_tasks)
+    futures = {
+        executor.submit(validate, i, theme, programming_concepts, query_path, model_configuration, task_responses, task_dict, stop_events[i]): i
+        for i in range(num_tasks_per_pair)
+    }
+    failed = True
+    try:
+        for future in as_completed(futures):
+            validated[futures[future]] = future.result()
+            if ON_HEROKU:
+                selected = first_passing_task(validated, num_tasks_per_pair)
+            if selected is not None:
+                for j in range(selected + 1, num_tasks_per_pair):
+                    stop_events[j].set()
+                break
+        failed = False
+    finally:
+        if failed:
+            # a stage raised: the other pipelines stop at their next stage before the error is passed on
+            for stop_event in stop_events:
+                stop_event.set()
+        executor.shutdown(wait=failed or selected is None, cancel_futures=True)
+
+    if selected is None:
+        return None, None, None
+    return get_selected_task(task_dict, selected)
+
+def in_thread(executor, fn, *args, **kwargs):
+    return asyncio.get_running_loop().run_in_executor(executor, lambda: fn(*args, **kwargs))
+
+def close_after(executor, tokens):
+    # the tokens stay set until the stages still running on executor have stopped
+    executor.shutdown(wait=True)
+    for token in tokens:
+        token.close()
+
+async def async_validate_task(i, theme, programming_concepts, query_path, model_configuration, task_responses, task_dict, stage_executor=None, cancel=None):
+    task = f'task_{i}'
+    task_path = os.path.join(query_path, task)
+    task, task_description, solution_program, test_suite = run_stage(query_path, task, 'parse', lambda: parse_task(i, task_responses[i], query_path, theme, programming_concepts), model_configuration)
+    task_dict[task] = {
+        'task_description': task_description,
+        'solution_program': solution_program,
+        'test_suite': test_suite
+    }
+    if not ON_HEROKU:
+        await async_run_stage(query_path, task, 'judge', lambda: async_query_simulated_judge(query_path, theme, programming_concepts, task, model_configuration, task_dict), model_configuration)
+    # pytest runs are blocking, so they are moved off the event loop; cancel stops them once the pipeline is cancelled
+    gen_consistency = await async_run_stage(query_path, task, 'gen_consistency', lambda: in_thread(stage_executor, check_gen_consistency, task_path, cancel), model_configuration)
+    if not ON_HEROKU or gen_consistency:
+        context_satisfied = await async_run_stage(query_path, task, 'tutor', lambda: async_query_simulated_tutor(query_path, theme, programming_concepts, task, model_configuration, task_dict), model_configuration)
+        print('context_satisfied:', context_satisfied)
+        if not ON_HEROKU or context_satisfied:
+            high_quality_testsuite = await async_run_stage(query_path, task, 'tutor_testsuite', lambda: in_thread(stage_executor, test_ta_testsuite, query_path, task, cancel), model_configuration)
+            print('high_quality_testsuite:', high_quality_testsuite)
+            if not ON_HEROKU or high_quality_testsuite:
+                await async_run_stage(query_path, task, 'students', lambda: async_query_simulated_students(query_path, task, model_configuration, task_dict), model_configuration)
+                passed_students = await async_run_stage(query_path, task, 'student_tests', lambda: in_thread(stage_executor, test_simulated_students, query_path, task, early_exit=ON_HEROKU, cancel=cancel), model_configuration)
+                print('test_simulated_students:', passed_students)
+                return passed_students
+    return False
+
+async def async_validate_query(theme, programming_concepts, query_path, model_configuration, task_responses, num_tasks_per_pair):
+    task_dict = {}
+    # The blocking stages run on an executor of their own, which is not waited for once the pipelines that
+    # still use it are cancelled (asyncio.run would wait for the default one)
+    stage_executor = ThreadPoolExecutor(max_workers=num_tasks_per_pair)
+    cancels = [CancelToken() for _ in range(num_tasks_per_pair)]
+    # All tasks of the pool are validated concurrently; the selected task is still the first passing one
+    pipelines = {
+        asyncio.ensure_future(async_validate_task(i, theme, programming_concepts, query_path, model_configuration, task_responses, task_dict, stage_executor, cancels[i])): i
+        for i in range(num_tasks_per_pair)
+    }
+    validated = {}
+    selected = None
+    pending = set(pipelines)
+    try:
+        while pending and selected is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for pipeline in done:
+                validated[pipelines[pipeline]] = pipeline.result()
+            if ON_HEROKU:
+                selected = first_passing_task(validated, num_tasks_per_pair)
+    finally:
+        # also when a pipeline raised, so that the others do not keep running
+        for pipeline in pending:
+            cancels[pipelines[pipeline]].set()
+            pipeline.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        stage_executor.shutdown(wait=False, cancel_futures=True)
+        threading.Thread(target=close_after, args=(stage_executor, cancels), daemon=True).start()
+
+    if selected is None:
+        return None, None, None
+    return get_selected_task(task_dict, selected)
+
+async def async_generate_and_validate(query_path, theme, programming_concepts, num_tasks_per_pair, model_configuration):
+    task_responses = await async_run_stage(query_path, None, 'gen_tasks', lambda: async_gen_tasks(query_path, theme, programming_concepts, num_tasks_per_pair, model_configuration), model_configuration)
+    print('Successfully generated tasks')
+    return await async_validate_query(theme, programming_concepts, query_path, model_configuration, task_responses, num_tasks_per_pair)
+
+def generate_task(query=None, theme=None, programming_concepts=None, model_configuration=None, num_tasks_per_pair=10, output_path='outputs', use_async=False, num_parallel_tasks=1, use_dag=False):
     start = time.time()
     if model_configuration==None:
         with open(os.path.join(parent_dir, 'data', 'model_configuration.json'), 'r') as f:
@@ -89,12 +264,16 @@ def generate_task(query=None, theme=None, programming_concepts=None, model_confi
         with open(os.path.join(query_path, 'programming_concepts.txt'), 'w') as f:
             f.write(str(programming_concepts))
 
-    ### Generate a pool of tasks
-    task_responses = gen_tasks(query_path, theme, programming_concepts, num_tasks_per_pair, model_configuration)
+    if use_async:
+        ### Generate and validate the pool of tasks on a single event loop
+        selected_task_description, selected_solution_program, selected_test_suite = asyncio.run(async_generate_and_validate(query_path, theme, programming_concepts, num_tasks_per_pair, model_configuration))
+    else:
+        ### Generate a pool of tasks
+        task_responses = run_stage(query_path, None, 'gen_tasks', lambda: gen_tasks(query_path, theme, programming_concepts, num_tasks_per_pair, model_configuration), model_configuration)
 
-    print('Successfully generated tasks')
+        print('Successfully generated tasks')
 
-    selected_task_description, selected_solution_program, selected_test_suite = validate_query(theme, programming_concepts, query_path, model_configuration, task_responses, num_tasks_per_pair)
+        selected_task_description, selected_solution_program, selected_test_suite = validate_query(theme, programming_concepts, query_path, model_configuration, task_responses, num_tasks_per_pair, num_parallel_tasks, use_dag)
     
     print("selected_task_description:", selected_task_description)
     print("selected_solution_program:", selected_solution_program)
@@ -131,6 +310,23 @@ def sample(themes, programming_concepts, num_themes, num_num_concept_lists_per_t
     
     return sampled
     
+def run_query(query, theme, programming_concepts, model_configuration, num_tasks_per_pair=10, output_path='outputs', use_async=False, num_parallel_tasks=1, use_dag=False, seed=None, incremental_analysis=False):
+    """Generate, validate and analyze one (theme, concepts) pair in its own query folder."""
+    if seed is not None:
+        model_configuration = dict(model_configuration, seed=seed)
+    query_name = 'query_' + str(query)
+    generate_task(query_name, theme, programming_concepts, model_configuration, num_tasks_per_pair, output_path, use_async, num_parallel_tasks, use_dag)
+    query_path = os.path.join(output_path, query_name)
+    # the analysis libraries (pandas, scipy, sklearn) are only loaded once a query is analyzed
+    from .analyze import analyze_results
+    # a resumed query only re-analyzes the tasks whose reports or annotations changed
+    analyze_results(query_path, incremental=incremental_analysis)
+    summary_dict = compute_simulated_distribution(query_path, num_tasks_per_pair, incremental=incremental_analysis)
+    if get_artifact_store() is not None:
+        # queued for the store's writer thread, which batches the writes of all queries
+        get_artifact_store().import_query(query_path)
+    return summary_dict
+
 if __name__=="__main__":
 
     parser = argparse.ArgumentParser(description='Generate tasks for students')
@@ -138,12 +334,37 @@ if __name__=="__main__":
     parser.add_argument('--num_concept_lists_per_theme', type=int, default=1)  
     parser.add_argument('--num_tasks_per_pair', type=int, default=10)
     parser.add_argument('--output_path', type=str, default='outputs')
+    parser.add_argument('--use_async', action='store_true', help='query agents with AsyncOpenAI and validate all tasks of a pool concurrently')
+    parser.add_argument('--num_parallel_tasks', type=int, default=1, help='number of task pipelines validated at once')
+    parser.add_argument('--use_dag', action='store_true', help='schedule the validation stages of each task as a DAG, running independent stages concurrently')
+    parser.add_argument('--resume', action='store_true', help='skip stages recorded as complete in each query manifest whose outputs are still valid')
+    parser.add_argument('--llm_cache', type=str, default=os.environ.get('LLM_CACHE_MODE', BYPASS), choices=CACHE_MODES, help='response cache mode for all agent calls')
+    parser.add_argument('--llm_cache_path', type=str, default=os.environ.get('LLM_CACHE_PATH', DEFAULT_CACHE_PATH))
+    parser.add_argument('--llm_backend', type=str, default=LLM_BACKEND, choices=LLM_BACKENDS, help='serve agent requests from OpenAI or from the offline mock')
+    parser.add_argument('--mock_source', type=str, default=None, help="outputs folder of an earlier run to replay with the mock backend, or 'synthetic'")
+    parser.add_argument('--mock_latency', type=str, default=None, help='mock latency per request: constant:<s>, uniform:<low>,<high> or lognormal:<mu>,<sigma>')
+    parser.add_argument('--mock_error_rate', type=float, default=None, help='share of mock requests failing with a 429 or 500')
+    parser.add_argument('--test_backend', type=str, default=TEST_BACKEND, choices=TEST_BACKENDS, help='how pytest runs are executed')
+    parser.add_argument('--num_test_workers', type=int, default=NUM_TEST_WORKERS, help='size of the pytest worker pool')
+    parser.add_argument('--max_concurrent_tests', type=int, default=MAX_CONCURRENT_TESTS, help='pytest runs allowed at once across all queries')
+    parser.add_argument('--batch_student_tests', action='store_true', default=BATCH_STUDENT_TESTS, help='test all simulated students of a task in one pytest session')
+    parser.add_argument('--jobs', type=int, default=1, help='number of queries processed concurrently')
+    parser.add_argument('--seed', type=int, default=None, help='base seed for agent requests, query i uses seed + i')
+    parser.add_argument('--artifact_store', type=str, default=None, help='also store every analyzed query in this SQLite file')
+    parser.add_argument('--render_matrices', action='store_true', help='render the test matrices of all queries as heatmaps once they are analyzed')
     
     #example command: python -m code.main --num_themes 5 --num_concept_lists_per_theme 1 --num_tasks_per_pair 10 --output_path outputs
     args = parser.parse_args()
+    configure_cache(args.llm_cache, args.llm_cache_path)
+    configure_mock(args.mock_source, args.mock_latency, args.mock_error_rate)
+    set_llm_backend(args.llm_backend)
+    set_test_backend(args.test_backend, args.num_test_workers, args.max_concurrent_tests, args.batch_student_tests)
+    set_resume(args.resume)
+    configure_artifact_store(args.artifact_store)
 
     with open(os.path.join(parent_dir, 'data', 'model_configuration.json'), 'r') as f:
         model_configuration = json.load(f)
+    configure_rate_limits(model_configuration)
 
     # Load themes_and_concepts.json
     with open('data/themes_and_concepts.json', 'r') as f:
@@ -153,11 +374,28 @@ if __name__=="__main__":
     
     sampled = sample(themes, programming_concepts, args.num_themes, args.num_concept_lists_per_theme)
 
-    for query in range(len(sampled)):
+    def run_sampled_query(query):
         sampled_pair = sampled[query]
-        theme = sampled_pair['theme']
-        programming_concepts = sampled_pair['concepts']
-        selected_task_description, selected_solution_program, selected_test_suite = generate_task('query_' + str(query), theme, programming_concepts, model_configuration, args.num_tasks_per_pair, args.output_path)
-        query_path = os.path.join(args.output_path, 'query_' + str(query))
-        analyze_results(query_path)
-        summary_dict = compute_simulated_distribution(query_path, args.num_tasks_per_pair)
\ No newline at end of file
+        seed = None if args.seed is None else args.seed + query
+        return run_query(query, sampled_pair['theme'], sampled_pair['concepts'], model_configuration, args.num_tasks_per_pair, args.output_path, args.use_async, args.num_parallel_tasks, args.use_dag, seed, args.resume)
+
+    if args.jobs <= 1:
+        for query in range(len(sampled)):
+            run_sampled_query(query)
+    else:
+        # Queries share the LLM request budget and the pytest budget of this process
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            futures = {executor.submit(run_sampled_query, query): query for query in range(len(sampled))}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    print(f'query_{futures[future]} finished')
+                except Exception as e:
+                    print(f'query_{futures[future]} failed: {e}')
+
+    if get_artifact_store() is not None:
+        get_artifact_store().close()
+
+    if args.render_matrices:
+        from .render_matrices import render_matrices
+        render_matrices(args.output_path)
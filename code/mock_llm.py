@@ -0,0 +1,214 @@
+import os
+import ast
+import json
+import time
+import random
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import httpx
+import openai
+from openai.types.chat import ParsedChatCompletion
+
+from .llm_cache import request_key
+
+# Recorded outputs (an outputs folder of earlier runs) to replay, or 'synthetic'
+MOCK_SOURCE = os.environ.get('LLM_MOCK_SOURCE', 'synthetic')
+# constant:<s>, uniform:<low>,<high> or lognormal:<mu>,<sigma>, in seconds per request
+MOCK_LATENCY = os.environ.get('LLM_MOCK_LATENCY', 'constant:0')
+MOCK_ERROR_RATE = float(os.environ.get('LLM_MOCK_ERROR_RATE', 0))
+MOCK_SEED = int(os.environ.get('LLM_MOCK_SEED', 0))
+# share of synthetic student attempts that solve the task
+MOCK_STUDENT_PASS_RATE = float(os.environ.get('LLM_MOCK_STUDENT_PASS_RATE', 0.7))
+
+SYNTHETIC_TASKS = [
+    {
+        'task_description': 'Write a function `add(a, b)` that returns the sum of two numbers.',
+        'solution_program': 'def add(a, b):\n    return a + b\n',
+        'wrong_program': 'def add(a, b):\n    return a - b\n',
+        'test_suite': 'from solution import add\n\ndef test_add_positive():\n    assert add(1, 2) == 3\n\ndef test_add_zero():\n    assert add(0, 0) == 0\n\ndef test_add_negative():\n    assert add(-1, -2) == -3\n',
+    },
+    {
+        'task_description': 'Write a function `count_vowels(text)` that returns the number of vowels in `text`.',
+        'solution_program': "def count_vowels(text):\n    return sum(1 for c in text.lower() if c in 'aeiou')\n",
+        'wrong_program': "def count_vowels(text):\n    return sum(1 for c in text if c in 'aeiou')\n",
+        'test_suite': "from solution import count_vowels\n\ndef test_lower():\n    assert count_vowels('banana') == 3\n\ndef test_upper():\n    assert count_vowels('AEIOU') == 5\n\ndef test_empty():\n    assert count_vowels('') == 0\n",
+    },
+    {
+        'task_description': 'Write a function `running_total(values)` that returns the list of running sums of `values`.',
+        'solution_program': 'def running_total(values):\n    total = 0\n    result = []\n    for value in values:\n        total += value\n        result.append(total)\n    return result\n',
+        'wrong_program': 'def running_total(values):\n    return [sum(values[:i]) for i in range(len(values))]\n',
+        'test_suite': 'from solution import running_total\n\ndef test_values():\n    assert running_total([1, 2, 3]) == [1, 3, 6]\n\ndef test_empty():\n    assert running_total([]) == []\n',
+    },
+]
+
+def parse_latency(spec):
+    kind, _, params = spec.partition(':')
+    params = [float(p) for p in params.split(',') if p]
+    if kind == 'constant':
+        return lambda rng: params[0] if params else 0.0
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(params[0], params[1])
+    raise ValueError(f'Unknown latency distribution {spec}, expected constant:<s>, uniform:<low>,<high> or lognormal:<mu>,<sigma>')
+
+def schema_key(fields):
+    return frozenset(fields)
+
+def recorded_calls(responses_txt):
+    # responses.txt is the repr of a list of ParsedChatCompletionMessage[...](..., parsed=Schema(...)),
+    # which is still valid Python syntax, so the parsed payloads are read back from the AST.
+    with open(responses_txt, 'r') as f:
+        tree = ast.parse(f.read(), mode='eval')
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and node.keywords and all(keyword.arg for keyword in node.keywords):
+            try:
+                payload = {keyword.arg: ast.literal_eval(keyword.value) for keyword in node.keywords}
+            except ValueError:
+                continue
+            if 'parsed' not in payload:
+                yield payload
+
+def load_recordings(source):
+    """Collect recorded payloads under `source` as (payload, prompt) pairs, grouped by the set of fields of their schema."""
+    recordings = {}
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        payloads = []
+        if 'responses.json' in files:
+            with open(os.path.join(root, 'responses.json'), 'r') as f:
+                payloads.extend(json.load(f))
+        elif 'responses.txt' in files:
+            try:
+                payloads.extend(recorded_calls(os.path.join(root, 'responses.txt')))
+            except SyntaxError:
+                print(f'Skipping unreadable {os.path.join(root, "responses.txt")}')
+        if 'annotations.json' in files:
+            with open(os.path.join(root, 'annotations.json'), 'r') as f:
+                payloads.append(json.load(f))
+        if os.path.basename(os.path.dirname(root)) == 'simulated_students' and 'solution_program.py' in files:
+            with open(os.path.join(root, 'solution_program.py'), 'r') as f:
+                payloads.append({'program': f.read()})
+        prompt = None
+        if 'prompt.txt' in files:
+            with open(os.path.join(root, 'prompt.txt'), 'r') as f:
+                prompt = f.read()
+        for payload in payloads:
+            recordings.setdefault(schema_key(payload), []).append((payload, prompt))
+    return recordings
+
+def synthetic_task(request, rng):
+    # tutors, students and judges answer the synthetic task quoted in their prompt
+    prompt = ' '.join(str(message.get('content', '')) for message in request.get('messages', []))
+    for task in SYNTHETIC_TASKS:
+        if task['task_description'] in prompt:
+            return task
+    return rng.choice(SYNTHETIC_TASKS)
+
+def synthetic_payload(request, rng):
+    response_format = request['response_format']
+    name = response_format.__name__
+    task = synthetic_task(request, rng)
+    if name == 'ProgrammingProblem':
+        return {key: task[key] for key in ['task_description', 'test_suite', 'solution_program']}
+    if name == 'TutorContext':
+        return {'program': task['solution_program'], 'context_relevance': 1.0}
+    if name == 'JudgeAnnotation':
+        return {'q_testsuite': 1.0, 'q_context': 1.0, 'q_comprehensible': 1.0, 'q_overall': 1.0}
+    if name == 'StudentAttempt':
+        return {'program': task['solution_program'] if rng.random() < MOCK_STUDENT_PASS_RATE else task['wrong_program']}
+    # any other schema gets placeholder values of the right types
+    defaults = {str: '', float: 0.0, int: 0, bool: True}
+    return {field: defaults.get(info.annotation) for field, info in response_format.model_fields.items()}
+
+class MockCompletions:
+    """Serves client.beta.chat.completions.parse requests from recordings or a synthetic generator."""
+
+    def __init__(self, source=None, latency=None, error_rate=None, seed=None):
+        self.source = source or MOCK_SOURCE
+        self.latency = parse_latency(latency or MOCK_LATENCY)
+        self.error_rate = MOCK_ERROR_RATE if error_rate is None else error_rate
+        self.seed = MOCK_SEED if seed is None else seed
+        self.recordings = {} if self.source == 'synthetic' else load_recordings(self.source)
+        self.calls = 0
+        self.lock = threading.Lock()
+        # latency and errors vary from call to call, but reproducibly for a given seed
+        self.rng = random.Random(self.seed)
+
+    def next_call(self):
+        with self.lock:
+            self.calls += 1
+            return self.latency(self.rng), self.rng.random() < self.error_rate
+
+    def payloads(self, request):
+        response_format = request['response_format']
+        # the content of a response only depends on the request, like a cached or seeded completion
+        rng = random.Random(f'{self.seed}:{request_key(request)}')
+        n = request.get('n', 1)
+        recorded = self.recordings.get(schema_key(response_format.model_fields), [])
+        # prefer what was recorded for the same prompt (prompt.txt holds the system prompt, then the user prompt)
+        user_prompt = str(request['messages'][-1].get('content', '')) if request.get('messages') else ''
+        same_prompt = [payload for payload, prompt in recorded if prompt is not None and prompt.endswith(user_prompt)]
+        recorded = same_prompt or [payload for payload, _ in recorded]
+        if recorded:
+            # a recorded completion is replayed in its original order
+            start = 0 if same_prompt else rng.randrange(len(recorded))
+            return [recorded[(start + i) % len(recorded)] for i in range(n)]
+        return [synthetic_payload(request, rng) for _ in range(n)]
+
+    def completion(self, request):
+        response_format = request['response_format']
+        choices = []
+        for i, payload in enumerate(self.payloads(request)):
+            content = json.dumps(payload)
+            choices.append({'index': i, 'finish_reason': 'stop', 'logprobs': None,
+                            'message': {'role': 'assistant', 'content': content, 'parsed': payload}})
+        prompt_tokens = sum(len(str(message.get('content', ''))) for message in request.get('messages', [])) // 4
+        completion_tokens = sum(len(choice['message']['content']) for choice in choices) // 4
+        return ParsedChatCompletion[response_format].model_validate({
+            'id': f'mock-{request_key(request)[:12]}', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': request['model'], 'choices': choices,
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+    def error(self, request):
+        http_request = httpx.Request('POST', 'https://mock.invalid/v1/chat/completions')
+        if self.rng.random() < 0.5:
+            response = httpx.Response(429, headers={'retry-after-ms': '500'}, request=http_request)
+            return openai.RateLimitError('Mock rate limit', response=response, body=None)
+        response = httpx.Response(500, request=http_request)
+        return openai.InternalServerError('Mock server error', response=response, body=None)
+
+    def parse(self, **request):
+        delay, fail = self.next_call()
+        time.sleep(delay)
+        if fail:
+            raise self.error(request)
+        return self.completion(request)
+
+class AsyncMockCompletions(MockCompletions):
+
+    async def parse(self, **request):
+        delay, fail = self.next_call()
+        await asyncio.sleep(delay)
+        if fail:
+            raise self.error(request)
+        return self.completion(request)
+
+def mock_client(completions):
+    # same attribute path as OpenAI().beta.chat.completions
+    return SimpleNamespace(beta=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+def configure_mock(source=None, latency=None, error_rate=None, seed=None):
+    global MOCK_SOURCE, MOCK_LATENCY, MOCK_ERROR_RATE, MOCK_SEED
+    if source is not None:
+        MOCK_SOURCE = source
+    if latency is not None:
+        parse_latency(latency)
+        MOCK_LATENCY = latency
+    if error_rate is not None:
+        MOCK_ERROR_RATE = error_rate
+    if seed is not None:
+        MOCK_SEED = seed
@@ -0,0 +1,108 @@
+import os
+import json
+import threading
+from array import array
+from collections import OrderedDict
+
+# Call outcome of a test case, as in the test matrices
+PASSED = 1
+FAILED = 0
+NOT_RUN = -1
+PHASES = ['setup', 'call', 'teardown']
+
+# Parsed reports kept in memory, enough for every report of a large output tree
+MAX_CACHED_OUTCOMES = 200000
+
+class TestOutcome:
+    """Compact record of one pytest-json-report report.
+
+    outcomes holds one int8 per test case (PASSED, FAILED or NOT_RUN when the call phase did not pass or fail; a call
+    stopped by the watchdog counts as FAILED), messages the crash messages of the failed, erroring or timed-out
+    phases of every test (None when none of its phases failed).
+    """
+    __slots__ = ('nodeids', 'outcomes', 'messages', 'summary', 'all_called')
+    # not a test class, despite its name
+    __test__ = False
+
+    def __init__(self, nodeids, outcomes, messages, summary, all_called):
+        self.nodeids = nodeids
+        self.outcomes = outcomes
+        self.messages = messages
+        self.summary = summary
+        self.all_called = all_called
+
+    @classmethod
+    def from_report(cls, report):
+        nodeids, messages = [], []
+        outcomes = array('b')
+        all_called = True
+        for test in report['tests']:
+            nodeids.append(test['nodeid'])
+            call = test.get('call')
+            if call is None:
+                all_called = False
+                outcomes.append(NOT_RUN)
+            else:
+                outcomes.append({'passed': PASSED, 'failed': FAILED, 'timeout': FAILED}.get(call['outcome'], NOT_RUN))
+            # e.g. a teardown error after a passing call, which makes the test an error
+            failed_phases = [test[when] for when in PHASES if test.get(when, {}).get('outcome') not in (None, 'passed', 'skipped')]
+            if failed_phases:
+                messages.append(' / '.join(phase.get('crash', {}).get('message', '') for phase in failed_phases))
+            elif test.get('outcome') in ('failed', 'error', 'timeout'):
+                messages.append('')
+            else:
+                messages.append(None)
+        return cls(tuple(nodeids), outcomes, tuple(messages), dict(report['summary']), all_called)
+
+    def __len__(self):
+        return len(self.outcomes)
+
+    @property
+    def num_passed(self):
+        return self.outcomes.count(PASSED)
+
+    def passed_all(self):
+        # a test without a call phase (e.g. a setup error) fails the run, as do empty runs
+        return self.all_called and self.num_passed > 0 and self.num_passed == self.summary.get('total')
+
+    def perc_passed(self):
+        if not self.all_called:
+            return 0
+        return self.num_passed / self.summary['collected'] * 100
+
+    def first_failed_str(self):
+        if len(self.outcomes) == 0:
+            return 'Code is not executable'
+        failed = [f"{nodeid.split('::')[1]} -- {message}\n" for nodeid, message in zip(self.nodeids, self.messages) if message is not None]
+        return ''.join(failed) or 'All tests passed'
+
+_outcomes = OrderedDict()
+_outcomes_lock = threading.Lock()
+
+def load_outcome(pytest_report_path):
+    """TestOutcome of the report at pytest_report_path, or None when it is missing or unreadable.
+
+    Each report is parsed once and served from memory until its mtime or size changes.
+    """
+    try:
+        stat = os.stat(pytest_report_path)
+    except OSError:
+        return None
+    key = os.path.abspath(pytest_report_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _outcomes_lock:
+        cached = _outcomes.get(key)
+        if cached is not None and cached[0] == version:
+            _outcomes.move_to_end(key)
+            return cached[1]
+    try:
+        with open(pytest_report_path, 'r') as f:
+            outcome = TestOutcome.from_report(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    with _outcomes_lock:
+        _outcomes[key] = (version, outcome)
+        _outcomes.move_to_end(key)
+        while len(_outcomes) > MAX_CACHED_OUTCOMES:
+            _outcomes.popitem(last=False)
+    return outcome
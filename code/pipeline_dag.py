@@ -0,0 +1,115 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+CPU = 'cpu'
+NETWORK = 'network'
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+# Stages of every pipeline share these pools; pytest stages mostly wait on their own subprocesses
+POOL_SIZES = {
+    CPU: os.cpu_count() or 4,
+    NETWORK: 16,
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def get_executor(pool):
+    with _executors_lock:
+        if pool not in _executors:
+            _executors[pool] = ThreadPoolExecutor(max_workers=POOL_SIZES[pool], thread_name_prefix=f'dag-{pool}')
+        return _executors[pool]
+
+class Stage:
+    """A pipeline stage.
+
+    fn is called with the results of the stages in `requires` as keyword arguments once they are done.
+    Stages in `gated_by` must pass for the stage's result to count; with speculative execution the stage
+    starts without waiting for them and is cancelled or discarded when one of them fails.
+    A stage with gate=True fails the pipeline when it returns a falsy result.
+    """
+
+    def __init__(self, name, fn, requires=(), gated_by=(), pool=NETWORK, gate=False):
+        self.name = name
+        self.fn = fn
+        self.requires = list(requires)
+        self.gated_by = list(gated_by)
+        self.pool = pool
+        self.gate = gate
+
+def skip_blocked_stages(stages, status):
+    # A stage is dropped once any of its inputs or gates failed or was dropped itself
+    changed = True
+    while changed:
+        changed = False
+        for stage in stages.values():
+            if status[stage.name] in (PENDING, RUNNING) and any(status[dep] in (FAILED, SKIPPED) for dep in stage.requires + stage.gated_by):
+                status[stage.name] = SKIPPED
+                changed = True
+
+def is_ready(stage, status, speculative):
+    if status[stage.name] != PENDING or any(status[dep] != DONE for dep in stage.requires):
+        return False
+    return speculative or all(status[dep] == DONE for dep in stage.gated_by)
+
+def run_dag(stages, speculative=True, stop_event=None):
+    """Run the stages as soon as their inputs are available.
+
+    Returns (results, status): the result of every stage that finished, and the final status of every stage.
+    """
+    stages = {stage.name: stage for stage in stages}
+    for stage in stages.values():
+        unknown = [dep for dep in stage.requires + stage.gated_by if dep not in stages]
+        if unknown:
+            raise ValueError(f'Stage {stage.name} depends on unknown stages {unknown}')
+    status = {name: PENDING for name in stages}
+    results = {}
+    running = {}
+
+    try:
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                for name in status:
+                    if status[name] in (PENDING, RUNNING):
+                        status[name] = SKIPPED
+            skip_blocked_stages(stages, status)
+            for future, name in list(running.items()):
+                if status[name] == SKIPPED and future.cancel():
+                    del running[future]
+
+            for stage in stages.values():
+                if is_ready(stage, status, speculative):
+                    inputs = {dep: results[dep] for dep in stage.requires}
+                    running[get_executor(stage.pool).submit(stage.fn, **inputs)] = stage.name
+                    status[stage.name] = RUNNING
+
+            # stages that were dropped while running cannot be interrupted, but nothing waits for them
+            if all(status[name] == SKIPPED for name in running.values()):
+                break
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                result = future.result()
+                if status[name] == SKIPPED:
+                    # finished after one of its gates failed, so the result is discarded
+                    continue
+                results[name] = result
+                status[name] = FAILED if stages[name].gate and not result else DONE
+    except BaseException:
+        for future in running:
+            future.cancel()
+        raise
+
+    for name in status:
+        if status[name] == PENDING:
+            status[name] = SKIPPED
+    return results, status
+
+def gates_passed(stages, status):
+    return all(status[stage.name] == DONE for stage in stages if stage.gate)
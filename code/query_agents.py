@@ -1,15 +1,13 @@
 import os
 import json
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import nest_asyncio
 nest_asyncio.apply()
 import time
 
-from openai import OpenAI
 from pydantic import BaseModel
-
-OpenAI.api_key = os.environ["OPENAI_API_KEY"]
-client = OpenAI()
+from .llm_client import parse_completion, async_parse_completion
 
 ON_HEROKU = eval(os.environ.get("ON_HEROKU"))
 if ON_HEROKU:
@@ -23,6 +21,9 @@ else:
 script_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
 
+# token_count.json is shared by all agents of a task, which may now finish concurrently
+token_count_lock = threading.Lock()
+
 class TutorContext(BaseModel):
     program: str
     context_relevance: float
@@ -39,6 +40,17 @@ class JudgeAnnotation(BaseModel):
 class StudentAttempt(BaseModel):
     program: str
 
+def update_token_count(task_path, agent, usage):
+    with token_count_lock:
+        token_count = {}
+        if os.path.exists(os.path.join(task_path, 'token_count.json')):
+            with open(os.path.join(task_path, 'token_count.json'), 'r') as f:
+                token_count = json.load(f)
+        
+        token_count[agent] = usage.dict()
+        with open(os.path.join(task_path, 'token_count.json'), 'w') as f:
+            json.dump(token_count, f, indent=4)
+
 def parse_student_response(output_path):
     with open(os.path.join(output_path, "response.txt"), 'r') as f:
         response = f.read()
@@ -57,7 +69,7 @@ def query_student(task_path, task_description, model, temp, simulated_students_p
     ### Query the model
     prompt = user_prompt_student.format(task_description=task_description)
 
-    completion = client.beta.chat.completions.parse(
+    completion = parse_completion(
                     model=model,
                     messages=[
                         {   
@@ -98,19 +110,20 @@ def query_student(task_path, task_description, model, temp, simulated_students_p
         with open(os.path.join(output_path, "solution_program.py"), 'w') as f:
             f.write(solution_program)
     
-def query_judge(task_path, theme, programming_concepts, task_description, test_suite, model, temp, judge_path, num_judges):
+def judge_request(theme, programming_concepts, task_description, test_suite, model, num_judges, seed=None):
     prompt = user_prompt_judge.format(theme=theme, concepts=str(programming_concepts), task_description=task_description, test_suite=test_suite)
-    
-    completion = client.beta.chat.completions.parse(
+    return dict(
         model=model,
         messages=[
             {"role": "system", "content": system_prompt_judge},
             {"role": "user", "content": prompt}
         ],
         response_format=JudgeAnnotation,
-        n=num_judges
+        n=num_judges,
+        seed=seed
     )
-    
+
+def save_judge_completion(task_path, prompt, completion, model, temp, judge_path):
     for rollout, choice in enumerate(completion.choices):
         output_path = os.path.join(judge_path, f"{model}_temp-{temp}_{rollout}")
         os.makedirs(output_path, exist_ok=True)
@@ -124,49 +137,44 @@ def query_judge(task_path, theme, programming_concepts, task_description, test_s
             json.dump(response.dict(), f, indent=4)
 
     # Update token count
-    token_count = {}
-    if os.path.exists(os.path.join(task_path, 'token_count.json')):
-        with open(os.path.join(task_path, 'token_count.json'), 'r') as f:
-            token_count = json.load(f)
-    
-    token_count['judge'] = completion.usage.dict()
-    with open(os.path.join(task_path, 'token_count.json'), 'w') as f:
-        json.dump(token_count, f, indent=4)
+    update_token_count(task_path, 'judge', completion.usage)
 
+def query_judge(task_path, theme, programming_concepts, task_description, test_suite, model, temp, judge_path, num_judges, seed=None):
+    request = judge_request(theme, programming_concepts, task_description, test_suite, model, num_judges, seed)
+    completion = parse_completion(**request)
+    save_judge_completion(task_path, request['messages'][-1]['content'], completion, model, temp, judge_path)
     return True
 
-def query_simulated_students(query_path, task, model_configuration, task_dict):
-    num_students = model_configuration["student"]["quantity"]
-    model = model_configuration["student"]["model"]
-    temp = model_configuration["student"]["temperature"]
-
-    task_path = os.path.join(query_path, task)
-    simulated_students_path = os.path.join(task_path, "simulated_students")
-    os.makedirs(simulated_students_path, exist_ok=True)
-
-    prompt = user_prompt_student.format(task_description=task_dict[task]['task_description'])
+async def async_query_judge(task_path, theme, programming_concepts, task_description, test_suite, model, temp, judge_path, num_judges, seed=None):
+    request = judge_request(theme, programming_concepts, task_description, test_suite, model, num_judges, seed)
+    completion = await async_parse_completion(**request)
+    save_judge_completion(task_path, request['messages'][-1]['content'], completion, model, temp, judge_path)
+    return True
 
-    completion = client.beta.chat.completions.parse(
-        model=model,
+def simulated_students_request(task_description, model_configuration):
+    prompt = user_prompt_student.format(task_description=task_description)
+    return dict(
+        model=model_configuration["student"]["model"],
         messages=[
             {"role": "system", "content": system_prompt_student},
             {"role": "user", "content": prompt}
         ],
         response_format=StudentAttempt,
-        n=num_students,
-        max_tokens=4096
+        n=model_configuration["student"]["quantity"],
+        max_tokens=4096,
+        seed=model_configuration.get("seed")
     )
 
+def save_simulated_students_completion(query_path, task, model_configuration, prompt, completion):
+    model = model_configuration["student"]["model"]
+    temp = model_configuration["student"]["temperature"]
+    task_path = os.path.join(query_path, task)
+    simulated_students_path = os.path.join(task_path, "simulated_students")
+    os.makedirs(simulated_students_path, exist_ok=True)
+
     if not ON_HEROKU:
         # Save token count
-        token_count = {}
-        if os.path.exists(os.path.join(task_path, 'token_count.json')):
-            with open(os.path.join(task_path, 'token_count.json'), 'r') as f:
-                token_count = json.load(f)
-        
-        token_count['student'] = completion.usage.dict()
-        with open(os.path.join(task_path, 'token_count.json'), 'w') as f:
-            json.dump(token_count, f, indent=4)
+        update_token_count(task_path, 'student', completion.usage)
 
     for rollout, choice in enumerate(completion.choices):
         output_path = os.path.join(simulated_students_path, f"{model}_temp-{temp}_{rollout}")
@@ -182,36 +190,40 @@ def query_simulated_students(query_path, task, model_configuration, task_dict):
         with open(os.path.join(output_path, "solution_program.py"), 'w') as f:
             f.write(solution_program)
 
-def query_simulated_tutor(query_path, theme, programming_concepts, task, model_configuration, task_dict):
-    context_satisfied = True
-    model = model_configuration["tutor"]["model"]
-    num_tutors = model_configuration["tutor"]["quantity"]
-    temp = model_configuration["tutor"]["temperature"]
-    task_path = os.path.join(query_path, task)
-    simulated_tutors_path = os.path.join(task_path, "simulated_tutors")
-    os.makedirs(simulated_tutors_path, exist_ok=True)
-    
-    prompt = user_prompt_tutor.format(theme=theme, concepts=str(programming_concepts), task_description=task_dict[task]['task_description'], test_suite=task_dict[task]['test_suite'])
-    completion = client.beta.chat.completions.parse(
-        model=model,
+def query_simulated_students(query_path, task, model_configuration, task_dict):
+    request = simulated_students_request(task_dict[task]['task_description'], model_configuration)
+    completion = parse_completion(**request)
+    save_simulated_students_completion(query_path, task, model_configuration, request['messages'][-1]['content'], completion)
+
+async def async_query_simulated_students(query_path, task, model_configuration, task_dict):
+    request = simulated_students_request(task_dict[task]['task_description'], model_configuration)
+    completion = await async_parse_completion(**request)
+    save_simulated_students_completion(query_path, task, model_configuration, request['messages'][-1]['content'], completion)
+
+def simulated_tutor_request(theme, programming_concepts, task_description, test_suite, model_configuration):
+    prompt = user_prompt_tutor.format(theme=theme, concepts=str(programming_concepts), task_description=task_description, test_suite=test_suite)
+    return dict(
+        model=model_configuration["tutor"]["model"],
         messages=[
             {"role": "system", "content": system_prompt_tutor},
             {"role": "user", "content": prompt}
         ],
         response_format=TutorContext,
-        n=num_tutors
+        n=model_configuration["tutor"]["quantity"],
+        seed=model_configuration.get("seed")
     )
 
+def save_simulated_tutor_completion(query_path, task, model_configuration, prompt, completion):
+    context_satisfied = True
+    model = model_configuration["tutor"]["model"]
+    temp = model_configuration["tutor"]["temperature"]
+    task_path = os.path.join(query_path, task)
+    simulated_tutors_path = os.path.join(task_path, "simulated_tutors")
+    os.makedirs(simulated_tutors_path, exist_ok=True)
+
     if not ON_HEROKU:
         # Update token count
-        token_count = {}
-        if os.path.exists(os.path.join(task_path, 'token_count.json')):
-            with open(os.path.join(task_path, 'token_count.json'), 'r') as f:
-                token_count = json.load(f)
-        
-        token_count['tutor'] = completion.usage.dict()
-        with open(os.path.join(task_path, 'token_count.json'), 'w') as f:
-            json.dump(token_count, f, indent=4)
+        update_token_count(task_path, 'tutor', completion.usage)
     
     for rollout, choice in enumerate(completion.choices):
         output_path = os.path.join(simulated_tutors_path, f"{model}_temp-{temp}_{rollout}")
@@ -238,16 +250,40 @@ def query_simulated_tutor(query_path, theme, programming_concepts, task, model_c
 
     return context_satisfied
 
+def query_simulated_tutor(query_path, theme, programming_concepts, task, model_configuration, task_dict):
+    request = simulated_tutor_request(theme, programming_concepts, task_dict[task]['task_description'], task_dict[task]['test_suite'], model_configuration)
+    completion = parse_completion(**request)
+    return save_simulated_tutor_completion(query_path, task, model_configuration, request['messages'][-1]['content'], completion)
+
+async def async_query_simulated_tutor(query_path, theme, programming_concepts, task, model_configuration, task_dict):
+    request = simulated_tutor_request(theme, programming_concepts, task_dict[task]['task_description'], task_dict[task]['test_suite'], model_configuration)
+    completion = await async_parse_completion(**request)
+    return save_simulated_tutor_completion(query_path, task, model_configuration, request['messages'][-1]['content'], completion)
+
+def simulated_judges_path_for(query_path, task):
+    simulated_judges_path = os.path.join(query_path, task, "simulated_judges")
+    os.makedirs(simulated_judges_path, exist_ok=True)
+    return simulated_judges_path
+
 def query_simulated_judge(query_path, theme, programming_concepts, task, model_configuration, task_dict):
     model = model_configuration["judge"]["model"]
     num_judges = model_configuration["judge"]["quantity"]
     temp = model_configuration["judge"]["temperature"]
     
     task_path = os.path.join(query_path, task)
-    simulated_judges_path = os.path.join(task_path, "simulated_judges")
-    os.makedirs(simulated_judges_path, exist_ok=True)
+    simulated_judges_path = simulated_judges_path_for(query_path, task)
+
+    query_judge(task_path, theme, programming_concepts, task_dict[task]['task_description'], task_dict[task]['test_suite'], model, temp, simulated_judges_path, num_judges, model_configuration.get("seed"))
+
+async def async_query_simulated_judge(query_path, theme, programming_concepts, task, model_configuration, task_dict):
+    model = model_configuration["judge"]["model"]
+    num_judges = model_configuration["judge"]["quantity"]
+    temp = model_configuration["judge"]["temperature"]
+    
+    task_path = os.path.join(query_path, task)
+    simulated_judges_path = simulated_judges_path_for(query_path, task)
 
-    query_judge(task_path, theme, programming_concepts, task_dict[task]['task_description'], task_dict[task]['test_suite'], model, temp, simulated_judges_path, num_judges)
+    await async_query_judge(task_path, theme, programming_concepts, task_dict[task]['task_description'], task_dict[task]['test_suite'], model, temp, simulated_judges_path, num_judges, model_configuration.get("seed"))
 
 def parse_simulated_students_responses(generated_tasks_path, task, num_students):
     futures = []
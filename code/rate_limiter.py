@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+
+import openai
+
+# Get the directory of the current script
+script_dir = os.path.dirname(__file__)
+parent_dir = os.path.abspath(os.path.join(script_dir, os.pardir))
+
+# Completion tokens assumed per choice when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1024
+CHARS_PER_TOKEN = 4
+
+MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 8))
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+class TokenBucket:
+    """Budget of `capacity` units per minute, refilled continuously.
+
+    reserve() always succeeds and returns how long the caller has to wait before its reservation is covered,
+    so callers queue in reservation order without polling. The level may go negative while callers wait.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.level = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        amount = min(amount, self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount):
+        with self.lock:
+            self.refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+    def drain(self, seconds):
+        # After a 429 nobody should send anything for `seconds`
+        with self.lock:
+            self.refill(time.monotonic())
+            self.level = min(self.level, -seconds * self.rate)
+
+class ModelLimiter:
+    """Requests-per-minute and tokens-per-minute buckets of one model, shared by every role that uses it."""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, estimated_tokens):
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(estimated_tokens))
+        return delay
+
+    def settle(self, estimated_tokens, used_tokens):
+        # Give back what the estimate over-reserved (or take what it under-reserved)
+        if self.tokens is not None and used_tokens is not None:
+            self.tokens.refund(estimated_tokens - used_tokens)
+
+    def back_off(self, seconds):
+        # Returns False when there is no bucket to hold the other callers back
+        buckets = [bucket for bucket in (self.requests, self.tokens) if bucket is not None]
+        for bucket in buckets:
+            bucket.drain(seconds)
+        return len(buckets) > 0
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+def configure_rate_limits(model_configuration):
+    """Build one limiter per model from the `rate_limits` of the roles in model_configuration.
+
+    Roles sharing a model share its quota, so the tightest budget configured for the model is used.
+    """
+    budgets = {}
+    for role in model_configuration.values():
+        if not isinstance(role, dict) or 'rate_limits' not in role:
+            continue
+        budget = budgets.setdefault(role['model'], {})
+        for name, value in role['rate_limits'].items():
+            budget[name] = min(budget.get(name, value), value)
+    with limiters_lock:
+        limiters.clear()
+        for model, budget in budgets.items():
+            limiters[model] = ModelLimiter(budget.get('requests_per_minute'), budget.get('tokens_per_minute'))
+
+def get_limiter(model):
+    with limiters_lock:
+        if model not in limiters:
+            # models without a configured budget are only protected by retries
+            limiters[model] = ModelLimiter()
+        return limiters[model]
+
+def estimate_tokens(request):
+    prompt_chars = sum(len(str(message.get('content', ''))) for message in request.get('messages', []))
+    max_tokens = request.get('max_tokens') or DEFAULT_COMPLETION_TOKENS
+    return prompt_chars // CHARS_PER_TOKEN + max_tokens * request.get('n', 1)
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        value = response.headers.get(header)
+        if value is None:
+            continue
+        try:
+            return float(value) * scale
+        except ValueError:
+            # an HTTP date, fall back to exponential backoff
+            return None
+    return None
+
+def backoff_delay(attempt, error):
+    delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2**attempt))
+    server_delay = retry_after(error)
+    if server_delay is not None:
+        delay = max(delay, server_delay)
+    return delay
+
+def used_tokens(completion):
+    usage = getattr(completion, 'usage', None)
+    return usage.total_tokens if usage is not None else None
+
+def call_with_rate_limit(call, request):
+    """Call call() within the budget of request['model'], retrying transient failures with jittered exponential backoff."""
+    limiter = get_limiter(request.get('model'))
+    estimated_tokens = estimate_tokens(request)
+    for attempt in range(MAX_RETRIES + 1):
+        time.sleep(limiter.reserve(estimated_tokens))
+        try:
+            completion = call()
+        except RETRYABLE_ERRORS as e:
+            limiter.settle(estimated_tokens, 0)
+            if attempt == MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt, e)
+            print(f'{type(e).__name__} for {request.get("model")}, retrying in {delay:.1f}s ({attempt + 1}/{MAX_RETRIES})')
+            # a 429 pauses every caller of the model; the next reservation then waits out the delay
+            if not (isinstance(e, openai.RateLimitError) and limiter.back_off(delay)):
+                time.sleep(delay)
+            continue
+        limiter.settle(estimated_tokens, used_tokens(completion))
+        return completion
+
+async def async_call_with_rate_limit(call, request):
+    limiter = get_limiter(request.get('model'))
+    estimated_tokens = estimate_tokens(request)
+    for attempt in range(MAX_RETRIES + 1):
+        await asyncio.sleep(limiter.reserve(estimated_tokens))
+        try:
+            completion = await call()
+        except RETRYABLE_ERRORS as e:
+            limiter.settle(estimated_tokens, 0)
+            if attempt == MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt, e)
+            print(f'{type(e).__name__} for {request.get("model")}, retrying in {delay:.1f}s ({attempt + 1}/{MAX_RETRIES})')
+            # a 429 pauses every caller of the model; the next reservation then waits out the delay
+            if not (isinstance(e, openai.RateLimitError) and limiter.back_off(delay)):
+                await asyncio.sleep(delay)
+            continue
+        limiter.settle(estimated_tokens, used_tokens(completion))
+        return completion
+
+with open(os.path.join(parent_dir, 'data', 'model_configuration.json'), 'r') as f:
+    configure_rate_limits(json.load(f))
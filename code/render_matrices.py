@@ -0,0 +1,104 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# Cell colours of the test matrices: not run (-1), failed (0), passed (1)
+MATRIX_COLORS = ['grey', 'orangered', 'dodgerblue']
+FONT_SIZE = 50
+TICK_LABEL_SIZE = 10
+
+def use_agg_backend():
+    # set in every worker before pyplot is imported, so rendering never needs a display
+    import matplotlib
+    matplotlib.use('Agg')
+
+def is_stale(csv_path, pdf_path):
+    # analyze_results only rewrites test_matrix.csv when its content changes
+    return not os.path.exists(pdf_path) or os.path.getmtime(pdf_path) < os.path.getmtime(csv_path)
+
+def has_rows(csv_path):
+    # matrices without test cases or without students have no figure
+    with open(csv_path, 'r') as f:
+        return ',' in f.readline() and bool(f.readline())
+
+def render_test_matrix(csv_path, pdf_path=None, usetex=False):
+    """Render the heatmap of one test_matrix.csv (next to it as test_matrix.pdf by default).
+
+    Returns the path of the figure, or None when the matrix has no rows.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from matplotlib.colors import ListedColormap, BoundaryNorm
+
+    pdf_path = pdf_path or os.path.splitext(csv_path)[0] + '.pdf'
+    matrix_df = pd.read_csv(csv_path, index_col='Simulated student').astype(float)
+    if matrix_df.empty:
+        return None
+
+    colors = ListedColormap(MATRIX_COLORS)
+    # boundaries between each value (-1, 0, 1)
+    norm = BoundaryNorm([-1.5, -0.5, 0.5, 1.5], colors.N)
+    with plt.rc_context({'font.size': FONT_SIZE, 'text.usetex': usetex}):
+        fig, ax = plt.subplots()
+        try:
+            sns.heatmap(matrix_df, ax=ax, cmap=colors, norm=norm, cbar=False, square=True,
+                        linewidths=2, linecolor='white', xticklabels=True, yticklabels=True,
+                        vmin=-1, vmax=1)
+            ax.set_aspect('equal')
+            ax.set_xlabel('Generated test cases')
+            ax.set_ylabel('')
+            ax.tick_params(axis='both', which='major', labelsize=TICK_LABEL_SIZE, length=0, left=False,
+                           labelbottom=False, bottom=False, top=True, labeltop=True)
+            fig.tight_layout()
+            fig.savefig(pdf_path)
+        finally:
+            plt.close(fig)
+    return pdf_path
+
+def find_test_matrices(root):
+    csv_paths = []
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        if 'test_matrix.csv' in files:
+            csv_paths.append(os.path.join(folder, 'test_matrix.csv'))
+    return csv_paths
+
+def render_matrices(root, num_workers=None, force=False, usetex=False):
+    """Render every test_matrix.csv under root whose figure is missing or older than the csv.
+
+    Figures are rendered in a process pool. Returns the paths of the rendered figures.
+    """
+    jobs = []
+    for csv_path in find_test_matrices(root):
+        pdf_path = os.path.splitext(csv_path)[0] + '.pdf'
+        if has_rows(csv_path) and (force or is_stale(csv_path, pdf_path)):
+            jobs.append((csv_path, pdf_path))
+    print(f'Rendering {len(jobs)} test matrices under {root}')
+    if not jobs:
+        return []
+
+    rendered = []
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=use_agg_backend) as executor:
+        futures = {executor.submit(render_test_matrix, csv_path, pdf_path, usetex): csv_path for csv_path, pdf_path in jobs}
+        for future, csv_path in futures.items():
+            try:
+                pdf_path = future.result()
+                if pdf_path is not None:
+                    rendered.append(pdf_path)
+            except Exception as e:
+                print(f'Could not render {csv_path}: {e}')
+    return rendered
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render the test matrices saved by analyze_results as heatmaps')
+    parser.add_argument('root', type=str, nargs='?', default='outputs', help='outputs, query or task folder to search for test_matrix.csv')
+    parser.add_argument('--num_workers', type=int, default=None, help='rendering processes, one per CPU by default')
+    parser.add_argument('--force', action='store_true', help='render every matrix, including those whose figure is up to date')
+    parser.add_argument('--usetex', action='store_true', help='typeset the labels with LaTeX (needs a TeX installation)')
+
+    #example command: python -m code.render_matrices outputs --num_workers 8
+    args = parser.parse_args()
+    rendered = render_matrices(args.root, args.num_workers, args.force, args.usetex)
+    print(f'Rendered {len(rendered)} figures')
@@ -3,17 +3,32 @@ import pandas as pd
 import json
 import argparse
 from code.utils import check_passed_all_tests, get_coverage, get_perc_passed_tests
-if __name__ == '__main__':
-    #parse the arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--output_path', type=str, required=True, help='path to the experiment')
-    args = parser.parse_args()
-    output_path = args.output_path
 
-    pd_data = pd.DataFrame(columns=['query', 'theme', 'programming_concepts', 'task', 'self_consistency', 'Q-TestSuite', 'Q-Context',
-                                    'Q-Comprehensive', 'Q-Overall', 'contain_higher_level_concepts'])
+ANNOTATION_COLUMNS = ['query', 'theme', 'programming_concepts', 'task', 'self_consistency', 'Q-TestSuite', 'Q-Context',
+                      'Q-Comprehensive', 'Q-Overall', 'contain_higher_level_concepts']
+
+def folder_number(folder):
+    return int(folder.split('_')[1])
+
+def annotation_rows_from_tables(tables_path):
+    from code.compact_outputs import OutputTables
+
+    tables = OutputTables(tables_path)
+    contexts = tables.query_contexts()
+    tasks = tables.table('tasks').select(['query', 'task', 'perc_passed_tests']).to_pylist()
+    tasks.sort(key=lambda row: (folder_number(row['query']), folder_number(row['task'])))
+    rows = []
+    for row in tasks:
+        theme, programming_concepts = contexts[row['query']]
+        passed_all_tests = round(row['perc_passed_tests'], 2)
+        rows.append({'query': row['query'], 'theme': theme, 'programming_concepts': programming_concepts, 'task': row['task'],
+                     'self_consistency': 1 if passed_all_tests==100.0 else 0})
+    return rows
+
+def annotation_rows_from_files(output_path):
+    rows = []
     sorted_queries = [folder for folder in os.listdir(output_path) if os.path.isdir(os.path.join(output_path, folder))]
-    sorted_queries.sort(key = lambda x: int(x.split('_')[1]))
+    sorted_queries.sort(key = folder_number)
     for query in sorted_queries:
         query_path = os.path.join(output_path, query)
         if not os.path.isdir(query_path):
@@ -23,7 +38,7 @@ if __name__ == '__main__':
         with open(os.path.join(query_path, 'programming_concepts.txt'), 'r') as f:
             programming_concepts = f.read()
         sorted_tasks = [folder for folder in os.listdir(query_path) if os.path.isdir(os.path.join(query_path, folder))]
-        sorted_tasks.sort(key = lambda x: int(x.split('_')[1]))
+        sorted_tasks.sort(key = folder_number)
         for task in sorted_tasks:
             task_path = os.path.join(query_path, task)
             if not os.path.isdir(task_path):
@@ -31,7 +46,19 @@ if __name__ == '__main__':
             print('task_path', task_path)
             passed_all_tests = round(get_perc_passed_tests(os.path.join(task_path, 'pytest_report.json')),2)
             coverage = round(get_coverage(os.path.join(task_path, 'pytest_coverage_report.json')),2)
-            pd_data = pd.concat([pd_data, pd.DataFrame({'query': query, 'theme': theme, 'programming_concepts': programming_concepts, 'task': task, 'self_consistency': 1 if passed_all_tests==100.0 else 0}, index=[0])], ignore_index=True)
+            rows.append({'query': query, 'theme': theme, 'programming_concepts': programming_concepts, 'task': task, 'self_consistency': 1 if passed_all_tests==100.0 else 0})
+    return rows
+
+if __name__ == '__main__':
+    #parse the arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output_path', type=str, required=True, help='path to the experiment')
+    parser.add_argument('--tables', type=str, default=None, help='read the tasks from the tables written by code.compact_outputs instead of the output tree')
+    args = parser.parse_args()
+    output_path = args.output_path
+
+    rows = annotation_rows_from_tables(args.tables) if args.tables else annotation_rows_from_files(output_path)
+    pd_data = pd.DataFrame(rows, columns=ANNOTATION_COLUMNS)
                                                         
     pd_data.to_csv(os.path.join(output_path, 'annotation_sheet.csv'), index=False)
 
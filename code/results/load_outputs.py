@@ -0,0 +1,53 @@
+import os
+import json
+
+from ..artifact_store import ArtifactStore
+from ..compact_outputs import OutputTables
+
+def open_store(store_path=None, tables_path=None):
+    """Read-only artifact store at store_path, the tables written by compact_outputs at tables_path, or None to read
+    the output tree itself."""
+    if tables_path:
+        return OutputTables(tables_path)
+    return ArtifactStore(store_path, read_only=True) if store_path else None
+
+def query_folders(data_path):
+    return sorted(folder for folder in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, folder)))
+
+def load_passed_tasks(data_path, N, store=None):
+    """{query: {technique: [task, ...]}} for the first N tasks of every query, from the store or from each
+    query's passed_tasks_for_each_technique.json."""
+    if store is not None:
+        return store.passed_tasks(N)
+    passed_tasks = {}
+    for query in query_folders(data_path):
+        with open(os.path.join(data_path, query, 'passed_tasks_for_each_technique.json'), 'r') as f:
+            passed_tasks[query] = json.load(f)[str(N)]
+    return passed_tasks
+
+def load_query_contexts(data_path, store=None):
+    """{query: (theme, programming concepts)}, as the text of theme.txt and programming_concepts.txt."""
+    if store is not None:
+        return store.query_contexts()
+    contexts = {}
+    for query in query_folders(data_path):
+        with open(os.path.join(data_path, query, 'theme.txt'), 'r') as f:
+            theme = f.read()
+        with open(os.path.join(data_path, query, 'programming_concepts.txt'), 'r') as f:
+            contexts[query] = (theme, f.read())
+    return contexts
+
+def index_annotations(annotations):
+    """{(query, task): {column: value}} of the first annotation row of every task, instead of filtering the
+    annotations DataFrame for every lookup."""
+    index = {}
+    for row in annotations.to_dict('records'):
+        index.setdefault((row['query'], row['task']), row)
+    return index
+
+def annotated_tasks(annotations):
+    """{query: [task, ...]} in the order of the annotation rows."""
+    tasks = {}
+    for query, task in zip(annotations['query'], annotations['task']):
+        tasks.setdefault(query, []).append(task)
+    return tasks
@@ -11,6 +11,7 @@ from scipy.stats import truncnorm
 import random
 np.random.seed(200)
 import csv
+from .load_outputs import open_store, load_passed_tasks, load_query_contexts, index_annotations, annotated_tasks
 from scipy.stats import chi2_contingency
 plt.rcParams.update({'font.size': 50})
 plt.rc('text', usetex=True)
@@ -110,7 +111,10 @@ def create_complete_legend():
     
     return handles, labels
 
-def summarize(data_path, annotations_1, annotations_2, metrics):
+def summarize(data_path, annotations_1, annotations_2, metrics, store=None):
+    # one dict lookup per (query, task) rather than a scan of the annotations
+    annotated_tasks_1 = annotated_tasks(annotations_1)
+    annotations_1, annotations_2 = index_annotations(annotations_1), index_annotations(annotations_2)
     metric = 'Q-Overall'
     fig, axs = plt.subplots(1, 2, figsize=(20, 9))
 
@@ -123,23 +127,21 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
         quality_annotations_2 = {}
         q_overall_values = {}
         contingency_table = pd.DataFrame(columns=['technique', 'technique_good_expert_good', 'technique_good_expert_bad', 'technique_bad_expert_good', 'technique_bad_expert_bad'])
-        queries = [folder for folder in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, folder))]
+        passed_tasks_by_query = load_passed_tasks(data_path, N, store)
+        queries = list(passed_tasks_by_query)
 
         oracle_quality_from_two_experts = []
         oracle_coverage = []
         aggreement_frequency = {}
         for query in queries:
-            if not os.path.isdir(os.path.join(data_path, query)): continue
-            query_path = os.path.join(data_path, query)
-            with open(os.path.join(query_path, 'passed_tasks_for_each_technique.json'), 'r') as f:
-                passed_tasks_at_N = json.load(f)[str(N)]
+            passed_tasks_at_N = passed_tasks_by_query[query]
         
             for technique, passed_tasks in passed_tasks_at_N.items():
                 if technique == 'Base':
                     max_quality_by_experts = 0
                     for task in passed_tasks:
-                        quality_by_expert_1 = annotations_1[(annotations_1['query'] == query) & (annotations_1['task'] == task)]['Q-Overall'].values[0]
-                        quality_by_expert_2 = annotations_2[(annotations_2['query'] == query) & (annotations_2['task'] == task)]['Q-Overall'].values[0]
+                        quality_by_expert_1 = annotations_1[query, task]['Q-Overall']
+                        quality_by_expert_2 = annotations_2[query, task]['Q-Overall']
                         max_quality_by_experts = max(max_quality_by_experts, (quality_by_expert_1 + quality_by_expert_2) / 2)
 
                     if max_quality_by_experts == 1.0:
@@ -158,9 +160,9 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
                 if technique not in quality_annotations_1:
                     quality_annotations_1[technique] = []
                 
-                for task in annotations_1[annotations_1['query'] == query]['task'].values:
-                    qoverall_by_expert_1 = annotations_1[(annotations_1['query'] == query) & (annotations_1['task'] == task)]['Q-Overall'].values[0]
-                    qoverall_by_expert_2 = annotations_2[(annotations_2['query'] == query) & (annotations_2['task'] == task)]['Q-Overall'].values[0]
+                for task in annotated_tasks_1.get(query, []):
+                    qoverall_by_expert_1 = annotations_1[query, task]['Q-Overall']
+                    qoverall_by_expert_2 = annotations_2[query, task]['Q-Overall']
                     overall_by_expert = 1 if qoverall_by_expert_1 == 1.0 and qoverall_by_expert_2 == 1.0 else 0.0
                     if task in passed_tasks:
                         overall_by_technique = 1
@@ -185,8 +187,8 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
                 passed_qualities_annotations_1 = []
                 passed_qualities_annotations_2 = []
                 for passed_task in passed_tasks:
-                    passed_qualities_annotations_1.append(annotations_1[(annotations_1['query'] == query) & (annotations_1['task'] == passed_task)][metric].values[0])
-                    passed_qualities_annotations_2.append(annotations_2[(annotations_2['query'] == query) & (annotations_2['task'] == passed_task)][metric].values[0])
+                    passed_qualities_annotations_1.append(annotations_1[query, passed_task][metric])
+                    passed_qualities_annotations_2.append(annotations_2[query, passed_task][metric])
              
                 if len(passed_tasks) > 0:
                     mean_passed_quality_annotations_1 = np.mean(passed_qualities_annotations_1)
@@ -288,6 +290,8 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--data_path', type=str, default='outputs', help='path to the experiment')
+    parser.add_argument('--artifact_store', type=str, default=None, help='read the queries from this artifact store instead of the output tree')
+    parser.add_argument('--tables', type=str, default=None, help='read the queries from the tables written by code.compact_outputs instead of the output tree')
     args = parser.parse_args()
 
     metrics = ['Q-Testsuite', 'Q-Context','Q-Comprehensible','Q-Overall']
@@ -297,4 +301,4 @@ if __name__=="__main__":
     annotation_file_2 = os.path.join(args.data_path, 'annotations_expert_2.csv')
     annotation_2 = pd.read_csv(annotation_file_2)
 
-    summarize(args.data_path, annotation_1, annotation_2, metrics)
+    summarize(args.data_path, annotation_1, annotation_2, metrics, open_store(args.artifact_store, args.tables))
@@ -11,6 +11,7 @@ from scipy.stats import truncnorm
 import random
 np.random.seed(200)
 import csv
+from .load_outputs import open_store, load_passed_tasks, load_query_contexts, index_annotations
 from matplotlib.patches import Rectangle
 plt.rcParams.update({'font.size': 53})
 plt.rc('text', usetex=True)
@@ -35,7 +36,9 @@ technique_name_to_latex_format = {
     'Oracle': '\\textsc{Oracle}$_{p}$'
 }
 
-def summarize(data_path, annotations_1, annotations_2, metrics):
+def summarize(data_path, annotations_1, annotations_2, metrics, store=None):
+    # one dict lookup per (query, task) rather than a scan of the annotations
+    annotations_1, annotations_2 = index_annotations(annotations_1), index_annotations(annotations_2)
     metric = 'Q-Overall'
     fig, axs = plt.subplots(1, 3, figsize=(30, 12))
     handles, labels = [], []
@@ -56,14 +59,12 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
         difficulties = {}
         q_overall_values = {}
         contingency_table = pd.DataFrame(columns=['technique', 'technique_good_expert_good', 'technique_good_expert_bad'])
-        queries = [folder for folder in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, folder))]
+        passed_tasks_by_query = load_passed_tasks(data_path, N, store)
+        queries = list(passed_tasks_by_query)
 
         aggreement_frequency = {}
         for query in queries:
-            if not os.path.isdir(os.path.join(data_path, query)): continue
-            query_path = os.path.join(data_path, query)
-            with open(os.path.join(query_path, 'passed_tasks_for_each_technique.json'), 'r') as f:
-                passed_tasks_at_N = json.load(f)[str(N)]
+            passed_tasks_at_N = passed_tasks_by_query[query]
         
             for technique, passed_tasks in passed_tasks_at_N.items():
                 if technique not in main_techniques:
@@ -79,8 +80,8 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
                     quality_annotations_1[technique] = []
                 
                 for task in passed_tasks:
-                    qoverall_by_expert_1 = annotations_1[(annotations_1['query'] == query) & (annotations_1['task'] == task)]['Q-Overall'].values[0]
-                    qoverall_by_expert_2 = annotations_2[(annotations_2['query'] == query) & (annotations_2['task'] == task)]['Q-Overall'].values[0]
+                    qoverall_by_expert_1 = annotations_1[query, task]['Q-Overall']
+                    qoverall_by_expert_2 = annotations_2[query, task]['Q-Overall']
                     overall_by_expert = 1 if qoverall_by_expert_1 == 1.0 and qoverall_by_expert_2 == 1.0 else 0.0
                     overall_by_technique = 1
                     if overall_by_expert == 1 and overall_by_technique == 1:
@@ -98,8 +99,8 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
                 passed_qualities_annotations_1 = []
                 passed_qualities_annotations_2 = []
                 for passed_task in passed_tasks:
-                    passed_qualities_annotations_1.append(annotations_1[(annotations_1['query'] == query) & (annotations_1['task'] == passed_task)][metric].values[0])
-                    passed_qualities_annotations_2.append(annotations_2[(annotations_2['query'] == query) & (annotations_2['task'] == passed_task)][metric].values[0])
+                    passed_qualities_annotations_1.append(annotations_1[query, passed_task][metric])
+                    passed_qualities_annotations_2.append(annotations_2[query, passed_task][metric])
              
                 if len(passed_tasks) > 0:
                     mean_passed_quality_annotations_1 = np.mean(passed_qualities_annotations_1)
@@ -135,13 +136,11 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
     metrics = ['Q-Overall', 'Q-Testsuite','Q-Context','Q-Comprehensible',]
     pd_data = pd.DataFrame(columns=['Technique'] + metrics)
     N = 10
-    queries = [folder for folder in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, folder))]
+    passed_tasks_by_query = load_passed_tasks(data_path, N, store)
+    queries = list(passed_tasks_by_query)
     metric_values = {}
     for query in queries:
-        if not os.path.isdir(os.path.join(data_path, query)): continue
-        query_path = os.path.join(data_path, query)
-        with open(os.path.join(query_path, 'passed_tasks_for_each_technique.json'), 'r') as f:
-            passed_tasks_at_N = json.load(f)[str(N)]
+        passed_tasks_at_N = passed_tasks_by_query[query]
         for technique, passed_tasks in passed_tasks_at_N.items():
             if technique not in main_techniques:
                 continue
@@ -149,13 +148,13 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
                 metric_values[technique] = {}
                 for metric in metrics:
                     metric_values[technique][metric] = []
-            filtered_annotations_1 = annotations_1[(annotations_1['query'] == query) & (annotations_1['task'].isin(passed_tasks))]
-            filtered_annotations_2 = annotations_2[(annotations_2['query'] == query) & (annotations_2['task'].isin(passed_tasks))]
+            filtered_annotations_1 = [annotations_1[query, task] for task in passed_tasks if (query, task) in annotations_1]
+            filtered_annotations_2 = [annotations_2[query, task] for task in passed_tasks if (query, task) in annotations_2]
 
             if len(passed_tasks) > 0:
                 for metric in metrics:
-                    mean_metric_by_expert_1 = filtered_annotations_1[metric].replace(np.NaN, 0).mean()
-                    mean_metric_by_expert_2 = filtered_annotations_2[metric].replace(np.NaN, 0).mean()
+                    mean_metric_by_expert_1 = np.mean([0 if pd.isna(row[metric]) else row[metric] for row in filtered_annotations_1])
+                    mean_metric_by_expert_2 = np.mean([0 if pd.isna(row[metric]) else row[metric] for row in filtered_annotations_2])
                     mean_metric_by_experts = (mean_metric_by_expert_1 + mean_metric_by_expert_2) / 2
                     metric_values[technique][metric].append(mean_metric_by_experts)
 
@@ -202,6 +201,8 @@ if __name__=="__main__":
     # argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('--data_path', type=str, default='outputs', help='path to the experiment')
+    parser.add_argument('--artifact_store', type=str, default=None, help='read the queries from this artifact store instead of the output tree')
+    parser.add_argument('--tables', type=str, default=None, help='read the queries from the tables written by code.compact_outputs instead of the output tree')
     args = parser.parse_args()
 
     metrics = ['Q-Testsuite', 'Q-Context','Q-Comprehensible','Q-Overall'] 
@@ -211,4 +212,4 @@ if __name__=="__main__":
     annotation_file_2 = os.path.join(args.data_path, 'annotations_expert_2.csv')
     annotation_2 = pd.read_csv(annotation_file_2)
 
-    summarize(args.data_path, annotation_1, annotation_2, metrics)
\ No newline at end of file
+    summarize(args.data_path, annotation_1, annotation_2, metrics, open_store(args.artifact_store, args.tables))
\ No newline at end of file
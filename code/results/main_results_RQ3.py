@@ -11,6 +11,7 @@ from scipy.stats import truncnorm
 import random
 np.random.seed(200)
 import csv
+from .load_outputs import open_store, load_passed_tasks, load_query_contexts, index_annotations
 plt.rcParams.update({'font.size': 55})
 plt.rc('text', usetex=True)
 
@@ -32,7 +33,9 @@ technique_name_to_latex_format = {
     'Oracle': '\\textsc{Oracle}$_{p}$'
 }
 
-def summarize(data_path, annotations_1, annotations_2, metrics):
+def summarize(data_path, annotations_1, annotations_2, metrics, store=None):
+    # one dict lookup per (query, task) rather than a scan of the annotations
+    annotations_1, annotations_2 = index_annotations(annotations_1), index_annotations(annotations_2)
     metric = 'Q-Overall'
 
     print(f'Analyzing for {metric}...')
@@ -41,23 +44,18 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
         if N!=10:
             continue
         coverage = {}
-        queries = [folder for folder in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, folder))]
+        passed_tasks_by_query = load_passed_tasks(data_path, N, store)
+        queries = list(passed_tasks_by_query)
+        query_contexts = load_query_contexts(data_path, store)
 
         theme_counts = {}
         theme_counts_high_quality = {}
         concept_counts = {}
         concept_counts_high_quality = {}
         for query in queries:
-            if not os.path.isdir(os.path.join(data_path, query)): continue
-            query_path = os.path.join(data_path, query)
-            with open(os.path.join(query_path, 'passed_tasks_for_each_technique.json'), 'r') as f:
-                passed_tasks_at_N = json.load(f)[str(N)]
-            # load theme
-            with open(os.path.join(query_path, 'theme.txt'), 'r') as f:
-                theme = f.read()
-            # load concepts
-            with open(os.path.join(query_path, 'programming_concepts.txt'), 'r') as f:
-                concepts = eval(f.read())
+            passed_tasks_at_N = passed_tasks_by_query[query]
+            theme, concepts = query_contexts[query]
+            concepts = eval(concepts)
             for technique, passed_tasks in passed_tasks_at_N.items():
                 if technique == 'PyTaskSyn-50%':
                     if theme not in theme_counts:
@@ -73,8 +71,8 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
                         concept_counts[concept].append(len(passed_tasks))
                     high_quality_counts = 0
                     for task in passed_tasks:
-                        qoverall_by_expert_1 = annotations_1[(annotations_1['query'] == query) & (annotations_1['task'] == task)]['Q-Overall'].values[0]
-                        qoverall_by_expert_2 = annotations_2[(annotations_2['query'] == query) & (annotations_2['task'] == task)]['Q-Overall'].values[0]
+                        qoverall_by_expert_1 = annotations_1[query, task]['Q-Overall']
+                        qoverall_by_expert_2 = annotations_2[query, task]['Q-Overall']
                         overall_by_expert = 1.0 if qoverall_by_expert_1 == 1.0 and qoverall_by_expert_2 == 1.0 else 0.0
                         if overall_by_expert == 1.0:
                             high_quality_counts += 1
@@ -174,6 +172,8 @@ def summarize(data_path, annotations_1, annotations_2, metrics):
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--data_path', type=str, default='outputs', help='path to the experiment')
+    parser.add_argument('--artifact_store', type=str, default=None, help='read the queries from this artifact store instead of the output tree')
+    parser.add_argument('--tables', type=str, default=None, help='read the queries from the tables written by code.compact_outputs instead of the output tree')
     args = parser.parse_args()
 
     metrics = ['Q-Testsuite', 'Q-Context','Q-Comprehensible','Q-Overall']
@@ -183,4 +183,4 @@ if __name__=="__main__":
     annotation_file_2 = os.path.join(args.data_path, 'annotations_expert_2.csv')
     annotation_2 = pd.read_csv(annotation_file_2)
 
-    summarize(args.data_path, annotation_1, annotation_2, metrics)
+    summarize(args.data_path, annotation_1, annotation_2, metrics, open_store(args.artifact_store, args.tables))
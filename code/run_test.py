@@ -1,14 +1,16 @@
 import os
+import re
 import json
+import shutil
 import argparse
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.stats import norm
 import random
-import subprocess
-from .utils import check_passed_all_tests, get_coverage, get_perc_passed_tests
+import threading
+from .utils import check_passed_all_tests, run_passed_all_tests, passed_all_tests, get_coverage, run_coverage, get_perc_passed_tests, fingerprint_program
+from .execution_backend import run_pytest, json_report_args, batches_student_tests, CancelToken
+from .analysis_state import file_hash, load_analysis_state, save_analysis_state
+from .line_coverage import coverage_report
 
 
 # set all seeds
@@ -30,7 +32,65 @@ STU_COVERAGE_THRESHOLD = model_configuration['student']['coverage_threshold']
 STU_POPULATION_SIZE = model_configuration['student']['quantity']
 STU_POPULATION_PASSING_THRESHOLD = model_configuration['student']['population_passing_threshold']
 
-def test_student(stu_folder, task_folder):
+# Files written by test_student that are copied to students with an equivalent program
+STUDENT_RESULT_FILES = ['test_suite_stu.py', 'pytest_report.json', 'test_results.txt']
+
+# Files test_students_batch writes next to the student folders for the time of its session
+BATCH_CONFTEST_FILE = 'conftest.py'
+BATCH_REPORT_FILE = 'pytest_report_batch.json'
+# Loaded by the batch session: each student's test_suite_stu.py imports solution_program from the student's
+# folder, which stays registered under a module name of its own; the student's tests run in that folder and
+# with that module as solution_program, as if it had a session of its own
+BATCH_CONFTEST = '''import os
+import sys
+import pytest
+
+programs = {}
+
+def enter_student(folder):
+    cwd = os.getcwd()
+    os.chdir(folder)
+    sys.path.insert(0, folder)
+    sys.modules.pop('solution_program', None)
+    if folder in programs:
+        sys.modules['solution_program'] = programs[folder]
+    return cwd
+
+def leave_student(folder, cwd):
+    program = sys.modules.pop('solution_program', None)
+    if program is not None and folder not in programs:
+        programs[folder] = program
+        sys.modules[f'solution_program_{len(programs)}'] = program
+    if folder in sys.path:
+        sys.path.remove(folder)
+    os.chdir(cwd)
+
+@pytest.hookimpl(wrapper=True)
+def pytest_make_collect_report(collector):
+    if not isinstance(collector, pytest.Module):
+        return (yield)
+    folder = str(collector.path.parent)
+    cwd = enter_student(folder)
+    try:
+        return (yield)
+    finally:
+        leave_student(folder, cwd)
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    folder = str(item.path.parent)
+    cwd = enter_student(folder)
+    try:
+        return (yield)
+    finally:
+        leave_student(folder, cwd)
+'''
+
+# Memoised population outcomes, keyed by task folder and invalidated when the test suite or a program changes
+population_results = {}
+population_results_lock = threading.Lock()
+
+def write_test_suite_stu(stu_folder, task_folder):
     test_suite_stu_path = os.path.join(stu_folder, 'test_suite_stu.py')
     task_suite_path = os.path.join(task_folder, 'test_suite.py')
     
@@ -39,54 +99,227 @@ def test_student(stu_folder, task_folder):
     
     with open(test_suite_stu_path, 'w') as f:
         f.write("from solution_program import *\n" + test_suite_content)
+    return test_suite_stu_path
+
+def test_student(stu_folder, task_folder, cancel=None):
+    # each student runs in its own folder, so files written by its program or test suite cannot collide
+    stu_folder = os.path.abspath(stu_folder)
+    test_suite_stu_path = write_test_suite_stu(stu_folder, task_folder)
 
     test_results_file_path = os.path.join(stu_folder, 'test_results.txt')
     pytest_coverage_report_file_path = os.path.join(stu_folder, 'pytest_coverage_report.json')
     pytest_report_path = os.path.join(stu_folder, 'pytest_report.json')
 
     command = [
-        'pytest', '--no-header','--tb=line', '--timeout=5', '--timeout_method=signal',
-        '--json-report', f'--json-report-file={pytest_report_path}', test_suite_stu_path
+        '--no-header','--tb=line',
+        *json_report_args(pytest_report_path, keep_report=not ON_HEROKU), test_suite_stu_path
     ]
     
-    if ON_HEROKU:
-        subprocess.run(command, check=False)
-    else:
-        with open(test_results_file_path, 'w') as f:
-            subprocess.run(command, stdout=f, stderr=subprocess.STDOUT, check=False)
+    run = run_pytest(command, None if ON_HEROKU else test_results_file_path, cwd=stu_folder, cancel=cancel)
+    if run['cancelled']:
+        return False
 
-    if check_passed_all_tests(pytest_report_path):
+    if run_passed_all_tests(run, pytest_report_path):
     # and get_coverage(pytest_coverage_report_file_path)>=STU_COVERAGE_THRESHOLD:
         return True
     else:
         return False
         
 
-def test_simulated_students(task_path, task):
+def group_equivalent_students(students_folder):
+    groups = {}
+    for stu in sorted(os.listdir(students_folder)):
+        stu_folder = os.path.join(students_folder, stu)
+        try:
+            with open(os.path.join(stu_folder, 'solution_program.py'), 'r') as f:
+                key = fingerprint_program(f.read())
+        except OSError:
+            # let test_student report the failure for this student alone
+            key = stu_folder
+        groups.setdefault(key, []).append(stu_folder)
+    return list(groups.values())
+
+def fan_out_student_results(source_folder, target_folders):
+    # the folder name only as a whole path component (or the start of a quoted nodeid), so that student_1
+    # leaves student_10 and test ids or messages that happen to contain it alone
+    name = re.escape(os.path.basename(source_folder))
+    source_name = re.compile(rf'(?<=[/\\]){name}(?![\w.-])|(?<="){name}(?=/)')
+    for file_name in STUDENT_RESULT_FILES:
+        source_path = os.path.join(source_folder, file_name)
+        if not os.path.exists(source_path):
+            continue
+        with open(source_path, 'r') as f:
+            content = f.read()
+        for target_folder in target_folders:
+            target_name = os.path.basename(target_folder)
+            with open(os.path.join(target_folder, file_name), 'w') as f:
+                f.write(source_name.sub(lambda match: target_name, content))
+
+def student_report(batch_report, stu_folder):
+    """The part of a batch session's report about one student, laid out as the report of its own session."""
+    prefix = os.path.basename(stu_folder) + '/'
+    strip = lambda entry: dict(entry, nodeid=entry['nodeid'][len(prefix):])
+    tests = [strip(test) for test in batch_report['tests'] if test['nodeid'].startswith(prefix)]
+    summary = {'total': len(tests), 'collected': len(tests)}
+    for test in tests:
+        summary[test['outcome']] = summary.get(test['outcome'], 0) + 1
+    report = {key: value for key, value in batch_report.items() if key not in ('tests', 'collectors', 'summary')}
+    report.update(root=stu_folder, summary=summary, tests=tests,
+                  exitcode=0 if summary.get('passed', 0) == len(tests) else 1)
+    if 'collectors' in batch_report:
+        report['collectors'] = [strip(collector) for collector in batch_report['collectors'] if collector['nodeid'].startswith(prefix)]
+    return report
+
+def student_results_text(report):
+    # stands in for the output of a session of the student's own, which the batch session does not have
+    lines = [f"{test['nodeid']} {test['outcome'].upper()}" for test in report['tests']]
+    failures = []
+    for test in report['tests']:
+        for phase in ['setup', 'call', 'teardown']:
+            crash = test.get(phase, {}).get('crash')
+            if crash is not None:
+                failures.append(f"{crash.get('path', test['nodeid'])}:{crash.get('lineno', '')}: {crash.get('message', '')}")
+    if failures:
+        lines += ['=================================== FAILURES ==================================='] + failures
+    counts = ', '.join(f'{count} {outcome}' for outcome, count in report['summary'].items() if outcome not in ('total', 'collected'))
+    lines.append(f'========== {counts} (batched session) ==========')
+    return '\n'.join(lines) + '\n'
+
+def test_students_batch(stu_folders, task_folder, cancel=None):
+    """Run the test suite of a task on every student folder in a single pytest session.
+
+    Returns {stu_folder: passed}, after writing each student's pytest_report.json and test_results.txt as
+    test_student would. Students the session has no outcome for (e.g. their program does not import, or the
+    session crashed) are tested on their own with test_student.
+    """
+    stu_folders = [os.path.abspath(stu_folder) for stu_folder in stu_folders]
+    students_folder = os.path.dirname(stu_folders[0])
+    conftest_path = os.path.join(students_folder, BATCH_CONFTEST_FILE)
+    batch_report_path = os.path.join(students_folder, BATCH_REPORT_FILE)
+    report_args = json_report_args(batch_report_path, keep_report=not ON_HEROKU)
+    with open(conftest_path, 'w') as f:
+        f.write(BATCH_CONFTEST)
+    test_suite_paths = [write_test_suite_stu(stu_folder, task_folder) for stu_folder in stu_folders]
+
+    command = [
+        '--no-header', '--tb=line',
+        # every test_suite_stu.py gets a module name of its own, and a student whose program does not
+        # import leaves the others running
+        '--import-mode=importlib', '--continue-on-collection-errors', f'--rootdir={students_folder}',
+        *report_args, *test_suite_paths
+    ]
+    try:
+        run = run_pytest(command, None if ON_HEROKU else os.devnull, cwd=students_folder, cancel=cancel)
+        batch_report = None if run['cancelled'] else run['report']
+        if report_args and not run['cancelled']:
+            try:
+                with open(batch_report_path, 'r') as f:
+                    batch_report = json.load(f)
+            except (OSError, ValueError):
+                batch_report = None
+    finally:
+        for path in [conftest_path, batch_report_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        # bytecode of the conftest would otherwise look like a student folder
+        shutil.rmtree(os.path.join(students_folder, '__pycache__'), ignore_errors=True)
+
+    results = {}
+    remaining = []
+    for stu_folder in stu_folders:
+        report = student_report(batch_report, stu_folder) if batch_report is not None else None
+        if report is None or not report['tests']:
+            remaining.append(stu_folder)
+            continue
+        if report_args:
+            with open(os.path.join(stu_folder, 'pytest_report.json'), 'w') as f:
+                json.dump(report, f)
+        if not ON_HEROKU:
+            with open(os.path.join(stu_folder, 'test_results.txt'), 'w') as f:
+                f.write(student_results_text(report))
+        results[stu_folder] = passed_all_tests(report)
+    if remaining:
+        print(f'Testing {len(remaining)} students on their own')
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results.update(zip(remaining, executor.map(lambda stu_folder: test_student(stu_folder, task_folder, cancel), remaining)))
+    return results
+
+def population_signature(task_folder, students_folder):
+    paths = [os.path.join(task_folder, 'test_suite.py')] + [os.path.join(students_folder, stu, 'solution_program.py') for stu in sorted(os.listdir(students_folder))]
+    return tuple((path, os.stat(path).st_mtime_ns if os.path.exists(path) else None) for path in paths)
+
+def population_passed(num_stu_passed):
+    return num_stu_passed/STU_POPULATION_SIZE*100 >= STU_POPULATION_PASSING_THRESHOLD
+
+def test_simulated_students(task_path, task, dedup=True, early_exit=False, cancel=None):
     num_stu_passed = 0
     task_folder = os.path.join('/app', task_path, task) if ON_HEROKU else os.path.join(task_path, task)
     students_folder = os.path.join(task_folder, 'simulated_students')
-    
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = []
-        for stu in os.listdir(students_folder):
-            future = executor.submit(test_student, os.path.join(students_folder, stu), task_folder)
-            futures.append(future)
-        
-        for future in as_completed(futures):
-            if future.result():
-                num_stu_passed += 1
-    print("num_stu_passed=", num_stu_passed)
-    if num_stu_passed/STU_POPULATION_SIZE*100 >= STU_POPULATION_PASSING_THRESHOLD:
-        return True
+
+    # A memoised early-exit outcome is not reused by a full run, which must leave a report for every student
+    memo_key = os.path.abspath(task_folder)
+    signature = population_signature(task_folder, students_folder)
+    with population_results_lock:
+        memo = population_results.get(memo_key)
+    if memo is not None and memo['signature'] == signature and (early_exit or memo['complete']):
+        return memo['passed']
+
+    if dedup:
+        # Equivalent programs are tested once and their results copied to the other students
+        groups = group_equivalent_students(students_folder)
     else:
-        return False
+        groups = [[os.path.join(students_folder, stu)] for stu in os.listdir(students_folder)]
+    print(f"Testing {len(groups)} distinct programs")
+    num_stu_remaining = sum(len(group) for group in groups)
+    complete = True
 
-def test_ta(ta_testsuite_folder, task_folder):
-    # list all files in ta_testsuite_folder
-    files = os.listdir(ta_testsuite_folder)
-    print('files:', files)
+    if batches_student_tests() and groups:
+        # a single session tests every program, so there is no early exit
+        results = test_students_batch([group[0] for group in groups], task_folder, cancel)
+        if cancel is not None and cancel.is_set():
+            return False
+        for group in groups:
+            fan_out_student_results(group[0], group[1:])
+            if results[os.path.abspath(group[0])]:
+                num_stu_passed += len(group)
+        return record_population(memo_key, signature, num_stu_passed, complete)
+    
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    futures = {}
+    for group in groups:
+        future = executor.submit(test_student, group[0], task_folder, cancel)
+        futures[future] = group
     
+    for future in as_completed(futures):
+        group = futures[future]
+        fan_out_student_results(group[0], group[1:])
+        if future.result():
+            num_stu_passed += len(group)
+        num_stu_remaining -= len(group)
+        # Stop as soon as the threshold is reached or can no longer be reached
+        if early_exit and num_stu_remaining > 0 and (population_passed(num_stu_passed) or not population_passed(num_stu_passed + num_stu_remaining)):
+            complete = False
+            break
+    executor.shutdown(wait=complete, cancel_futures=True)
+    if cancel is not None and cancel.is_set():
+        # the outcomes of cancelled runs say nothing about the students
+        return False
+
+    return record_population(memo_key, signature, num_stu_passed, complete)
+
+def record_population(memo_key, signature, num_stu_passed, complete):
+    print("num_stu_passed=", num_stu_passed)
+    passed = population_passed(num_stu_passed)
+    with population_results_lock:
+        population_results[memo_key] = {'signature': signature, 'passed': passed, 'complete': complete}
+    return passed
+
+def population_passed_from_reports(task_folder):
+    students_folder = os.path.join(task_folder, 'simulated_students')
+    num_stu_passed = sum(check_passed_all_tests(os.path.join(students_folder, stu, 'pytest_report.json')) for stu in os.listdir(students_folder))
+    return population_passed(num_stu_passed)
+
+def write_test_suite_ta(ta_testsuite_folder, task_folder):
     test_suite_ta_path = os.path.join(ta_testsuite_folder, 'test_suite_ta.py')
     task_suite_path = os.path.join(task_folder, 'test_suite.py')
     
@@ -96,45 +329,119 @@ def test_ta(ta_testsuite_folder, task_folder):
     
     with open(test_suite_ta_path, 'w') as f:
         f.write("from program import *\n" + test_suite_content)
+    return test_suite_ta_path
+
+def test_ta(ta_testsuite_folder, task_folder, cancel=None):
+    ta_testsuite_folder = os.path.abspath(ta_testsuite_folder)
+    # list all files in ta_testsuite_folder
+    files = os.listdir(ta_testsuite_folder)
+    print('files:', files)
+    test_suite_ta_path = write_test_suite_ta(ta_testsuite_folder, task_folder)
 
     test_results_file_path = os.path.join(ta_testsuite_folder, 'test_results.txt')
     pytest_coverage_report_file_path = os.path.join(ta_testsuite_folder, 'pytest_coverage_report.json')
     pytest_report_path = os.path.join(ta_testsuite_folder, 'pytest_report.json')
 
     command = [
-        'pytest', '--tb=line','--timeout=5', '--timeout_method=signal',
-        f'--cov=program', f'--cov-report=json:{pytest_coverage_report_file_path}',
-        '--json-report', f'--json-report-file={pytest_report_path}', test_suite_ta_path
+        '--tb=line',
+        *json_report_args(pytest_report_path, keep_report=not ON_HEROKU), test_suite_ta_path
     ]
 
-    if ON_HEROKU:
-        subprocess.run(command, check=False)
-    else:
-        with open(test_results_file_path, 'w') as f:
-            subprocess.run(command, stdout=f, stderr=subprocess.STDOUT, check=False)
+    # the run records the executed lines of program.py itself, instead of through pytest-cov
+    program_path = os.path.join(ta_testsuite_folder, 'program.py')
+    run = run_pytest(command, None if ON_HEROKU else test_results_file_path, cwd=ta_testsuite_folder, cancel=cancel, coverage_source=program_path)
+    if run['cancelled']:
+        return False
+    if not ON_HEROKU:
+        with open(pytest_coverage_report_file_path, 'w') as f:
+            json.dump(coverage_report(program_path, run['coverage']), f)
+        with open(test_results_file_path, 'a') as f:
+            f.write(f"\nCoverage of program.py: {run['coverage']['percent_covered']:.0f}%, missing lines {run['coverage']['missing_lines']}\n")
 
-    if check_passed_all_tests(pytest_report_path) and get_coverage(pytest_coverage_report_file_path) >= TUTOR_TESTSUITE_COVERAGE_THRESHOLD:
+    return ta_passed(ta_testsuite_folder, run)
+
+def ta_passed(ta_testsuite_folder, run=None):
+    pytest_coverage_report_file_path = os.path.join(ta_testsuite_folder, 'pytest_coverage_report.json')
+    pytest_report_path = os.path.join(ta_testsuite_folder, 'pytest_report.json')
+    if run_passed_all_tests(run, pytest_report_path) and run_coverage(run, pytest_coverage_report_file_path) >= TUTOR_TESTSUITE_COVERAGE_THRESHOLD:
         return True
     else:
         return False
 
 
-def test_ta_testsuite(task_path, task):
+def test_ta_testsuite(task_path, task, cancel=None):
     task_folder = os.path.join('/app', task_path, task) if ON_HEROKU else os.path.join(task_path, task)
     # os.makedirs(task_folder, exist_ok=True)
     ta_testsuite_folder = os.path.join(task_folder, 'simulated_tutors')
     
+    # every tutor is tested at once, and the first one that fails cancels the runs of the others
+    # (as does cancel, which stops the whole stage)
     high_quality_testsuite = True
-    for ta in os.listdir(ta_testsuite_folder):
-        if not test_ta(os.path.join(ta_testsuite_folder, ta), task_folder):
-            high_quality_testsuite = False
-            break
+    siblings = CancelToken(cancel)
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    futures = [executor.submit(test_ta, os.path.join(ta_testsuite_folder, ta), task_folder, siblings) for ta in os.listdir(ta_testsuite_folder)]
+    try:
+        for future in as_completed(futures):
+            if not future.result():
+                high_quality_testsuite = False
+                siblings.set()
+                break
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        siblings.close()
     
     return high_quality_testsuite
     
 
-def compute_simulated_distribution(query_path, num_tasks_per_pair):
+# Columns that must equal 1 for a task to pass each technique
+TECHNIQUE_GATES = {
+    'Base': [],
+    'GenConsistency': ['gen_consistency'],
+    'LLMJudge': ['gen_consistency', 'llm_judge'],
+    'SimTutorsVal': ['gen_consistency', 'q_testsuite', 'q_context'],
+}
+# Techniques that additionally require the share of passing simulated students to reach a threshold
+SWEPT_TECHNIQUES = {
+    'SimStudentsVal': ['gen_consistency'],
+    'PyTaskSyn': ['gen_consistency', 'q_testsuite', 'q_context'],
+}
+DEFAULT_THRESHOLDS = list(range(0, 101, 5))
+
+def threshold_sweep(pd_data, thresholds=DEFAULT_THRESHOLDS, gates=TECHNIQUE_GATES, swept=SWEPT_TECHNIQUES, sweep_column='perc_passed_stu'):
+    """Boolean mask over the rows of pd_data for every technique, swept ones as '<name>-<threshold>%'.
+
+    All gates are evaluated once as a tasks x columns matrix and all thresholds as a tasks x thresholds matrix,
+    so the cost hardly grows with the number of thresholds.
+    """
+    gate_columns = sorted({column for columns in list(gates.values()) + list(swept.values()) for column in columns})
+    gate_matrix = pd_data[gate_columns].to_numpy(dtype=float) == 1
+    column_index = {column: i for i, column in enumerate(gate_columns)}
+    def gate_mask(columns):
+        return gate_matrix[:, [column_index[column] for column in columns]].all(axis=1)
+
+    thresholds = np.asarray(thresholds, dtype=float)
+    reached = pd_data[sweep_column].to_numpy(dtype=float)[:, None] >= thresholds[None, :]
+
+    passed = {technique: gate_mask(columns) for technique, columns in gates.items()}
+    for technique, columns in swept.items():
+        swept_masks = gate_mask(columns)[:, None] & reached
+        for i, threshold in enumerate(thresholds):
+            passed[f'{technique}-{threshold:g}%'] = swept_masks[:, i]
+    return passed
+
+def compute_simulated_distribution(query_path, num_tasks_per_pair, thresholds=DEFAULT_THRESHOLDS, incremental=False):
     results_path = os.path.join(query_path, 'results.csv')
+    summary_path = os.path.join(query_path, 'passed_tasks_for_each_technique.json')
+    state = load_analysis_state(query_path)
+    inputs = {'results': file_hash(results_path), 'num_tasks_per_pair': num_tasks_per_pair, 'thresholds': list(thresholds)}
+    if incremental and state.get('distribution') == inputs and os.path.exists(summary_path) \
+            and os.path.exists(os.path.join(query_path, 'passed_tasks_matrix.csv')):
+        print(f'results.csv of {query_path} is unchanged')
+        with open(summary_path, 'r') as f:
+            return {int(N): passed_tasks for N, passed_tasks in json.load(f).items()}
+
+    # pandas is only needed once a query is analyzed, not to validate tasks
+    import pandas as pd
     results = pd.read_csv(results_path)
     tasks = sorted(results['task'].unique(), key=lambda x: int(x.split('_')[1]))
 
@@ -150,64 +457,24 @@ def compute_simulated_distribution(query_path, num_tasks_per_pair):
 
     print('pd_data:', pd_data)
 
+    passed = threshold_sweep(pd_data, thresholds)
+    pd.DataFrame({'task': pd_data['task'], **{technique: mask.astype(np.int8) for technique, mask in passed.items()}}).to_csv(
+        os.path.join(query_path, 'passed_tasks_matrix.csv'), index=False)
+
     summary_dict = {}
+    task_numbers = pd_data['task'].str.split('_').str[1].astype(int).to_numpy()
     list_N = [1] + list(range(5, num_tasks_per_pair + 1, 5))
     for N in list_N:
-        filtered_pd_data = pd_data.sample(n=N, random_state=208).sort_values(by='task', key=lambda x: x.str.split('_').str[1].astype(int))
-        passed_tasks = {
-            'Base': filtered_pd_data['task'].tolist(),
-            'GenConsistency': filtered_pd_data[(filtered_pd_data['gen_consistency']==1)]['task'].tolist(),
-            'LLMJudge': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['llm_judge'] == 1)]['task'].tolist(),
-            # 'ValTests': filtered_pd_data[filtered_pd_data['q_testsuite'] == 1.0]['task'].tolist(),
-            'SimTutorsVal': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0)]['task'].tolist(),
-            'SimStudentsVal-0%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 0) ]['task'].tolist(),
-            'SimStudentsVal-5%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 5) ]['task'].tolist(),
-            'SimStudentsVal-10%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 10) ]['task'].tolist(),
-            'SimStudentsVal-15%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 15) ]['task'].tolist(),
-            'SimStudentsVal-20%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 20) ]['task'].tolist(),
-            'SimStudentsVal-25%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 25) ]['task'].tolist(),
-            'SimStudentsVal-30%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 30) ]['task'].tolist(),
-            'SimStudentsVal-35%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 35) ]['task'].tolist(),
-            'SimStudentsVal-40%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 40) ]['task'].tolist(),
-            'SimStudentsVal-45%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 45) ]['task'].tolist(),
-            'SimStudentsVal-50%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 50) ]['task'].tolist(),
-            'SimStudentsVal-55%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 55) ]['task'].tolist(),
-            'SimStudentsVal-60%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 60) ]['task'].tolist(),
-            'SimStudentsVal-65%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 65) ]['task'].tolist(),
-            'SimStudentsVal-70%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 70) ]['task'].tolist(),
-            'SimStudentsVal-75%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 75) ]['task'].tolist(),
-            'SimStudentsVal-80%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 80) ]['task'].tolist(),
-            'SimStudentsVal-85%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 85) ]['task'].tolist(),
-            'SimStudentsVal-90%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 90) ]['task'].tolist(),
-            'SimStudentsVal-95%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 95) ]['task'].tolist(),
-            'SimStudentsVal-100%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['perc_passed_stu'] >= 100) ]['task'].tolist(),
-            
-            'PyTaskSyn-0%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 0)]['task'].tolist(),
-            'PyTaskSyn-5%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 5)]['task'].tolist(),
-            'PyTaskSyn-10%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 10)]['task'].tolist(),
-            'PyTaskSyn-15%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 15)]['task'].tolist(),
-            'PyTaskSyn-20%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 20)]['task'].tolist(),
-            'PyTaskSyn-25%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 25)]['task'].tolist(),
-            'PyTaskSyn-30%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 30)]['task'].tolist(),
-            'PyTaskSyn-35%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 35)]['task'].tolist(),
-            'PyTaskSyn-40%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 40)]['task'].tolist(),
-            'PyTaskSyn-45%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 45)]['task'].tolist(),
-            'PyTaskSyn-50%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 50)]['task'].tolist(),
-            'PyTaskSyn-55%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 55)]['task'].tolist(),
-            'PyTaskSyn-60%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 60)]['task'].tolist(),
-            'PyTaskSyn-65%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 65)]['task'].tolist(),
-            'PyTaskSyn-70%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 70)]['task'].tolist(),
-            'PyTaskSyn-75%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 75)]['task'].tolist(),
-            'PyTaskSyn-80%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 80)]['task'].tolist(),
-            'PyTaskSyn-85%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 85)]['task'].tolist(),
-            'PyTaskSyn-90%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 90)]['task'].tolist(),
-            'PyTaskSyn-95%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) & (filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 95)]['task'].tolist(),
-            'PyTaskSyn-100%': filtered_pd_data[(filtered_pd_data['gen_consistency']==1) &(filtered_pd_data['q_testsuite'] == 1.0) & (filtered_pd_data['q_context'] == 1.0) & (filtered_pd_data['perc_passed_stu'] >= 100)]['task'].tolist()
-        }
-        summary_dict[N] = passed_tasks
-
-    with open(os.path.join(query_path, 'passed_tasks_for_each_technique.json'), 'w') as f:
+        # same sample of the pool as before, listed by task number
+        sampled = pd_data.sample(n=N, random_state=208).index.to_numpy()
+        sampled = sampled[np.argsort(task_numbers[sampled], kind='stable')]
+        sampled_tasks = pd_data['task'].to_numpy()[sampled]
+        summary_dict[N] = {technique: sampled_tasks[mask[sampled]].tolist() for technique, mask in passed.items()}
+
+    with open(summary_path, 'w') as f:
         json.dump(summary_dict, f)
+    state['distribution'] = inputs
+    save_analysis_state(query_path, state)
 
     return summary_dict
 
@@ -0,0 +1,17 @@
+"""Watchdog plugin of pytest processes started as subprocesses, loaded with `-p pytasksyn_watchdog`.
+
+This directory is the only one added to their path and the plugin is imported from the package under a private
+name, so the program under test still imports the standard library's `code` module (e.g. through pdb).
+"""
+import os
+import sys
+import types
+import importlib
+
+PACKAGE = '_pytasksyn_session'
+
+package = types.ModuleType(PACKAGE)
+package.__path__ = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+sys.modules.setdefault(PACKAGE, package)
+
+pytest_configure = importlib.import_module(f'{PACKAGE}.watchdog').pytest_configure
@@ -1,12 +1,9 @@
 import os
 import json
 
-from openai import OpenAI
 from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
-
-OpenAI.api_key = os.environ["OPENAI_API_KEY"]
-client = OpenAI()
+from .llm_client import parse_completion, async_parse_completion
 
 ON_HEROKU = eval(os.environ.get("ON_HEROKU"))
 if ON_HEROKU:
@@ -44,15 +41,10 @@ def parse_task(i, response, output_path, theme, concepts):
         raise Exception(f"Failed to parse the response for task {i}.")
     return f'task_{i}', response.task_description, solution_program, test_suite
 
-def gen_tasks(query_path, theme, programming_concepts, num_tasks_per_pair, model_configuration):
-    # task_dict = {}
+def expert_request(theme, programming_concepts, num_tasks_per_pair, model_configuration):
     prompt = user_prompt_expert.format(theme=theme, concepts= str(programming_concepts))
-    print(prompt)
-   
-    ### Query the model
-    model = model_configuration["expert"]["model"]
-    completion = client.beta.chat.completions.parse(
-                    model=model,
+    return dict(
+                    model=model_configuration["expert"]["model"],
                     messages=[
                         {   
                             "role": "system", "content": system_prompt_expert,
@@ -60,8 +52,10 @@ def gen_tasks(query_path, theme, programming_concepts, num_tasks_per_pair, model
                         }
                     ],
                     response_format=ProgrammingProblem,
-                    n=num_tasks_per_pair)
-    
+                    n=num_tasks_per_pair,
+                    seed=model_configuration.get("seed"))
+
+def save_expert_completion(query_path, prompt, completion, num_tasks_per_pair):
     responses = [completion.choices[i].message.parsed for i in range(num_tasks_per_pair)]
     if not ON_HEROKU:
         ### Save the prompt to a file
@@ -76,5 +70,25 @@ def gen_tasks(query_path, theme, programming_concepts, num_tasks_per_pair, model
         with open(os.path.join(query_path, 'token_count.json'), 'w') as f:
             token_count = completion.usage.to_dict()
             json.dump(token_count, f, indent=4)
+        # machine-readable copy of the pool, used to resume a query without regenerating it
+        with open(os.path.join(query_path, 'responses.json'), 'w') as f:
+            json.dump([response.dict() for response in responses], f, indent=4)
+
+    return responses
+
+def gen_tasks(query_path, theme, programming_concepts, num_tasks_per_pair, model_configuration):
+    request = expert_request(theme, programming_concepts, num_tasks_per_pair, model_configuration)
+    prompt = request['messages'][0]['content']
+    print(prompt)
+   
+    ### Query the model
+    completion = parse_completion(**request)
+    return save_expert_completion(query_path, prompt, completion, num_tasks_per_pair)
+
+async def async_gen_tasks(query_path, theme, programming_concepts, num_tasks_per_pair, model_configuration):
+    request = expert_request(theme, programming_concepts, num_tasks_per_pair, model_configuration)
+    prompt = request['messages'][0]['content']
+    print(prompt)
 
-    return responses
\ No newline at end of file
+    completion = await async_parse_completion(**request)
+    return save_expert_completion(query_path, prompt, completion, num_tasks_per_pair)
@@ -1,32 +1,44 @@
 import json
 import os
+import ast
+import hashlib
+from .outcome import TestOutcome, load_outcome
+
+def normalize_program(program):
+    # The AST dump ignores comments and formatting within a line but keeps the line of every node, so the
+    # tracebacks and crash line numbers of one program hold for the others; programs that do not parse are
+    # compared as they are, since their syntax error quotes the offending line
+    try:
+        tree = ast.parse(program)
+    except (SyntaxError, ValueError):
+        return program
+    for node in ast.walk(tree):
+        if hasattr(node, 'col_offset'):
+            node.col_offset = node.end_col_offset = 0
+    return ast.dump(tree, include_attributes=True)
+
+def fingerprint_program(program):
+    return hashlib.sha256(normalize_program(program).encode('utf-8')).hexdigest()
 
 def check_passed_all_tests(pytest_report_path):
-    num_passed_tests = 0
+    outcome = load_outcome(pytest_report_path)
+    return outcome is not None and outcome.passed_all()
+
+def passed_all_tests(pytest_report):
     try:
-        with open(pytest_report_path, 'r') as f:
-            pytest_report = json.load(f)
-        tests = pytest_report['tests']
-        for test in tests:
-            if test['call']['outcome'] == 'passed':
-                num_passed_tests += 1
-        if num_passed_tests>0 and num_passed_tests == pytest_report['summary']['total']:
-            return True
-        else:
-            return False
+        return TestOutcome.from_report(pytest_report).passed_all()
     except:
         return False
 
+def run_passed_all_tests(run, pytest_report_path):
+    # Outcomes collected by the inprocess backend spare reading the report back from disk
+    if run is not None and run.get('report') is not None:
+        return passed_all_tests(run['report'])
+    return check_passed_all_tests(pytest_report_path)
+
 def get_perc_passed_tests(pytest_report_path):
     try:
-        with open(pytest_report_path, 'r') as f:
-            pytest_report = json.load(f)
-        num_passed = 0
-        total_tests = pytest_report['summary']['collected']
-        for key in pytest_report['tests']:
-            if key['call']['outcome'] == 'passed':
-                num_passed += 1
-        return num_passed/total_tests*100
+        return load_outcome(pytest_report_path).perc_passed()
     except:
         return 0
 
@@ -38,6 +50,12 @@ def get_coverage(cov_report_path):
     except:
         return 0
     
+def run_coverage(run, cov_report_path):
+    # Coverage recorded by the run itself spares reading the report back from disk
+    if run is not None and run.get('coverage') is not None:
+        return round(run['coverage']['percent_covered'], 2)
+    return get_coverage(cov_report_path)
+
 def get_not_covered_lines(cov_report_path):
     try:
         with open(cov_report_path, 'r') as f:
@@ -49,25 +67,10 @@ def get_not_covered_lines(cov_report_path):
         return []
 
 def get_first_failed_test(pytest_report_path):
-    failed_test_str = ''
-    try:
-        with open(pytest_report_path, 'r') as f:
-            pytest_report = json.load(f)
-
-        if len(pytest_report['tests']) != 0:
-            for key in pytest_report['tests']:
-                if key['outcome'] == 'failed':
-                    failed_test_str += key['nodeid'].split('::')[1] + ' -- ' + key['call']['crash']['message'] + '\n'
-                elif key['outcome'] == 'error':
-                    failed_test_str += key['nodeid'].split('::')[1] + ' -- ' + key['setup']['crash']['message'] + '\n'
-        else:
-            failed_test_str = 'Code is not executable'
-        
-        if failed_test_str == '':
-            failed_test_str = 'All tests passed'
-        return failed_test_str
-    except:
+    outcome = load_outcome(pytest_report_path)
+    if outcome is None:
         return None, None
+    return outcome.first_failed_str()
 
 def get_testsuite_feedback(task_path):
     feedback = ''
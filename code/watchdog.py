@@ -0,0 +1,61 @@
+import os
+import json
+import resource
+
+# Set for pytest processes started by execution_backend: write end of the supervisor's pipe, CPU seconds allowed
+# and the program whose executed lines are recorded (see line_coverage)
+WATCHDOG_FD_ENV = 'TEST_WATCHDOG_FD'
+CPU_LIMIT_ENV = 'TEST_CPU_LIMIT'
+COVERAGE_SOURCE_ENV = 'TEST_COVERAGE_SOURCE'
+
+def set_cpu_limit(seconds):
+    # SIGXCPU at the soft limit, SIGKILL a second later should the process catch it
+    resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+
+def longrepr_line(report):
+    return str(report.longrepr).strip().splitlines()[-1] if report.longrepr else ''
+
+class Watchdog:
+    """pytest plugin sending the progress of a session to the supervisor in execution_backend, one JSON line per event.
+
+    The supervisor knows from the events which test is running, so it can kill a session stuck in a test (even in C
+    code, which a signal cannot interrupt) and still has the outcomes of the tests that finished.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def send(self, event):
+        data = (json.dumps(event) + '\n').encode('utf-8')
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            self.send({'event': 'collecterror', 'nodeid': report.nodeid, 'message': longrepr_line(report)})
+
+    def pytest_collection_finish(self, session):
+        self.send({'event': 'collected', 'nodeids': [item.nodeid for item in session.items]})
+
+    def pytest_runtest_logstart(self, nodeid, location):
+        self.send({'event': 'start', 'nodeid': nodeid})
+
+    def pytest_runtest_logreport(self, report):
+        self.send({'event': 'report', 'nodeid': report.nodeid, 'when': report.when, 'outcome': report.outcome,
+                   'message': longrepr_line(report) if report.failed else None})
+
+    def pytest_runtest_logfinish(self, nodeid, location):
+        self.send({'event': 'finish', 'nodeid': nodeid})
+
+def pytest_configure(config):
+    # called through session_plugin/pytasksyn_watchdog in pytest processes started as subprocesses
+    fd = os.environ.get(WATCHDOG_FD_ENV)
+    if fd is None:
+        return
+    if os.environ.get(CPU_LIMIT_ENV):
+        set_cpu_limit(int(os.environ[CPU_LIMIT_ENV]))
+    watchdog = Watchdog(int(fd))
+    config.pluginmanager.register(watchdog, 'watchdog')
+    if os.environ.get(COVERAGE_SOURCE_ENV):
+        from .line_coverage import LineCoverage
+        config.pluginmanager.register(LineCoverage(os.environ[COVERAGE_SOURCE_ENV], watchdog.send), 'line_coverage')